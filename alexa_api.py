@@ -0,0 +1,112 @@
+"""Calls to the Alexa service APIs made while handling a request.
+
+KeepAliveApiClient replaces the SDK's DefaultApiClient, which goes through
+the module-level `requests` functions and so opens a new TLS connection for
+every call; here one requests.Session with a bounded connection pool is
+shared by all handlers.
+
+The profile email asked for by "Invia" is cached per user in the
+profile_emails table for PROFILE_EMAIL_TTL seconds (shared by all workers),
+so repeat senders skip the round trip to Amazon. The cache is only used
+while the request carries a consent token: a request without one (the user
+revoked the permission) drops the entry and fails like the API would. The
+entry is also dropped whenever a lookup fails. A changed address is picked
+up once the entry is PROFILE_EMAIL_TTL old. Digest subscriptions (digest.py)
+follow along: a freshly fetched address replaces the stored one and a
+request without consent cancels the subscription.
+"""
+import collections
+import functools
+import logging
+import os
+import threading
+
+import requests
+from ask_sdk_core.api_client import DefaultApiClient
+from ask_sdk_core.exceptions import ApiClientException
+
+import database
+import metrics
+
+logger = logging.getLogger(__name__)
+
+ALEXA_API_TIMEOUT = float(os.environ.get("ALEXA_API_TIMEOUT", 5))
+ALEXA_API_POOL_SIZE = int(os.environ.get("ALEXA_API_POOL_SIZE", 10))
+PROFILE_EMAIL_TTL = int(os.environ.get("PROFILE_EMAIL_TTL", 3600))
+
+_stats_lock = threading.Lock()
+_stats = collections.Counter()
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+class KeepAliveApiClient(DefaultApiClient):
+    """DefaultApiClient over one pooled requests.Session (HTTPS only, like the SDK client)."""
+
+    def __init__(self, session=None, timeout=ALEXA_API_TIMEOUT, pool_size=ALEXA_API_POOL_SIZE):
+        if session is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            session.mount("https://", adapter)
+        self.session = session
+        self.timeout = timeout
+
+    def _resolve_method(self, request):
+        method = getattr(self.session, (request.method or "").lower(), None)
+        if method is None or request.method.lower() not in ("get", "post", "put", "patch", "delete", "head"):
+            raise ApiClientException(f"Invalid request method: {request.method}")
+        return functools.partial(method, timeout=self.timeout)
+
+
+def has_consent(handler_input):
+    """Whether the request carries a consent token, i.e. the user still grants the email permission.
+
+    Email is the only permission the skill asks for, so any token means it is granted.
+    """
+    system = handler_input.request_envelope.context.system
+    user = system.user if system is not None else None
+    permissions = user.permissions if user is not None else None
+    return permissions is not None and bool(permissions.consent_token)
+
+
+def get_profile_email(handler_input):
+    """The user's profile email, from the cache or the Alexa API.
+
+    Raises PermissionError when the request carries no consent token, and
+    whatever UpsServiceClient.get_profile_email raises when the API call fails.
+    """
+    user_id = handler_input.request_envelope.session.user.user_id
+    if not has_consent(handler_input):
+        # Revoked (or never granted): forget the address rather than keep mailing it.
+        _count("invalidations")
+        database.delete_profile_email(user_id)
+        database.update_digest_email(user_id, None)
+        raise PermissionError("the email permission is not granted")
+    email = database.get_profile_email(user_id, PROFILE_EMAIL_TTL)
+    if email:
+        _count("hits")
+        return email
+
+    _count("misses")
+    ups_service = handler_input.service_client_factory.get_ups_service()
+    try:
+        with metrics.external_call_seconds.time("ups_profile_email"):
+            email = ups_service.get_profile_email()
+    except Exception:
+        # 401/403 (permission missing or revoked) or any other failure: never fall back to an old address.
+        _count("invalidations")
+        database.delete_profile_email(user_id)
+        raise
+    if email:
+        database.set_profile_email(user_id, email)
+        database.update_digest_email(user_id, email)
+    return email
+
+
+def stats():
+    """Profile email cache hits, misses and invalidations in this process."""
+    with _stats_lock:
+        return {name: _stats[name] for name in ("hits", "misses", "invalidations")}
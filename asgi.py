@@ -0,0 +1,137 @@
+"""ASGI entry point for serving the skill from an asyncio event loop.
+
+    pip install uvicorn
+    uvicorn asgi:app --host 0.0.0.0 --port 5000
+
+The handlers, verifiers and interceptors are the ones registered in main.py;
+each request is verified and dispatched exactly as the Flask route does it,
+but on a bounded thread pool (ASGI_WORKER_THREADS), so the SQLite calls, the
+Alexa profile API lookup and the group-commit wait block a pool thread
+instead of the whole process. Emails are already sent by the outbox workers
+off the request path. Requests beyond ASGI_MAX_IN_FLIGHT wait on the event
+loop rather than queueing unbounded work on the pool.
+
+With several uvicorn worker processes (--workers N or WEB_CONCURRENCY=N) the
+per-process memory cache would serve stale notes once another worker writes,
+so it is turned off as under gunicorn (cache.use_shared_backend_for); use
+CACHE_BACKEND=redis to cache across workers.
+"""
+import asyncio
+import concurrent.futures
+import json
+import logging
+import os
+import sys
+
+import cache
+import main
+import metrics
+
+logger = logging.getLogger(__name__)
+
+ASGI_WORKER_THREADS = int(os.environ.get("ASGI_WORKER_THREADS", 32))
+ASGI_MAX_IN_FLIGHT = int(os.environ.get("ASGI_MAX_IN_FLIGHT", 4 * ASGI_WORKER_THREADS))
+# Alexa request envelopes are a few KB; anything much larger is not from Alexa.
+ASGI_MAX_BODY = int(os.environ.get("ASGI_MAX_BODY", 256 * 1024))
+
+
+def _uvicorn_workers(argv=None):
+    """Worker processes uvicorn was started with: WEB_CONCURRENCY, or --workers in its command line."""
+    if os.environ.get("WEB_CONCURRENCY"):
+        return int(os.environ["WEB_CONCURRENCY"])
+    # uvicorn spawns its workers with the parent's sys.argv.
+    argv = sys.argv if argv is None else argv
+    if not argv or os.path.basename(argv[0]) != "uvicorn":
+        return 1
+    for i, arg in enumerate(argv):
+        if arg == "--workers" and i + 1 < len(argv):
+            return int(argv[i + 1])
+        if arg.startswith("--workers="):
+            return int(arg.split("=", 1)[1])
+    return 1
+
+
+ASGI_WORKERS = _uvicorn_workers()
+cache.use_shared_backend_for(ASGI_WORKERS)
+
+_executor = concurrent.futures.ThreadPoolExecutor(max_workers=ASGI_WORKER_THREADS, thread_name_prefix="skill")
+_in_flight = None
+
+
+async def _read_body(receive):
+    """The full request body, or None if it exceeds ASGI_MAX_BODY."""
+    chunks = []
+    size = 0
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return None
+        body = message.get("body", b"")
+        size += len(body)
+        if size > ASGI_MAX_BODY:
+            return None
+        chunks.append(body)
+        if not message.get("more_body", False):
+            return b"".join(chunks)
+
+
+async def _respond(send, status, body, content_type):
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", content_type.encode("latin-1")),
+                    (b"content-length", str(len(body)).encode("latin-1"))],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _invoke_skill(scope, receive, send):
+    global _in_flight
+    body = await _read_body(receive)
+    if body is None:
+        await _respond(send, 413, b"Request Entity Too Large", "text/plain")
+        return
+    headers = {key.decode("latin-1"): value.decode("latin-1") for key, value in scope["headers"]}
+
+    if _in_flight is None:
+        _in_flight = asyncio.Semaphore(ASGI_MAX_IN_FLIGHT)
+    async with _in_flight:
+        loop = asyncio.get_running_loop()
+        try:
+            envelope = await loop.run_in_executor(_executor, main.dispatch_skill_request, headers, body)
+        except Exception as e:
+            # Same outcome as an exception escaping the Flask route.
+            logger.error(f"Skill request failed: {e}", exc_info=True)
+            await _respond(send, 500, b"Internal Server Error", "text/plain")
+            return
+    await _respond(send, 200, json.dumps(envelope).encode("utf-8"), "application/json")
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            _executor.shutdown(wait=True)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    """ASGI application: POST / for the skill, GET /metrics when enabled."""
+    if scope["type"] == "lifespan":
+        await _lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+
+    path, method = scope["path"], scope["method"]
+    if path == "/" and method == "POST":
+        await _invoke_skill(scope, receive, send)
+    elif path == "/metrics" and method == "GET" and metrics.METRICS_ENABLED:
+        await _respond(send, 200, metrics.render().encode("utf-8"), "text/plain; version=0.0.4")
+    elif path == "/" or (path == "/metrics" and metrics.METRICS_ENABLED):
+        await _respond(send, 405, b"Method Not Allowed", "text/plain")
+    else:
+        await _respond(send, 404, b"Not Found", "text/plain")
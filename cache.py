@@ -0,0 +1,227 @@
+"""Per-user read-through cache in front of the database module.
+
+Entries are grouped by user_id so that a write for a user (save_note,
+set_retention_days, retention cleanup) drops everything cached for that user
+with one call. Backends:
+
+    memory  per-process LRU with TTL and a bound on cached users (default)
+    redis   shared by all gunicorn workers, so an invalidation in one worker
+            is seen by the others (needs the `redis` package)
+    none    caching disabled
+
+The memory backend is only coherent within one process, so under gunicorn
+or uvicorn with more than one worker it is replaced by none (see
+use_shared_backend_for); use CACHE_BACKEND=redis to cache there.
+"""
+import collections
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+CACHE_BACKEND = os.environ.get("CACHE_BACKEND", "memory").lower()
+CACHE_TTL = float(os.environ.get("CACHE_TTL", 30))
+CACHE_MAX_USERS = int(os.environ.get("CACHE_MAX_USERS", 10000))
+CACHE_REDIS_URL = os.environ.get("CACHE_REDIS_URL", "redis://localhost:6379/0")
+
+_MISSING = object()
+
+
+class _Stats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = collections.Counter()
+
+    def incr(self, name):
+        with self._lock:
+            self._counts[name] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {name: self._counts[name] for name in ("hits", "misses", "evictions", "expirations", "invalidations")}
+
+
+class NullCache:
+    """Backend used when caching is disabled: every lookup misses."""
+
+    def __init__(self):
+        self.stats = _Stats()
+
+    def read_through(self, user_id, key, loader):
+        self.stats.incr("misses")
+        return loader()
+
+    def invalidate(self, user_id):
+        pass
+
+    def clear(self):
+        pass
+
+
+class MemoryCache:
+    """LRU over users; each user holds a few keyed values that expire after `ttl` seconds."""
+
+    def __init__(self, max_users=CACHE_MAX_USERS, ttl=CACHE_TTL):
+        self.max_users = max_users
+        self.ttl = ttl
+        self.stats = _Stats()
+        self._lock = threading.Lock()
+        # user_id -> [generation, {key: (value, expires_at)}]
+        self._users = collections.OrderedDict()
+
+    def _lookup(self, user_id, key):
+        """Return (value or _MISSING, generation). Caller holds the lock."""
+        entry = self._users.get(user_id)
+        if entry is None:
+            return _MISSING, 0
+        self._users.move_to_end(user_id)
+        cached = entry[1].get(key)
+        if cached is None:
+            return _MISSING, entry[0]
+        value, expires_at = cached
+        if expires_at < time.monotonic():
+            del entry[1][key]
+            self.stats.incr("expirations")
+            return _MISSING, entry[0]
+        return value, entry[0]
+
+    def read_through(self, user_id, key, loader):
+        with self._lock:
+            value, generation = self._lookup(user_id, key)
+        if value is not _MISSING:
+            self.stats.incr("hits")
+            return value
+
+        self.stats.incr("misses")
+        value = loader()
+        with self._lock:
+            entry = self._users.get(user_id)
+            if entry is None:
+                if generation != 0:
+                    # Evicted while loading: don't cache a possibly stale value.
+                    return value
+                entry = self._users[user_id] = [0, {}]
+                while len(self._users) > self.max_users:
+                    self._users.popitem(last=False)
+                    self.stats.incr("evictions")
+            elif entry[0] != generation:
+                # A write invalidated this user while we were loading.
+                return value
+            entry[1][key] = (value, time.monotonic() + self.ttl)
+        return value
+
+    def invalidate(self, user_id):
+        with self._lock:
+            entry = self._users.get(user_id)
+            if entry is None:
+                # Record the write even for uncached users so a load already in flight is not stored.
+                self._users[user_id] = [1, {}]
+                while len(self._users) > self.max_users:
+                    self._users.popitem(last=False)
+                    self.stats.incr("evictions")
+            else:
+                # Keep the entry with a new generation so in-flight loads cannot repopulate it.
+                entry[0] += 1
+                entry[1].clear()
+        self.stats.incr("invalidations")
+
+    def clear(self):
+        with self._lock:
+            self._users.clear()
+
+
+class RedisCache:
+    """Cache shared across processes: one Redis hash per user, expiring after `ttl` seconds.
+
+    Like MemoryCache, each user has a generation (a counter key bumped by
+    invalidate); a loaded value is only stored if the generation it was read
+    under is still current, checked with WATCH so a racing write always wins.
+    """
+
+    # Generation keys outlive any load by far; one that expired reads as changed.
+    GENERATION_TTL = 3600
+
+    def __init__(self, url=CACHE_REDIS_URL, ttl=CACHE_TTL, prefix="blocco-note:cache:"):
+        import redis  # optional dependency, only needed for this backend
+
+        self.client = redis.Redis.from_url(url)
+        self.ttl = int(ttl)
+        self.prefix = prefix
+        self.stats = _Stats()
+        self._watch_error = redis.WatchError
+
+    def read_through(self, user_id, key, loader):
+        name = self.prefix + user_id
+        generation_name = self.prefix + "gen:" + user_id
+        pipe = self.client.pipeline(transaction=False)
+        pipe.hget(name, key)
+        pipe.get(generation_name)
+        raw, generation = pipe.execute()
+        if raw is not None:
+            self.stats.incr("hits")
+            return json.loads(raw)
+
+        self.stats.incr("misses")
+        value = loader()
+        with self.client.pipeline() as pipe:
+            try:
+                pipe.watch(generation_name)
+                if pipe.get(generation_name) != generation:
+                    # A write invalidated this user while we were loading.
+                    return value
+                pipe.multi()
+                pipe.hset(name, key, json.dumps(value))
+                pipe.expire(name, self.ttl)
+                pipe.execute()
+            except self._watch_error:
+                pass
+        return value
+
+    def invalidate(self, user_id):
+        pipe = self.client.pipeline()
+        pipe.incr(self.prefix + "gen:" + user_id)
+        pipe.expire(self.prefix + "gen:" + user_id, self.GENERATION_TTL)
+        pipe.delete(self.prefix + user_id)
+        pipe.execute()
+        self.stats.incr("invalidations")
+
+    def clear(self):
+        for name in self.client.scan_iter(self.prefix + "*"):
+            self.client.delete(name)
+
+
+def create_cache(backend=CACHE_BACKEND):
+    """Build the cache backend named by CACHE_BACKEND."""
+    if backend == "none":
+        return NullCache()
+    if backend == "redis":
+        return RedisCache()
+    if backend != "memory":
+        logger.warning(f"Unknown CACHE_BACKEND '{backend}', using memory")
+    return MemoryCache()
+
+
+user_cache = create_cache()
+
+
+def use_shared_backend_for(workers):
+    """Drop the per-process memory cache when `workers` processes serve requests.
+
+    Each worker would otherwise keep serving a user's old notes after another
+    worker saved a new one, until CACHE_TTL. Called in each worker by
+    gunicorn.conf.py and, under uvicorn, by asgi.py; redis and none are left
+    as they are.
+    """
+    global user_cache
+    if workers > 1 and isinstance(user_cache, MemoryCache):
+        logger.warning(f"CACHE_BACKEND=memory is per process and {workers} workers are running: "
+                       f"caching disabled (use CACHE_BACKEND=redis to cache across workers)")
+        user_cache = NullCache()
+
+
+def stats():
+    """Hit/miss/eviction/expiration/invalidation counters for this process."""
+    return user_cache.stats.snapshot()
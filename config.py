@@ -0,0 +1,168 @@
+"""Skill settings, read from the environment and validated once at startup.
+
+SkillConfig.from_env() collects every MSG_* text (spoken and emailed),
+DATE_FORMAT and the numeric and boolean settings main.py needs, converts
+them to their types and reports every bad value in a single ConfigError, so
+a typo in the environment stops the process at boot instead of surfacing as
+a failed request later. Message templates that are filled in with
+str.format are checked for their placeholders too. get() returns the
+process-wide instance that main.py, rendering, export and digest read.
+"""
+import os
+import string
+import time
+
+# Spoken texts, overridable one by one through environment variables of the same name.
+MESSAGES = {
+    "MSG_LAUNCH": "Ciao, cosa vuoi fare? Scrivi, Rileggi, Invia o Chiudi?",
+    "MSG_MENU_FULL": "Cosa vuoi fare ora? Scrivi, Rileggi, Invia o Chiudi?",
+    "MSG_MENU_SHORT": "Cosa vuoi fare?",
+    "MSG_START_WRITING": "Dimmi pure.",
+    "MSG_NOTE_RECEIVED": "Ricevuto. Altro?",
+    "MSG_NOTE_SAVED": "Salvato. Cosa vuoi fare ora? Scrivi, Rileggi, Invia o Chiudi?",
+    "MSG_NOTHING_SAID": "Non hai detto nulla. Cosa vuoi fare ora?",
+    "MSG_NOT_WRITING": "Non stavo scrivendo. Cosa vuoi fare? Scrivi, Rileggi, Invia o Chiudi?",
+    "MSG_PENDING_NOTE": "Hai una nota in sospeso. Di 'Fine' per salvarla, o continua a dettare.",
+    "MSG_PENDING_NOTE_SEND": "Hai una nota in sospeso. Di 'Fine' per salvarla prima di inviare.",
+    "MSG_WRITING_IN_PROGRESS": "Stai scrivendo. Di 'Fine' quando hai finito.",
+    "MSG_NO_NOTES": "Non hai ancora salvato nessuna nota. Cosa vuoi fare?",
+    "MSG_READ_NOTES_PREFIX": "Ecco le tue ultime note: ",
+    "MSG_READ_MORE_PREFIX": "Ecco altre note: ",
+    "MSG_READ_MORE_PROMPT": "Di 'Avanti' per sentire le note precedenti, o 'Indietro' per tornare a quelle di prima.",
+    "MSG_NO_MORE_NOTES": "Non ci sono altre note. Cosa vuoi fare?",
+    "MSG_SEARCH_ASK": "Cosa vuoi cercare nelle tue note?",
+    "MSG_SEARCH_RESULTS_PREFIX": "Ho trovato: ",
+    "MSG_NO_SEARCH_RESULTS": "Non ho trovato note su {query}. Cosa vuoi fare?",
+    "MSG_NO_PREVIOUS_NOTES": "Sei già all'inizio delle note. Cosa vuoi fare?",
+    "MSG_EMAIL_SENT": "Email inviata. Cosa vuoi fare ora? Scrivi, Rileggi, Invia o Chiudi?",
+    "MSG_EMAIL_PERMISSION": "Per inviare le note, ho bisogno del permesso di accedere alla tua email. Ho inviato una scheda alla tua app Alexa. Per favore abilita i permessi nelle impostazioni.",
+    "MSG_EMAIL_NOT_FOUND": "Non riesco a trovare il tuo indirizzo email. Controlla le impostazioni.",
+    "MSG_NO_NOTES_TO_SEND": "Non ci sono note da inviare.",
+    "MSG_EMAIL_ERROR": "C'è stato un errore nell'invio dell'email.",
+    "MSG_HELP": "Puoi dirmi di scrivere una nota o di rileggere le tue note. Cosa vuoi fare?",
+    "MSG_NOT_UNDERSTOOD": "Non ho capito. Vuoi scrivere, rileggere o inviare?",
+    "MSG_GOODBYE": "Arrivederci!",
+    "MSG_ERROR": "Scusa, ho avuto un problema. Riprova.",
+    "MSG_SMTP_CONFIG_ERROR": "Errore di configurazione del server email.",
+    "MSG_RETENTION_SET": "Ho impostato la scadenza a {days} giorni.",
+    "MSG_RETENTION_INVALID": "Le note vanno conservate almeno un giorno. Per quanti giorni vuoi conservarle?",
+    "MSG_CLEANUP_DONE": "Ho cancellato {count} vecchie note.",
+    "MSG_DIGEST_ASK": "Vuoi il riepilogo delle nuove note ogni giorno, ogni settimana, o vuoi disattivarlo?",
+    "MSG_DIGEST_DAILY_SET": "Fatto. Ogni giorno ti invierò per email le note nuove.",
+    "MSG_DIGEST_WEEKLY_SET": "Fatto. Ogni settimana ti invierò per email le note nuove.",
+    "MSG_DIGEST_OFF": "Ho disattivato il riepilogo via email.",
+    # Note lines read back by "Rileggi" and "Cerca" (rendering.py)
+    "MSG_NOTE_FORMAT": "Nota {num} del {date}: {content}",
+    # Notes export email (export.py)
+    "MSG_EMAIL_SUBJECT": "Le tue note Alexa",
+    "MSG_EMAIL_BODY_PREFIX": "Ecco le tue note:\n\n",
+    "MSG_EMAIL_PART_SUFFIX": " (parte {part})",
+    # Digest email (digest.py)
+    "MSG_DIGEST_SUBJECT": "Le tue nuove note Alexa ({count})",
+    "MSG_DIGEST_BODY_PREFIX": "Ecco le note che hai salvato dall'ultimo riepilogo:\n\n",
+    "MSG_DIGEST_MORE": "\n\nLe altre note arriveranno con il prossimo riepilogo.",
+}
+
+# Placeholders each formatted message is filled in with.
+MESSAGE_FIELDS = {
+    "MSG_NO_SEARCH_RESULTS": {"query"},
+    "MSG_RETENTION_SET": {"days"},
+    "MSG_CLEANUP_DONE": {"count"},
+    "MSG_NOTE_FORMAT": {"num", "date", "content"},
+    "MSG_EMAIL_PART_SUFFIX": {"part"},
+    "MSG_DIGEST_SUBJECT": {"count"},
+}
+
+_TRUE = {"true", "1", "yes"}
+_FALSE = {"false", "0", "no"}
+
+
+class ConfigError(ValueError):
+    """One or more settings in the environment are invalid."""
+
+
+class SkillConfig:
+    """Settings for the skill and its jobs, typed and validated."""
+
+    def __init__(self, messages, date_format, read_page_size, search_results_limit, verify_signature,
+                 start_background_tasks):
+        self.messages = messages
+        self.date_format = date_format
+        self.read_page_size = read_page_size
+        self.search_results_limit = search_results_limit
+        self.verify_signature = verify_signature
+        self.start_background_tasks = start_background_tasks
+
+    @classmethod
+    def from_env(cls, environ=os.environ):
+        errors = []
+
+        def integer(name, default, minimum=1):
+            raw = environ.get(name, "").strip()
+            if not raw:
+                return default
+            try:
+                value = int(raw)
+            except ValueError:
+                value = None
+            if value is None or value < minimum:
+                errors.append(f"{name}={raw!r} is not an integer >= {minimum}")
+                return default
+            return value
+
+        def boolean(name, default):
+            raw = environ.get(name, "").strip()
+            if not raw:
+                return default
+            if raw.lower() not in _TRUE | _FALSE:
+                errors.append(f"{name}={raw!r} is not one of true/false, 1/0, yes/no")
+                return default
+            return raw.lower() in _TRUE
+
+        messages = {name: environ.get(name, default) for name, default in MESSAGES.items()}
+        for name, text in messages.items():
+            if not text.strip():
+                errors.append(f"{name} is empty")
+            elif name in MESSAGE_FIELDS:
+                try:
+                    fields = {field for _, field, _, _ in string.Formatter().parse(text) if field is not None}
+                except ValueError as e:
+                    errors.append(f"{name} is not a valid template: {e}")
+                    continue
+                if not fields <= MESSAGE_FIELDS[name]:
+                    errors.append(f"{name} uses {sorted(fields - MESSAGE_FIELDS[name])}; "
+                                  f"only {sorted(MESSAGE_FIELDS[name])} are filled in")
+
+        # Dates in read-back and email lines (time.strftime, UTC)
+        date_format = environ.get("DATE_FORMAT", "%d/%m/%Y %H:%M")
+        try:
+            if not time.strftime(date_format, time.gmtime(0)).strip():
+                errors.append(f"DATE_FORMAT={date_format!r} renders an empty date")
+        except ValueError as e:
+            errors.append(f"DATE_FORMAT={date_format!r} is not a valid strftime format: {e}")
+
+        config = cls(
+            messages=messages,
+            date_format=date_format,
+            # Notes read per page by "Rileggi" / "Avanti" / "Indietro"
+            read_page_size=integer("READ_PAGE_SIZE", 5),
+            # Best matches read by "Cerca"
+            search_results_limit=integer("SEARCH_RESULTS_LIMIT", 3),
+            verify_signature=boolean("VERIFY_SIGNATURE", True),
+            # gunicorn.conf.py turns this off and starts them in each worker after the fork
+            start_background_tasks=boolean("START_BACKGROUND_TASKS", True),
+        )
+        if errors:
+            raise ConfigError("Invalid configuration: " + "; ".join(errors))
+        return config
+
+
+_config = None
+
+
+def get():
+    """The SkillConfig for this process, read from the environment and validated on first use."""
+    global _config
+    if _config is None:
+        _config = SkillConfig.from_env()
+    return _config
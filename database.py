@@ -1,13 +1,175 @@
+import calendar
+import logging
 import sqlite3
 import os
+import re
+import threading
+import time
+import unicodedata
+import zlib
 
-DB_NAME = "notes.db"
+import cache
 
-def init_db():
-    """Initialize the database with the notes table."""
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute('''
+logger = logging.getLogger(__name__)
+
+# sqlite: the local file DB_NAME (one host). postgres: DATABASE_URL, shared by
+# every host behind the load balancer (needs psycopg2, see postgres_backend.py).
+DB_BACKEND = os.environ.get("DB_BACKEND", "sqlite").lower()
+DB_NAME = os.environ.get("DB_NAME", "notes.db")
+
+# Connection tuning. WAL lets readers proceed while a writer commits, and
+# synchronous=NORMAL is durable across application crashes in WAL mode.
+DB_BUSY_TIMEOUT_MS = int(os.environ.get("DB_BUSY_TIMEOUT_MS", 5000))
+DB_CACHE_SIZE_KB = int(os.environ.get("DB_CACHE_SIZE_KB", 16384))
+DB_MMAP_SIZE = int(os.environ.get("DB_MMAP_SIZE", 268435456))
+DB_STATEMENT_CACHE = int(os.environ.get("DB_STATEMENT_CACHE", 128))
+SEARCH_CANDIDATES = int(os.environ.get("SEARCH_CANDIDATES", 200))
+
+# Note bodies of at least this many UTF-8 bytes are stored deflated (see _pack_note).
+NOTE_COMPRESS_MIN_BYTES = int(os.environ.get("NOTE_COMPRESS_MIN_BYTES", 200))
+
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}",
+    f"PRAGMA cache_size=-{DB_CACHE_SIZE_KB}",
+    f"PRAGMA mmap_size={DB_MMAP_SIZE}",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA foreign_keys=ON",
+)
+
+# One connection per (process, thread). Gunicorn forks workers after import,
+# so the pid is part of the key and a forked child never reuses its parent's handle.
+_local = threading.local()
+_connections = {}
+_connections_lock = threading.Lock()
+# users.id by (DB_NAME, user_id). Keys never change once committed, so every thread shares them.
+_user_keys = {}
+
+
+def _connect():
+    """Open a new tuned connection to DB_NAME."""
+    new_file = not os.path.exists(DB_NAME) or os.path.getsize(DB_NAME) == 0
+    conn = sqlite3.connect(
+        DB_NAME,
+        timeout=DB_BUSY_TIMEOUT_MS / 1000,
+        cached_statements=DB_STATEMENT_CACHE,
+        check_same_thread=False,
+    )
+    if new_file:
+        # Only takes effect before the file's header is written, which journal_mode=WAL does.
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    # The full-text triggers index note_text(content), which may be a compressed blob.
+    conn.create_function("note_text", 1, _note_text, deterministic=True)
+    return conn
+
+
+def get_connection():
+    """Return the pooled connection for the current thread, opening it if needed."""
+    key = (os.getpid(), DB_NAME)
+    conn = getattr(_local, "conn", None)
+    if conn is not None and getattr(_local, "key", None) == key:
+        return conn
+
+    if conn is not None:
+        # DB_NAME changed (or we were forked): retire the stale handle.
+        _discard(_local.key, threading.get_ident())
+
+    conn = _connect()
+    _local.conn = conn
+    _local.key = key
+    with _connections_lock:
+        _prune_dead_threads()
+        _connections[(key, threading.get_ident())] = conn
+    return conn
+
+
+def _discard(key, ident):
+    with _connections_lock:
+        conn = _connections.pop((key, ident), None)
+    if conn is not None and key[0] == os.getpid():
+        conn.close()
+
+
+def _prune_dead_threads():
+    """Close connections whose owning thread has exited. Caller holds _connections_lock."""
+    alive = {t.ident for t in threading.enumerate()}
+    for (key, ident) in [k for k in _connections if k[1] not in alive]:
+        conn = _connections.pop((key, ident))
+        if key[0] == os.getpid():
+            conn.close()
+
+
+def close_connections():
+    """Close every pooled connection owned by this process (e.g. at shutdown or after DB_NAME changes)."""
+    pid = os.getpid()
+    with _connections_lock:
+        for (key, ident), conn in list(_connections.items()):
+            if key[0] != pid:
+                # Inherited from the parent across fork: drop the reference without touching it.
+                del _connections[(key, ident)]
+                continue
+            conn.close()
+            del _connections[(key, ident)]
+    _local.conn = None
+    _local.key = None
+    _user_keys.clear()
+
+
+# Deflate preset dictionary for note bodies: words and phrases common in
+# dictated notes, most frequent last. Short notes share few repeats with
+# themselves, so most of the saving comes from here. A stored blob names its
+# dictionary in the first byte; never edit a shipped one, add a new entry.
+_NOTE_DICTIONARIES = {
+    1: (
+        "grazie ciao buongiorno buonasera per favore settimana prossima mese prossimo entro venerdi "
+        "sabato domenica gennaio febbraio marzo aprile maggio giugno luglio agosto settembre ottobre "
+        "novembre dicembre mattina pomeriggio sera stasera stamattina oggi pomeriggio ieri dopodomani "
+        "appuntamento dal dentista dal medico dal dottore in farmacia in banca in posta al supermercato "
+        "dal meccanico in palestra in ufficio a scuola all'aeroporto alla stazione "
+        "scadenza bolletta della luce del gas dell'acqua del telefono affitto condominio assicurazione "
+        "dell'auto revisione tagliando bollo tasse rata del mutuo carta di credito conto corrente "
+        "compleanno di anniversario regalo per la festa cena con pranzo con colazione con "
+        "telefonare a chiamare il chiamare la scrivere a mandare una email a rispondere a prenotare il "
+        "prenotare un tavolo volo treno albergo biglietti per il ritirare il pacco portare la macchina "
+        "pagare la pagare il comprare il comprare la comprare le comprare i lista della spesa "
+        "latte pane uova burro frutta verdura pasta riso acqua caffe zucchero olio carne pesce "
+        "formaggio detersivo sapone carta igienica medicine "
+        "mamma papa nonna nonno figli bambini marito moglie fratello sorella amici collega capo "
+        "riunione alle ore nove alle dieci alle undici a mezzogiorno alle due alle tre alle quattro "
+        "alle cinque alle sei alle sette alle otto lunedi martedi mercoledi giovedi venerdi "
+        "non dimenticare di ricordati di ricordarsi di ricordarmi di devo che cosa perche quando "
+        "domani mattina domani sera la prossima volta di nuovo anche ancora subito dopo prima "
+        "della delle degli dello nella nelle negli sulla sulle con il con la per il per la "
+        "e il e la di un di una che non per con del dei una un il la le i gli di a da in "
+    ).encode("utf-8"),
+}
+_NOTE_FORMAT = 1
+
+
+def _pack_note(text):
+    """Storage form of a note body: the str itself, or a deflated blob when that is smaller."""
+    raw = text.encode("utf-8")
+    if len(raw) < NOTE_COMPRESS_MIN_BYTES:
+        return text
+    deflate = zlib.compressobj(9, zlib.DEFLATED, -15, zdict=_NOTE_DICTIONARIES[_NOTE_FORMAT])
+    packed = bytes((_NOTE_FORMAT,)) + deflate.compress(raw) + deflate.flush()
+    return packed if len(packed) < len(raw) else text
+
+
+def _note_text(value):
+    """Inverse of _pack_note; also registered in SQL as note_text()."""
+    if not isinstance(value, bytes):
+        return value
+    inflate = zlib.decompressobj(-15, zdict=_NOTE_DICTIONARIES[value[0]])
+    return (inflate.decompress(value[1:]) + inflate.flush()).decode("utf-8")
+
+
+def _migration_1(conn):
+    """Base schema: notes and per-user settings."""
+    conn.execute('''
         CREATE TABLE IF NOT EXISTS notes (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             content TEXT NOT NULL,
@@ -15,69 +177,1160 @@ def init_db():
             user_id TEXT
         )
     ''')
-    c.execute('''
+    conn.execute('''
         CREATE TABLE IF NOT EXISTS user_settings (
             user_id TEXT PRIMARY KEY,
             retention_days INTEGER NOT NULL
         )
     ''')
-    conn.commit()
-    conn.close()
+
+def _migration_2(conn):
+    """Store timestamps as integer epoch seconds and index notes by (user_id, timestamp)."""
+    conn.execute('''
+        CREATE TABLE notes_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            content TEXT NOT NULL,
+            timestamp INTEGER NOT NULL DEFAULT (CAST(strftime('%s', 'now') AS INTEGER)),
+            user_id TEXT
+        )
+    ''')
+    # Old rows hold 'YYYY-MM-DD HH:MM:SS' UTC strings from CURRENT_TIMESTAMP.
+    conn.execute('''
+        INSERT INTO notes_new (id, content, timestamp, user_id)
+        SELECT id, content,
+               COALESCE(CAST(strftime('%s', timestamp) AS INTEGER), CAST(strftime('%s', 'now') AS INTEGER)),
+               user_id
+        FROM notes
+    ''')
+    conn.execute('DROP TABLE notes')
+    conn.execute('ALTER TABLE notes_new RENAME TO notes')
+    conn.execute('CREATE INDEX idx_notes_user_ts ON notes (user_id, timestamp DESC, id DESC)')
+
+def _migration_3(conn):
+    """Single-row bookmark so the background retention sweep can resume where it stopped."""
+    conn.execute('''
+        CREATE TABLE retention_progress (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            last_user_id TEXT,
+            sweep_started_at INTEGER,
+            sweep_finished_at INTEGER,
+            lease_owner TEXT,
+            lease_until INTEGER
+        )
+    ''')
+    conn.execute('INSERT INTO retention_progress (id) VALUES (1)')
+
+def _migration_4(conn):
+    """Durable outbox for emails delivered by the outbox worker pool."""
+    conn.execute('''
+        CREATE TABLE email_outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id TEXT,
+            recipient TEXT NOT NULL,
+            subject TEXT NOT NULL,
+            body TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at INTEGER NOT NULL,
+            last_error TEXT,
+            created_at INTEGER NOT NULL,
+            updated_at INTEGER NOT NULL
+        )
+    ''')
+    conn.execute('CREATE INDEX idx_outbox_due ON email_outbox (status, next_attempt_at)')
+
+def _migration_5(conn):
+    """Outbox entries can be a rendered message or a notes export streamed at delivery time."""
+    conn.execute("ALTER TABLE email_outbox ADD COLUMN kind TEXT NOT NULL DEFAULT 'message'")
+    # Export parts already delivered, so a retry resumes instead of resending them.
+    conn.execute('ALTER TABLE email_outbox ADD COLUMN parts_sent INTEGER NOT NULL DEFAULT 0')
+
+def _migration_6(conn):
+    """Server-side dictation drafts, appended one fragment per utterance."""
+    conn.execute('''
+        CREATE TABLE drafts (
+            draft_id TEXT PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            updated_at INTEGER NOT NULL
+        )
+    ''')
+    conn.execute('CREATE INDEX idx_drafts_updated ON drafts (updated_at)')
+    conn.execute('''
+        CREATE TABLE draft_fragments (
+            id INTEGER PRIMARY KEY,
+            draft_id TEXT NOT NULL REFERENCES drafts (draft_id) ON DELETE CASCADE,
+            fragment TEXT NOT NULL
+        )
+    ''')
+    conn.execute('CREATE INDEX idx_draft_fragments_draft ON draft_fragments (draft_id, id)')
+
+def _migration_7(conn):
+    """Profile email addresses fetched from the Alexa API, reused until they are PROFILE_EMAIL_TTL old."""
+    conn.execute('''
+        CREATE TABLE profile_emails (
+            user_id TEXT PRIMARY KEY,
+            email TEXT NOT NULL,
+            fetched_at INTEGER NOT NULL
+        )
+    ''')
+
+def _migration_8(conn):
+    """Full-text index over notes, kept in sync with triggers.
+
+    Contentless FTS5 table: the text is stored once, in notes. Each row also
+    indexes an owner token ('u' + hex of the user_id, one token per user), so
+    a search is restricted to one user inside the MATCH instead of ranking
+    every user's matches first.
+    """
+    conn.execute('''
+        CREATE VIRTUAL TABLE notes_fts USING fts5 (
+            content, owner,
+            content='', tokenize='unicode61 remove_diacritics 2'
+        )
+    ''')
+    conn.execute('''
+        CREATE TRIGGER notes_fts_insert AFTER INSERT ON notes BEGIN
+            INSERT INTO notes_fts (rowid, content, owner) VALUES (new.id, new.content, 'u' || hex(new.user_id));
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER notes_fts_delete AFTER DELETE ON notes BEGIN
+            INSERT INTO notes_fts (notes_fts, rowid, content, owner) VALUES ('delete', old.id, old.content, 'u' || hex(old.user_id));
+        END
+    ''')
+    conn.execute('''
+        CREATE TRIGGER notes_fts_update AFTER UPDATE OF content, user_id ON notes BEGIN
+            INSERT INTO notes_fts (notes_fts, rowid, content, owner) VALUES ('delete', old.id, old.content, 'u' || hex(old.user_id));
+            INSERT INTO notes_fts (rowid, content, owner) VALUES (new.id, new.content, 'u' || hex(new.user_id));
+        END
+    ''')
+    conn.execute("INSERT INTO notes_fts (rowid, content, owner) SELECT id, content, 'u' || hex(user_id) FROM notes")
+
+# Since migration 9, notes live in one table per UTC month (notes_YYYYMM), each
+# with its own full-text index (notes_fts_YYYYMM), and the `notes` view unions
+# them for reads. Expiring a month is a DROP TABLE instead of a row-by-row
+# DELETE. Ids come from note_id_seq, so they stay unique across partitions.
+_PARTITION_GLOB = 'notes_[0-9][0-9][0-9][0-9][0-9][0-9]'
+
+def _partition_for(ts):
+    """Name of the partition holding notes stamped `ts` (epoch seconds, UTC)."""
+    day = time.gmtime(ts)
+    return f"notes_{day.tm_year:04d}{day.tm_mon:02d}"
+
+def _partition_bounds(name):
+    """(first, last + 1) epoch second covered by a partition."""
+    year, month = int(name[-6:-2]), int(name[-2:])
+    start = calendar.timegm((year, month, 1, 0, 0, 0))
+    end = calendar.timegm((year + month // 12, month % 12 + 1, 1, 0, 0, 0))
+    return start, end
+
+def _list_partitions(conn):
+    """Partition table names, oldest month first."""
+    return [row[0] for row in conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name GLOB ? ORDER BY name", (_PARTITION_GLOB,))]
+
+def _create_partition_v9(conn, name):
+    """Create one month's table (schema 9 layout), index, FTS table and triggers. Caller holds the write lock and refreshes the view."""
+    fts = name.replace("notes_", "notes_fts_")
+    conn.execute(f'''
+        CREATE TABLE {name} (
+            id INTEGER PRIMARY KEY,
+            content TEXT NOT NULL,
+            timestamp INTEGER NOT NULL,
+            user_id TEXT
+        )
+    ''')
+    conn.execute(f'CREATE INDEX idx_{name}_user_ts ON {name} (user_id, timestamp DESC, id DESC)')
+    conn.execute(f'''
+        CREATE VIRTUAL TABLE {fts} USING fts5 (
+            content, owner,
+            content='', tokenize='unicode61 remove_diacritics 2'
+        )
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER {fts}_insert AFTER INSERT ON {name} BEGIN
+            INSERT INTO {fts} (rowid, content, owner) VALUES (new.id, new.content, 'u' || hex(new.user_id));
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER {fts}_delete AFTER DELETE ON {name} BEGIN
+            INSERT INTO {fts} ({fts}, rowid, content, owner) VALUES ('delete', old.id, old.content, 'u' || hex(old.user_id));
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER {fts}_update AFTER UPDATE OF content, user_id ON {name} BEGIN
+            INSERT INTO {fts} ({fts}, rowid, content, owner) VALUES ('delete', old.id, old.content, 'u' || hex(old.user_id));
+            INSERT INTO {fts} (rowid, content, owner) VALUES (new.id, new.content, 'u' || hex(new.user_id));
+        END
+    ''')
+
+def _drop_partition(conn, name):
+    """Drop one month's notes and FTS index (triggers go with the table). Caller refreshes the view."""
+    conn.execute(f'DROP TABLE {name}')
+    conn.execute(f'DROP TABLE {name.replace("notes_", "notes_fts_")}')
+
+def _refresh_notes_view_v9(conn):
+    """Recreate the schema 9 `notes` view over the current partitions (always at least the current month)."""
+    partitions = _list_partitions(conn)
+    if not partitions:
+        partitions = [_partition_for(time.time())]
+        _create_partition_v9(conn, partitions[0])
+    conn.execute('DROP VIEW IF EXISTS notes')
+    conn.execute('CREATE VIEW notes AS ' + ' UNION ALL '.join(
+        f'SELECT id, content, timestamp, user_id FROM {name}' for name in partitions))
+
+def _migration_9(conn):
+    """Partition notes by month behind a `notes` view (see _partition_for)."""
+    conn.execute('CREATE TABLE note_id_seq (id INTEGER PRIMARY KEY CHECK (id = 1), next_id INTEGER NOT NULL)')
+    conn.execute('INSERT INTO note_id_seq (id, next_id) SELECT 1, COALESCE(MAX(id), 0) + 1 FROM notes')
+    months = conn.execute("SELECT DISTINCT strftime('%Y%m', timestamp, 'unixepoch') FROM notes").fetchall()
+    for (month,) in months:
+        name = f"notes_{month}"
+        start, end = _partition_bounds(name)
+        _create_partition_v9(conn, name)
+        conn.execute(f'INSERT INTO {name} (id, content, timestamp, user_id) SELECT id, content, timestamp, user_id '
+                     f'FROM notes WHERE timestamp >= ? AND timestamp < ?', (start, end))
+    conn.execute('DROP TABLE notes_fts')
+    conn.execute('DROP TABLE notes')
+    _refresh_notes_view_v9(conn)
+
+# Since migration 10, a partition stores a small integer user_key (users.id)
+# instead of repeating the long Alexa user id on every row and in the index,
+# and content holds _pack_note output: TEXT, or a deflated BLOB for long
+# notes. content is the last column, so index-driven scans that only need
+# the key and timestamp never step into overflow pages.
+def _create_partition(conn, name):
+    """Create one month's table, index, FTS table and triggers. Caller holds the write lock and refreshes the view."""
+    fts = name.replace("notes_", "notes_fts_")
+    conn.execute(f'''
+        CREATE TABLE {name} (
+            id INTEGER PRIMARY KEY,
+            user_key INTEGER,
+            timestamp INTEGER NOT NULL,
+            content NOT NULL
+        )
+    ''')
+    conn.execute(f'CREATE INDEX idx_{name}_user_ts ON {name} (user_key, timestamp DESC, id DESC)')
+    conn.execute(f'''
+        CREATE VIRTUAL TABLE {fts} USING fts5 (
+            content, owner,
+            content='', tokenize='unicode61 remove_diacritics 2'
+        )
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER {fts}_insert AFTER INSERT ON {name} BEGIN
+            INSERT INTO {fts} (rowid, content, owner) VALUES (new.id, note_text(new.content), 'u' || new.user_key);
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER {fts}_delete AFTER DELETE ON {name} BEGIN
+            INSERT INTO {fts} ({fts}, rowid, content, owner) VALUES ('delete', old.id, note_text(old.content), 'u' || old.user_key);
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER {fts}_update AFTER UPDATE OF content, user_key ON {name} BEGIN
+            INSERT INTO {fts} ({fts}, rowid, content, owner) VALUES ('delete', old.id, note_text(old.content), 'u' || old.user_key);
+            INSERT INTO {fts} (rowid, content, owner) VALUES (new.id, note_text(new.content), 'u' || new.user_key);
+        END
+    ''')
+
+def _refresh_notes_view(conn):
+    """Recreate the `notes` read view over the current partitions (always at least the current month)."""
+    partitions = _list_partitions(conn)
+    if not partitions:
+        partitions = [_partition_for(time.time())]
+        _create_partition(conn, partitions[0])
+    conn.execute('DROP VIEW IF EXISTS notes')
+    conn.execute('CREATE VIEW notes AS ' + ' UNION ALL '.join(
+        f'SELECT id, user_key, timestamp, content FROM {name}' for name in partitions))
+
+def _migration_10(conn):
+    """Intern user ids into `users` and store note bodies with _pack_note (see _create_partition)."""
+    conn.execute('CREATE TABLE users (id INTEGER PRIMARY KEY, user_id TEXT NOT NULL UNIQUE)')
+    conn.execute('INSERT INTO users (user_id) SELECT DISTINCT user_id FROM notes WHERE user_id IS NOT NULL ORDER BY user_id')
+    conn.create_function("note_pack", 1, _pack_note, deterministic=True)
+    conn.execute('DROP VIEW notes')
+    for name in _list_partitions(conn):
+        fts = name.replace("notes_", "notes_fts_")
+        for action in ("insert", "delete", "update"):
+            conn.execute(f'DROP TRIGGER {fts}_{action}')
+        conn.execute(f'DROP TABLE {fts}')
+        conn.execute(f'DROP INDEX idx_{name}_user_ts')
+        conn.execute(f'ALTER TABLE {name} RENAME TO old_{name}')
+        _create_partition(conn, name)
+        conn.execute(f'''
+            INSERT INTO {name} (id, user_key, timestamp, content)
+            SELECT o.id, users.id, o.timestamp, note_pack(o.content)
+            FROM old_{name} AS o LEFT JOIN users ON users.user_id = o.user_id
+        ''')
+        conn.execute(f'DROP TABLE old_{name}')
+    _refresh_notes_view(conn)
+
+def _migration_11(conn):
+    """Opt-in digest emails: frequency, address, next run and note cursor in user_settings.
+
+    retention_days becomes optional (a user may only want digests), which
+    SQLite cannot change in place, so the table is rebuilt. Due digests are
+    found through a partial index that only holds opted-in users.
+    """
+    conn.execute('''
+        CREATE TABLE user_settings_new (
+            user_id TEXT PRIMARY KEY,
+            retention_days INTEGER,
+            digest_frequency TEXT,
+            digest_email TEXT,
+            digest_next_at INTEGER,
+            digest_after_ts INTEGER NOT NULL DEFAULT 0,
+            digest_after_id INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    conn.execute('INSERT INTO user_settings_new (user_id, retention_days) SELECT user_id, retention_days FROM user_settings')
+    conn.execute('DROP TABLE user_settings')
+    conn.execute('ALTER TABLE user_settings_new RENAME TO user_settings')
+    conn.execute('CREATE INDEX idx_user_settings_digest_due ON user_settings (digest_next_at) '
+                 'WHERE digest_frequency IS NOT NULL')
+
+# Ordered schema migrations. The schema version is kept in PRAGMA user_version;
+# append new migrations at the end and never edit one that has shipped.
+MIGRATIONS = [
+    _migration_1,
+    _migration_2,
+    _migration_3,
+    _migration_4,
+    _migration_5,
+    _migration_6,
+    _migration_7,
+    _migration_8,
+    _migration_9,
+    _migration_10,
+    _migration_11,
+]
+
+def schema_version(conn=None):
+    """Return the schema version recorded in the database file."""
+    conn = conn or get_connection()
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+class SqliteBackend:
+    """Storage in the local SQLite file DB_NAME, one pooled connection per thread.
+
+    Fine for any number of gunicorn workers on one host; every host has its
+    own file, so use the postgres backend to run several hosts.
+    """
+
+    name = "sqlite"
+
+    def init_db(self):
+        conn = get_connection()
+        if schema_version(conn) >= len(MIGRATIONS):
+            return
+
+        # IMMEDIATE takes the write lock up front so concurrent workers migrate one at a time.
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            version = schema_version(conn)
+            for number, migration in enumerate(MIGRATIONS[version:], version + 1):
+                migration(conn)
+                conn.execute(f'PRAGMA user_version = {number}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+        if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+            # One-off rewrite of a file created before incremental auto-vacuum; VACUUM cannot run in a transaction.
+            logger.info(f"Converting {DB_NAME} to incremental auto-vacuum")
+            conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            conn.execute('VACUUM')
+
+    def close(self):
+        close_connections()
+
+    # Notes
+
+    def _user_key(self, conn, user_id):
+        """users.id for `user_id`, or None if they never saved a note."""
+        key = _user_keys.get((DB_NAME, user_id))
+        if key is None:
+            row = conn.execute('SELECT id FROM users WHERE user_id = ?', (user_id,)).fetchone()
+            if row is None:
+                return None
+            key = _user_keys[(DB_NAME, user_id)] = row[0]
+        return key
+
+    def _intern_users(self, conn, user_ids):
+        """users.id for each of `user_ids`, adding missing ones. Caller holds the write lock and caches after commit."""
+        keys, created = {None: None}, {}
+        for user_id in user_ids - {None}:
+            keys[user_id] = _user_keys.get((DB_NAME, user_id))
+            if keys[user_id] is None:
+                conn.execute('INSERT OR IGNORE INTO users (user_id) VALUES (?)', (user_id,))
+                keys[user_id] = created[user_id] = conn.execute(
+                    'SELECT id FROM users WHERE user_id = ?', (user_id,)).fetchone()[0]
+        return keys, created
+
+    def save_notes_batch(self, notes, durable=False):
+        conn = get_connection()
+        if durable and getattr(_local, "durable", None) is not conn:
+            # Acknowledged notes must survive power loss, not just a crash of the process.
+            conn.execute("PRAGMA synchronous=FULL")
+            _local.durable = conn
+        by_partition = {}
+        for text, user_id, timestamp in notes:
+            by_partition.setdefault(_partition_for(timestamp), []).append((_pack_note(text), user_id, timestamp))
+        # IMMEDIATE: the id range, user keys and any new partition are decided under the write lock.
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            keys, created = self._intern_users(conn, {user_id for _, user_id, _ in notes})
+            missing = set(by_partition) - set(_list_partitions(conn))
+            if missing:
+                for name in missing:
+                    _create_partition(conn, name)
+                _refresh_notes_view(conn)
+            next_id = conn.execute('UPDATE note_id_seq SET next_id = next_id + ? WHERE id = 1 RETURNING next_id',
+                                   (len(notes),)).fetchone()[0] - len(notes)
+            for name, rows in by_partition.items():
+                conn.executemany(f'INSERT INTO {name} (id, content, user_key, timestamp) VALUES (?, ?, ?, ?)',
+                                 [(next_id + i, content, keys[user_id], timestamp)
+                                  for i, (content, user_id, timestamp) in enumerate(rows)])
+                next_id += len(rows)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        _user_keys.update(((DB_NAME, user_id), key) for user_id, key in created.items())
+
+    # Bodies are inflated here, once each, for the rows being returned; SQL
+    # never calls note_text() on the read path.
+
+    def get_notes_page(self, user_id, before, limit):
+        conn = get_connection()
+        user_key = self._user_key(conn, user_id)
+        if user_key is None:
+            return []
+        if before is None:
+            rows = conn.execute('''
+                SELECT content, timestamp, id FROM notes WHERE user_key = ?
+                ORDER BY timestamp DESC, id DESC LIMIT ?
+            ''', (user_key, limit)).fetchall()
+        else:
+            rows = conn.execute('''
+                SELECT content, timestamp, id FROM notes WHERE user_key = ? AND (timestamp, id) < (?, ?)
+                ORDER BY timestamp DESC, id DESC LIMIT ?
+            ''', (user_key, before[0], before[1], limit)).fetchall()
+        return [(_note_text(row[0]), row[1], row[2]) for row in rows]
+
+    def get_all_notes(self, user_id):
+        conn = get_connection()
+        user_key = self._user_key(conn, user_id)
+        if user_key is None:
+            return []
+        rows = conn.execute('SELECT content, timestamp FROM notes WHERE user_key = ? ORDER BY timestamp DESC, id DESC', (user_key,)).fetchall()
+        return [(_note_text(row[0]), row[1]) for row in rows]
+
+    def iter_all_notes(self, user_id, batch_size):
+        conn = get_connection()
+        user_key = self._user_key(conn, user_id)
+        if user_key is None:
+            return
+        cur = conn.execute('SELECT content, timestamp FROM notes WHERE user_key = ? ORDER BY timestamp DESC, id DESC', (user_key,))
+        try:
+            while True:
+                rows = cur.fetchmany(batch_size)
+                if not rows:
+                    return
+                for content, timestamp in rows:
+                    yield _note_text(content), timestamp
+        finally:
+            cur.close()
+
+    def count_notes(self):
+        conn = get_connection()
+        return conn.execute('SELECT COUNT(*) FROM notes').fetchone()[0]
+
+    def get_note_users(self, after_user_id, limit):
+        conn = get_connection()
+        return [row[0] for row in conn.execute(
+            'SELECT user_id FROM users WHERE user_id > ? ORDER BY user_id LIMIT ?', (after_user_id or '', limit))]
+
+    def has_notes(self, user_id):
+        conn = get_connection()
+        user_key = self._user_key(conn, user_id)
+        if user_key is None:
+            return False
+        return conn.execute('SELECT 1 FROM notes WHERE user_key = ? LIMIT 1', (user_key,)).fetchone() is not None
+
+    def search_candidates(self, user_id, terms, prefix, limit):
+        conn = get_connection()
+        user_key = self._user_key(conn, user_id)
+        if user_key is None:
+            return []
+        phrases = [_fts_phrase(term) for term in terms]
+        if prefix:
+            phrases[-1] += "*"
+        match = f"owner : u{user_key} AND content : ({' '.join(phrases)})"
+        rows = []
+        # Newest month first, until enough candidates are found.
+        for name in reversed(_list_partitions(conn)):
+            fts = name.replace("notes_", "notes_fts_")
+            rows += conn.execute(f'''
+                SELECT {name}.content, {name}.timestamp, {name}.id
+                FROM (
+                    SELECT rowid FROM {fts} WHERE {fts} MATCH ? ORDER BY rowid DESC LIMIT ?
+                ) AS hits JOIN {name} ON {name}.id = hits.rowid
+                WHERE {name}.user_key = ?
+            ''', (match, limit - len(rows), user_key)).fetchall()
+            if len(rows) >= limit:
+                break
+        return [(_note_text(row[0]), row[1], row[2]) for row in rows]
+
+    # Settings and retention
+
+    def set_retention_days(self, user_id, days):
+        conn = get_connection()
+        with conn:
+            conn.execute('''
+                INSERT INTO user_settings (user_id, retention_days) VALUES (?, ?)
+                ON CONFLICT (user_id) DO UPDATE SET retention_days = excluded.retention_days
+            ''', (user_id, days))
+
+    def get_retention_days(self, user_id):
+        conn = get_connection()
+        row = conn.execute('SELECT retention_days FROM user_settings WHERE user_id = ?', (user_id,)).fetchone()
+        return row[0] if row else None
+
+    def delete_expired_notes(self, user_id, cutoff, batch_size):
+        conn = get_connection()
+        user_key = self._user_key(conn, user_id)
+        if user_key is None:
+            return 0
+        deleted = 0
+        # IMMEDIATE so the partition list cannot change before the deletes run.
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # Only months that start before the cutoff can hold expired notes.
+            for name in _list_partitions(conn):
+                if _partition_bounds(name)[0] >= cutoff:
+                    break
+                if batch_size is None:
+                    cur = conn.execute(f'DELETE FROM {name} WHERE user_key = ? AND timestamp < ?', (user_key, cutoff))
+                else:
+                    # Bounded chunk so one heavy user never holds the write lock for long.
+                    cur = conn.execute(f'''
+                        DELETE FROM {name} WHERE id IN (
+                            SELECT id FROM {name} WHERE user_key = ? AND timestamp < ? LIMIT ?
+                        )
+                    ''', (user_key, cutoff, batch_size - deleted))
+                deleted += cur.rowcount
+                if batch_size is not None and deleted >= batch_size:
+                    break
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return deleted
+
+    def delete_notes_before(self, cutoff, batch_size):
+        conn = get_connection()
+        deleted = 0
+        # One transaction per dropped partition keeps each write lock short.
+        while True:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                partitions = _list_partitions(conn)
+                name = partitions[0] if partitions else None
+                start, end = _partition_bounds(name) if name else (cutoff, cutoff)
+                # The view always keeps the current month, so that one is only ever trimmed.
+                drop = name is not None and end <= cutoff and end <= time.time()
+                if drop:
+                    deleted += conn.execute(f'SELECT COUNT(*) FROM {name}').fetchone()[0]
+                    _drop_partition(conn, name)
+                    _refresh_notes_view(conn)
+                    logger.info(f"Dropped notes partition {name}")
+                elif start < cutoff:
+                    # The month straddling the cutoff keeps its newer rows.
+                    deleted += conn.execute(f'''
+                        DELETE FROM {name} WHERE id IN (
+                            SELECT id FROM {name} WHERE timestamp < ? LIMIT ?
+                        )
+                    ''', (cutoff, batch_size)).rowcount
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            if not drop:
+                return deleted
+
+    def reclaim_space(self, max_pages):
+        conn = get_connection()
+        before = conn.execute('PRAGMA freelist_count').fetchone()[0]
+        # execute() would step the pragma once and free a single page; executescript runs it to completion.
+        conn.executescript(f'PRAGMA incremental_vacuum({int(max_pages)})')
+        return before - conn.execute('PRAGMA freelist_count').fetchone()[0]
+
+    def get_retention_settings(self, after_user_id, limit):
+        conn = get_connection()
+        return conn.execute(
+            'SELECT user_id, retention_days FROM user_settings '
+            'WHERE user_id > ? AND retention_days > 0 ORDER BY user_id LIMIT ?',
+            (after_user_id or '', limit)).fetchall()
+
+    def acquire_retention_lease(self, owner, ttl_seconds):
+        now = int(time.time())
+        conn = get_connection()
+        with conn:
+            cur = conn.execute('''
+                UPDATE retention_progress SET lease_owner = ?, lease_until = ?
+                WHERE id = 1 AND (lease_owner IS NULL OR lease_owner = ? OR lease_until < ?)
+            ''', (owner, now + ttl_seconds, owner, now))
+        return cur.rowcount == 1
+
+    def release_retention_lease(self, owner):
+        conn = get_connection()
+        with conn:
+            conn.execute('UPDATE retention_progress SET lease_owner = NULL, lease_until = NULL WHERE id = 1 AND lease_owner = ?', (owner,))
+
+    def get_retention_progress(self):
+        conn = get_connection()
+        return conn.execute('SELECT last_user_id, sweep_started_at, sweep_finished_at FROM retention_progress WHERE id = 1').fetchone()
+
+    def set_retention_progress(self, last_user_id, started_at, finished_at):
+        conn = get_connection()
+        with conn:
+            conn.execute('''
+                UPDATE retention_progress
+                SET last_user_id = ?,
+                    sweep_started_at = COALESCE(?, sweep_started_at),
+                    sweep_finished_at = COALESCE(?, sweep_finished_at)
+                WHERE id = 1
+            ''', (last_user_id, started_at, finished_at))
+
+    # Digests
+
+    def set_digest(self, user_id, frequency, email, next_at, after_ts):
+        conn = get_connection()
+        with conn:
+            # A user who was already subscribed keeps their cursor; a new subscriber starts at after_ts.
+            conn.execute('''
+                INSERT INTO user_settings (user_id, digest_frequency, digest_email, digest_next_at, digest_after_ts)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (user_id) DO UPDATE SET
+                    digest_after_ts = CASE WHEN digest_frequency IS NULL THEN excluded.digest_after_ts ELSE digest_after_ts END,
+                    digest_after_id = CASE WHEN digest_frequency IS NULL THEN 0 ELSE digest_after_id END,
+                    digest_frequency = excluded.digest_frequency,
+                    digest_email = excluded.digest_email,
+                    digest_next_at = excluded.digest_next_at
+            ''', (user_id, frequency, email, next_at, after_ts or 0))
+
+    def get_digest(self, user_id):
+        conn = get_connection()
+        return conn.execute(
+            'SELECT digest_frequency, digest_email, digest_next_at FROM user_settings '
+            'WHERE user_id = ? AND digest_frequency IS NOT NULL', (user_id,)).fetchone()
+
+    def update_digest_email(self, user_id, email):
+        conn = get_connection()
+        with conn:
+            conn.execute('''
+                UPDATE user_settings SET
+                    digest_email = COALESCE(?, digest_email),
+                    digest_frequency = CASE WHEN ? IS NULL THEN NULL ELSE digest_frequency END,
+                    digest_next_at = CASE WHEN ? IS NULL THEN NULL ELSE digest_next_at END
+                WHERE user_id = ? AND digest_frequency IS NOT NULL
+            ''', (email, email, email, user_id))
+
+    def claim_due_digests(self, now, limit, lease_seconds):
+        conn = get_connection()
+        # IMMEDIATE so two jobs never claim the same users.
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            rows = conn.execute('''
+                SELECT user_id, digest_frequency, digest_email, digest_next_at, digest_after_ts, digest_after_id
+                FROM user_settings
+                WHERE digest_frequency IS NOT NULL AND digest_next_at <= ?
+                ORDER BY digest_next_at LIMIT ?
+            ''', (now, limit)).fetchall()
+            conn.executemany('UPDATE user_settings SET digest_next_at = ? WHERE user_id = ?',
+                             [(now + lease_seconds, row[0]) for row in rows])
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return rows
+
+    def get_new_notes(self, cursors, limit):
+        conn = get_connection()
+        notes = {}
+        for user_id, after_ts, after_id in cursors:
+            user_key = self._user_key(conn, user_id)
+            if user_key is None:
+                continue
+            rows = conn.execute('''
+                SELECT content, timestamp, id FROM notes WHERE user_key = ? AND (timestamp, id) > (?, ?)
+                ORDER BY timestamp, id LIMIT ?
+            ''', (user_key, after_ts, after_id, limit)).fetchall()
+            if rows:
+                notes[user_id] = [(_note_text(row[0]), row[1], row[2]) for row in rows]
+        return notes
+
+    def record_digests(self, updates):
+        conn = get_connection()
+        with conn:
+            # Users who opted out meanwhile stay unscheduled.
+            conn.executemany('''
+                UPDATE user_settings SET digest_next_at = ?, digest_after_ts = ?, digest_after_id = ?
+                WHERE user_id = ? AND digest_frequency IS NOT NULL
+            ''', [(next_at, after_ts, after_id, user_id) for user_id, next_at, after_ts, after_id in updates])
+
+    # Email outbox
+
+    def enqueue_email(self, user_id, recipient, subject, body, kind):
+        now = int(time.time())
+        conn = get_connection()
+        with conn:
+            cur = conn.execute('''
+                INSERT INTO email_outbox (user_id, recipient, subject, body, kind, next_attempt_at, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (user_id, recipient, subject, body, kind, now, now, now))
+        return cur.lastrowid
+
+    def claim_emails(self, limit, lease_seconds):
+        now = int(time.time())
+        conn = get_connection()
+        with conn:
+            return conn.execute('''
+                UPDATE email_outbox
+                SET status = 'sending', attempts = attempts + 1, next_attempt_at = ?, updated_at = ?
+                WHERE id IN (
+                    SELECT id FROM email_outbox
+                    WHERE status IN ('pending', 'sending') AND next_attempt_at <= ?
+                    ORDER BY next_attempt_at LIMIT ?
+                )
+                RETURNING id, kind, user_id, recipient, subject, body, attempts, parts_sent
+            ''', (now + lease_seconds, now, now, limit)).fetchall()
+
+    def mark_email_sent(self, email_id, attempt):
+        conn = get_connection()
+        with conn:
+            return conn.execute(
+                "UPDATE email_outbox SET status = 'sent', last_error = NULL, updated_at = ? "
+                "WHERE id = ? AND (? IS NULL OR attempts = ?)",
+                (int(time.time()), email_id, attempt, attempt)).rowcount == 1
+
+    def mark_email_failed(self, email_id, error, retry_at, attempt):
+        conn = get_connection()
+        with conn:
+            if retry_at is None:
+                cur = conn.execute(
+                    "UPDATE email_outbox SET status = 'failed', last_error = ?, updated_at = ? "
+                    "WHERE id = ? AND (? IS NULL OR attempts = ?)",
+                    (error, int(time.time()), email_id, attempt, attempt))
+            else:
+                cur = conn.execute(
+                    "UPDATE email_outbox SET status = 'pending', last_error = ?, next_attempt_at = ?, updated_at = ? "
+                    "WHERE id = ? AND (? IS NULL OR attempts = ?)",
+                    (error, retry_at, int(time.time()), email_id, attempt, attempt))
+            return cur.rowcount == 1
+
+    def set_email_parts_sent(self, email_id, parts_sent, attempt, lease_until):
+        conn = get_connection()
+        with conn:
+            return conn.execute(
+                'UPDATE email_outbox SET parts_sent = ?, next_attempt_at = COALESCE(?, next_attempt_at), updated_at = ? '
+                'WHERE id = ? AND (? IS NULL OR attempts = ?)',
+                (parts_sent, lease_until, int(time.time()), email_id, attempt, attempt)).rowcount == 1
+
+    def get_email_status(self, email_id):
+        conn = get_connection()
+        return conn.execute('SELECT status, attempts, last_error, updated_at FROM email_outbox WHERE id = ?', (email_id,)).fetchone()
+
+    # Dictation drafts
+
+    def create_draft(self, draft_id, user_id):
+        conn = get_connection()
+        with conn:
+            conn.execute('INSERT OR REPLACE INTO drafts (draft_id, user_id, updated_at) VALUES (?, ?, ?)', (draft_id, user_id, int(time.time())))
+
+    def append_draft_fragment(self, draft_id, user_id, fragment):
+        conn = get_connection()
+        with conn:
+            conn.execute('''
+                INSERT INTO drafts (draft_id, user_id, updated_at) VALUES (?, ?, ?)
+                ON CONFLICT (draft_id) DO UPDATE SET updated_at = excluded.updated_at
+            ''', (draft_id, user_id, int(time.time())))
+            conn.execute('INSERT INTO draft_fragments (draft_id, fragment) VALUES (?, ?)', (draft_id, fragment))
+
+    def get_draft_fragments(self, draft_id):
+        conn = get_connection()
+        return [row[0] for row in conn.execute('SELECT fragment FROM draft_fragments WHERE draft_id = ? ORDER BY id', (draft_id,))]
+
+    def get_draft_user(self, draft_id):
+        conn = get_connection()
+        row = conn.execute('SELECT user_id FROM drafts WHERE draft_id = ?', (draft_id,)).fetchone()
+        return row[0] if row else None
+
+    def delete_draft(self, draft_id):
+        conn = get_connection()
+        with conn:
+            conn.execute('DELETE FROM drafts WHERE draft_id = ?', (draft_id,))
+
+    def claim_draft(self, draft_id, updated_before):
+        conn = get_connection()
+        # IMMEDIATE: the fragments read and the delete happen under one write lock.
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            fragments = [row[0] for row in conn.execute(
+                'SELECT fragment FROM draft_fragments WHERE draft_id = ? ORDER BY id', (draft_id,))]
+            row = conn.execute(
+                'DELETE FROM drafts WHERE draft_id = ? AND updated_at < COALESCE(?, updated_at + 1) RETURNING user_id',
+                (draft_id, updated_before)).fetchone()
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return (row[0], fragments) if row else None
+
+    def get_stale_drafts(self, updated_before, limit):
+        conn = get_connection()
+        return [row[0] for row in conn.execute(
+            'SELECT draft_id FROM drafts WHERE updated_at < ? ORDER BY updated_at LIMIT ?', (updated_before, limit))]
+
+    # Profile emails
+
+    def get_profile_email(self, user_id, fetched_after):
+        conn = get_connection()
+        row = conn.execute('SELECT email FROM profile_emails WHERE user_id = ? AND fetched_at > ?',
+                           (user_id, fetched_after)).fetchone()
+        return row[0] if row else None
+
+    def set_profile_email(self, user_id, email):
+        conn = get_connection()
+        with conn:
+            conn.execute('INSERT OR REPLACE INTO profile_emails (user_id, email, fetched_at) VALUES (?, ?, ?)',
+                         (user_id, email, int(time.time())))
+
+    def delete_profile_email(self, user_id):
+        conn = get_connection()
+        with conn:
+            conn.execute('DELETE FROM profile_emails WHERE user_id = ?', (user_id,))
+
+
+def create_backend(name=DB_BACKEND):
+    """Build the storage backend named by DB_BACKEND."""
+    if name == "postgres":
+        import postgres_backend  # optional dependency (psycopg2), only needed for this backend
+
+        return postgres_backend.PostgresBackend()
+    if name != "sqlite":
+        logger.warning(f"Unknown DB_BACKEND '{name}', using sqlite")
+    return SqliteBackend()
+
+
+backend = create_backend()
+
+
+def init_db():
+    """Initialize the database, applying any pending schema migrations in order."""
+    backend.init_db()
 
 def set_retention_days(user_id, days):
-    """Set the retention period in days for a user."""
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute('INSERT OR REPLACE INTO user_settings (user_id, retention_days) VALUES (?, ?)', (user_id, days))
-    conn.commit()
-    conn.close()
+    """Set the retention period in days for a user. Raises ValueError unless days >= 1."""
+    retention_cutoff(days)
+    backend.set_retention_days(user_id, days)
+    cache.user_cache.invalidate(user_id)
 
 def get_retention_days(user_id):
     """Get the retention period in days for a user. Returns None if not set."""
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute('SELECT retention_days FROM user_settings WHERE user_id = ?', (user_id,))
-    row = c.fetchone()
-    conn.close()
-    return row[0] if row else None
+    return cache.user_cache.read_through(user_id, "retention", lambda: backend.get_retention_days(user_id))
 
 def cleanup_old_notes(user_id):
     """Delete notes older than the retention period for a user. Returns number of deleted notes."""
     days = get_retention_days(user_id)
-    if days is None:
+    if days is None or days < 1:
         return 0
-        
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    # SQLite 'datetime' modifier handles date calculations
-    c.execute(f"DELETE FROM notes WHERE user_id = ? AND timestamp < datetime('now', '-{days} days')", (user_id,))
-    deleted_count = c.rowcount
-    conn.commit()
-    conn.close()
-    return deleted_count
+    return delete_expired_notes(user_id, retention_cutoff(days))
+
+def retention_cutoff(days, now=None):
+    """Epoch timestamp before which notes kept for `days` days have expired.
+
+    Raises ValueError for fewer than one day, which would expire every note.
+    """
+    days = int(days)
+    if days < 1:
+        raise ValueError(f"retention must be at least 1 day, got {days}")
+    return int(now if now is not None else time.time()) - days * 86400
+
+def delete_expired_notes(user_id, cutoff, batch_size=None):
+    """Delete a user's notes older than `cutoff`, at most `batch_size` rows if given. Returns number deleted."""
+    deleted = backend.delete_expired_notes(user_id, cutoff, batch_size)
+    if deleted:
+        cache.user_cache.invalidate(user_id)
+    return deleted
+
+def delete_notes_before(cutoff, batch_size=1000):
+    """Delete up to `batch_size` notes of any user older than `cutoff`. Returns number deleted.
+
+    Backends that partition notes by time drop whole partitions that lie
+    before the cutoff, so the count can exceed `batch_size`.
+    """
+    deleted = backend.delete_notes_before(cutoff, batch_size)
+    if deleted:
+        cache.user_cache.clear()
+    return deleted
+
+def reclaim_space(max_pages=10000):
+    """Give up to `max_pages` free database pages back to the filesystem. Returns pages released."""
+    return backend.reclaim_space(max_pages)
+
+def get_retention_settings(after_user_id=None, limit=500):
+    """Page through (user_id, retention_days) rows in user_id order, starting after `after_user_id`."""
+    return backend.get_retention_settings(after_user_id, limit)
+
+def acquire_retention_lease(owner, ttl_seconds):
+    """Take or renew the sweep lease. Returns True if `owner` holds it, so only one worker sweeps at a time."""
+    return backend.acquire_retention_lease(owner, ttl_seconds)
+
+def release_retention_lease(owner):
+    """Give up the sweep lease if `owner` holds it."""
+    backend.release_retention_lease(owner)
+
+def get_retention_progress():
+    """Return (last_user_id, sweep_started_at, sweep_finished_at) for the current or last sweep."""
+    return backend.get_retention_progress()
+
+def set_retention_progress(last_user_id, started_at=None, finished_at=None):
+    """Record sweep progress. Pass last_user_id=None with finished_at to mark a sweep complete."""
+    backend.set_retention_progress(last_user_id, started_at, finished_at)
+
+def set_digest(user_id, frequency, email=None, next_at=None, after_ts=None):
+    """Subscribe a user to 'daily' or 'weekly' digests sent to `email`, first at `next_at`; frequency None unsubscribes.
+
+    A new subscriber's first digest holds the notes saved after `after_ts`;
+    changing the frequency of an existing subscription keeps its cursor.
+    """
+    backend.set_digest(user_id, frequency, email, next_at, after_ts)
+
+def get_digest(user_id):
+    """(frequency, email, next_at) of a user's digest subscription, or None."""
+    return backend.get_digest(user_id)
+
+def update_digest_email(user_id, email):
+    """Send an existing digest subscription to `email`; None (consent withdrawn) cancels it."""
+    backend.update_digest_email(user_id, email)
+
+def claim_due_digests(now, limit, lease_seconds):
+    """Reserve up to `limit` users whose digest is due at `now` for `lease_seconds`.
+
+    Rows are (user_id, frequency, email, scheduled_at, after_ts, after_id), the
+    last two being the cursor of the last note already sent.
+    """
+    return backend.claim_due_digests(now, limit, lease_seconds)
+
+def get_new_notes(cursors, limit):
+    """Notes after each (user_id, after_ts, after_id) cursor, oldest first, at most `limit` per user.
+
+    Returns {user_id: [(content, epoch timestamp, id), ...]} for users with new notes only.
+    """
+    return backend.get_new_notes(cursors, limit)
+
+def record_digests(updates):
+    """Store (user_id, next_at, after_ts, after_id) for claimed users in one transaction."""
+    backend.record_digests(updates)
 
 def save_note(text, user_id):
     """Save a note to the database."""
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute('INSERT INTO notes (content, user_id) VALUES (?, ?)', (text, user_id))
-    conn.commit()
-    conn.close()
+    backend.save_notes_batch([(text, user_id, int(time.time()))])
+    cache.user_cache.invalidate(user_id)
+
+def save_notes_batch(notes, durable=False):
+    """Save (text, user_id, epoch timestamp) tuples in a single transaction.
+
+    With `durable`, the commit also survives power loss (SQLite: synchronous=FULL
+    on this thread's connection), for writers that acknowledge saves.
+    """
+    backend.save_notes_batch(notes, durable)
+    for user_id in {note[1] for note in notes}:
+        cache.user_cache.invalidate(user_id)
 
 def get_notes(user_id, limit=5):
-    """Retrieve the most recent notes for a specific user with timestamps."""
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute('SELECT content, timestamp FROM notes WHERE user_id = ? ORDER BY timestamp DESC LIMIT ?', (user_id, limit))
-    rows = c.fetchall()
-    conn.close()
+    """Retrieve the most recent notes for a specific user as (content, epoch timestamp) pairs."""
+    rows = cache.user_cache.read_through(user_id, f"notes:{limit}", lambda: _load_notes(user_id, limit))
     return [(row[0], row[1]) for row in rows]
 
+def _load_notes(user_id, limit):
+    return [(row[0], row[1]) for row in backend.get_notes_page(user_id, None, limit)]
+
+def get_notes_page(user_id, before=None, limit=5):
+    """Return up to `limit` notes older than the `before` (timestamp, id) cursor, newest first.
+
+    Rows are (content, epoch timestamp, id); pass the last row's (timestamp, id)
+    as `before` to get the next page. Keyset pagination walks idx_notes_user_ts
+    directly, so deep pages cost the same as the first one. The first page
+    (before=None) is served from the user cache.
+    """
+    if before is None:
+        rows = cache.user_cache.read_through(user_id, f"page:{limit}", lambda: backend.get_notes_page(user_id, None, limit))
+    else:
+        rows = backend.get_notes_page(user_id, before, limit)
+    return [(row[0], row[1], row[2]) for row in rows]
+
 def get_all_notes(user_id):
-    """Retrieve all notes for a specific user with timestamps."""
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute('SELECT content, timestamp FROM notes WHERE user_id = ? ORDER BY timestamp DESC', (user_id,))
-    rows = c.fetchall()
-    conn.close()
-    return [(row[0], row[1]) for row in rows]
+    """Retrieve all notes for a specific user as (content, epoch timestamp) pairs."""
+    return backend.get_all_notes(user_id)
+
+def has_notes(user_id):
+    """True if the user has at least one saved note."""
+    return backend.has_notes(user_id)
+
+def count_notes():
+    """Total number of notes, all users included."""
+    return backend.count_notes()
+
+def get_note_users(after_user_id=None, limit=500):
+    """Page through the ids of users who have saved notes, in user_id order, starting after `after_user_id`."""
+    return backend.get_note_users(after_user_id, limit)
+
+def _fts_phrase(text):
+    return '"' + text.replace('"', '""') + '"'
+
+def _fts_tokens(text):
+    """Tokens as the notes_fts tokenizer sees them (unicode61, remove_diacritics 2)."""
+    folded = unicodedata.normalize("NFKD", text.lower())
+    return re.findall(r"\w+", "".join(c for c in folded if not unicodedata.combining(c)))
+
+def _bm25(tokens, terms, avg_length, prefix, k1=1.2, b=0.75):
+    """Okapi BM25 of one note for `terms` (the last one a prefix if `prefix`), without the IDF factor."""
+    norm = k1 * (1 - b + b * len(tokens) / avg_length)
+    score = 0.0
+    for i, term in enumerate(terms):
+        if prefix and i == len(terms) - 1:
+            tf = sum(1 for token in tokens if token.startswith(term))
+        else:
+            tf = tokens.count(term)
+        score += tf * (k1 + 1) / (tf + norm)
+    return score
+
+def search_notes(user_id, query, limit=5):
+    """Full-text search of a user's notes, best match first (BM25), as (content, epoch timestamp, id) rows.
+
+    Every word of `query` must appear in the note. If that finds fewer than
+    `limit` notes, the last word is also matched as a prefix ("dent" finds
+    "dentista"). Only the newest SEARCH_CANDIDATES matching notes are ranked.
+    Returns [] if the query has no words.
+    """
+    terms = _fts_tokens(query)
+    if not terms:
+        return []
+    # A prefix query merges the doclists of every word with that prefix, which
+    # is slow for short or common prefixes; Alexa transcribes whole words, so
+    # it is only the fallback.
+    prefix = False
+    rows = backend.search_candidates(user_id, terms, prefix, SEARCH_CANDIDATES)
+    if len(rows) < limit:
+        prefix = True
+        rows = backend.search_candidates(user_id, terms, prefix, SEARCH_CANDIDATES)
+    if not rows:
+        return []
+    # FTS5's bm25() first scans every match of every phrase (the owner token
+    # included) for its IDF, which grows with the user's history and with how
+    # common the words are. Every candidate contains every term, so IDF would
+    # scale all scores alike: rank the newest candidates here by term
+    # frequency and note length instead.
+    rows = list(rows)
+    tokenized = [_fts_tokens(row[0]) for row in rows]
+    avg_length = sum(len(tokens) for tokens in tokenized) / len(tokenized) or 1
+    scores = {row[2]: _bm25(tokens, terms, avg_length, prefix) for row, tokens in zip(rows, tokenized)}
+    rows.sort(key=lambda row: (-scores[row[2]], -row[2]))
+    return [(row[0], row[1], row[2]) for row in rows[:limit]]
+
+def iter_all_notes(user_id, batch_size=500):
+    """Yield all of a user's notes, newest first, as (content, epoch timestamp) pairs.
+
+    Rows are stepped from the cursor `batch_size` at a time instead of being
+    fetched all at once, so memory stays flat however long the history is.
+    """
+    return backend.iter_all_notes(user_id, batch_size)
+
+def enqueue_email(user_id, recipient, subject, body, kind='message'):
+    """Queue an email for delivery by the outbox workers. Returns the outbox id."""
+    return backend.enqueue_email(user_id, recipient, subject, body, kind)
+
+def claim_emails(limit, lease_seconds):
+    """Atomically claim up to `limit` due emails as (id, kind, user_id, recipient, subject, body, attempts, parts_sent).
+
+    Claimed rows move to 'sending' with next_attempt_at set to the lease expiry,
+    so rows held by a worker that died are picked up again once the lease lapses.
+    """
+    return backend.claim_emails(limit, lease_seconds)
+
+def mark_email_sent(email_id, attempt=None):
+    """Record a successful delivery. Returns False if `attempt` is given and no longer owns the email."""
+    return backend.mark_email_sent(email_id, attempt)
+
+def mark_email_failed(email_id, error, retry_at=None, attempt=None):
+    """Record a failed attempt: reschedule at `retry_at`, or give up for good when it is None.
+
+    Returns False if `attempt` is given and no longer owns the email.
+    """
+    return backend.mark_email_failed(email_id, error, retry_at, attempt)
+
+def set_email_parts_sent(email_id, parts_sent, attempt=None, lease_seconds=None):
+    """Record how many parts of a multi-part export have been delivered, extending the lease by `lease_seconds`.
+
+    `attempt` is the attempts count returned by claim_emails; each claim bumps
+    it, so it identifies the current owner. Returns False if another worker
+    has claimed the email since, in which case nothing is recorded.
+    """
+    lease_until = int(time.time()) + lease_seconds if lease_seconds is not None else None
+    return backend.set_email_parts_sent(email_id, parts_sent, attempt, lease_until)
+
+def get_email_status(email_id):
+    """Return {'status', 'attempts', 'last_error', 'updated_at'} for an outbox entry, or None."""
+    row = backend.get_email_status(email_id)
+    if row is None:
+        return None
+    return {"status": row[0], "attempts": row[1], "last_error": row[2], "updated_at": row[3]}
+
+def create_draft(draft_id, user_id):
+    """Register an empty dictation draft."""
+    backend.create_draft(draft_id, user_id)
+
+def append_draft_fragment(draft_id, user_id, fragment):
+    """Append one utterance to a draft (creating the draft row if another worker started it)."""
+    backend.append_draft_fragment(draft_id, user_id, fragment)
+
+def get_draft_fragments(draft_id):
+    """Return a draft's fragments in dictation order."""
+    return backend.get_draft_fragments(draft_id)
+
+def get_draft_user(draft_id):
+    """Return the user_id owning a draft, or None."""
+    return backend.get_draft_user(draft_id)
+
+def delete_draft(draft_id):
+    """Delete a draft and its fragments."""
+    backend.delete_draft(draft_id)
+
+def claim_draft(draft_id, updated_before=None):
+    """Delete a draft and return (user_id, fragments), or None if it is gone or was updated since `updated_before`.
+
+    The delete decides the winner, so concurrent callers never both get the same draft.
+    """
+    return backend.claim_draft(draft_id, updated_before)
+
+def get_stale_drafts(updated_before, limit=50):
+    """Return ids of drafts untouched since `updated_before`, oldest first."""
+    return backend.get_stale_drafts(updated_before, limit)
+
+def get_profile_email(user_id, max_age):
+    """Return the user's cached profile email if it was fetched less than max_age seconds ago, else None."""
+    return backend.get_profile_email(user_id, int(time.time()) - max_age)
+
+def set_profile_email(user_id, email):
+    """Remember the profile email just fetched for a user."""
+    backend.set_profile_email(user_id, email)
+
+def delete_profile_email(user_id):
+    """Forget a user's cached profile email (e.g. after the permission was revoked)."""
+    backend.delete_profile_email(user_id)
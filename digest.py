@@ -0,0 +1,229 @@
+"""Scheduled digest emails: each opted-in user's new notes, daily or weekly.
+
+Users opt in from the skill (SetDigestIntent), which stores the frequency and
+their profile email in user_settings. A batch job then works through the due
+users DIGEST_BATCH_SIZE at a time:
+
+1. claims users whose digest is due (a partial index holds only subscribers)
+   and leases them for DIGEST_LEASE_SECONDS, so concurrent jobs skip them;
+2. reads only the notes after each user's cursor (timestamp, id of the last
+   note already sent) through the per-user notes index, at most
+   DIGEST_MAX_NOTES each; the rest wait for the next digest;
+3. renders one message per user with new notes and sends them over
+   DIGEST_SENDERS pooled SMTP sessions (mailer.py), DIGEST_MESSAGES_PER_SESSION
+   per session, at most DIGEST_RATE_PER_SECOND messages a second overall;
+4. moves each cursor past the notes sent and schedules the next digest. A
+   failed message keeps its cursor and is retried after DIGEST_RETRY_SECONDS.
+
+The job has no Alexa request to check consent with, so the stored address
+is kept current by the skill instead: each fresh profile email lookup
+replaces it, and the subscription is cancelled when a request arrives
+without the email permission or when Alexa reports the skill disabled or
+the permission withdrawn (SkillDisabled / SkillPermissionChanged events,
+which the skill manifest must subscribe to). Until one of those happens,
+digests go to the last address seen.
+
+Users without new notes get no email. Delivery is at least once: if the job
+dies between sending and recording a batch, that batch is sent again when
+its lease expires. Run it from cron or as a service:
+
+    python digest.py --once
+    python digest.py --interval 300
+"""
+if __name__ == "__main__":
+    # Run as a job: read .env like main.py, before the modules below read their settings.
+    from dotenv import load_dotenv
+
+    load_dotenv(override=True)
+
+import argparse
+import concurrent.futures
+import logging
+import os
+import threading
+import time
+
+import config
+import database
+import mailer
+import rendering
+
+logger = logging.getLogger(__name__)
+
+DIGEST_INTERVAL = int(os.environ.get("DIGEST_INTERVAL", 300))
+DIGEST_BATCH_SIZE = int(os.environ.get("DIGEST_BATCH_SIZE", 500))
+DIGEST_MAX_NOTES = int(os.environ.get("DIGEST_MAX_NOTES", 200))
+# Parallel SMTP sessions; keep it at or below SMTP_POOL_SIZE.
+DIGEST_SENDERS = int(os.environ.get("DIGEST_SENDERS", 2))
+DIGEST_MESSAGES_PER_SESSION = int(os.environ.get("DIGEST_MESSAGES_PER_SESSION", 50))
+# Messages per second across all sessions, as the relay allows (0 = no limit).
+DIGEST_RATE_PER_SECOND = float(os.environ.get("DIGEST_RATE_PER_SECOND", 10))
+DIGEST_LEASE_SECONDS = int(os.environ.get("DIGEST_LEASE_SECONDS", 900))
+DIGEST_RETRY_SECONDS = int(os.environ.get("DIGEST_RETRY_SECONDS", 3600))
+
+FREQUENCIES = {"daily": 86400, "weekly": 7 * 86400}
+
+MSG_DIGEST_SUBJECT = config.get().messages["MSG_DIGEST_SUBJECT"]
+MSG_DIGEST_BODY_PREFIX = config.get().messages["MSG_DIGEST_BODY_PREFIX"]
+MSG_DIGEST_MORE = config.get().messages["MSG_DIGEST_MORE"]
+
+
+def subscribe(user_id, frequency, email, now=None):
+    """Send `user_id` a digest of notes saved from now on, every day or week ('daily'/'weekly')."""
+    now = int(now if now is not None else time.time())
+    database.set_digest(user_id, frequency, email, next_at=now + FREQUENCIES[frequency], after_ts=now)
+
+
+def unsubscribe(user_id):
+    """Stop sending digests to `user_id`."""
+    database.set_digest(user_id, None)
+
+
+class RateLimiter:
+    """Token bucket shared by the sender threads: `rate` acquisitions per second, in bursts of at most `burst`."""
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            # Reserve the token now and sleep off the debt outside the lock.
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+
+def _next_run(scheduled_at, frequency, now):
+    """Keep the user's time of day, unless the job has fallen a whole period behind."""
+    period = FREQUENCIES.get(frequency, FREQUENCIES["daily"])
+    next_at = scheduled_at + period
+    return next_at if next_at > now else now + period
+
+
+def build_digest(recipient, rows, more=False):
+    """The digest message for (content, timestamp, id) rows, oldest first."""
+    body = MSG_DIGEST_BODY_PREFIX + rendering.render_email_body(rows) + (MSG_DIGEST_MORE if more else "")
+    return mailer.build_message(recipient, MSG_DIGEST_SUBJECT.format(count=len(rows)), body)
+
+
+def _send_all(messages, senders, limiter):
+    """Send messages over up to `senders` pooled sessions. Returns None or the exception for each."""
+    chunks = [messages[i:i + DIGEST_MESSAGES_PER_SESSION] for i in range(0, len(messages), DIGEST_MESSAGES_PER_SESSION)]
+
+    def send_chunk(chunk):
+        try:
+            return mailer.send_messages(chunk, limiter.acquire)
+        except Exception as e:
+            # No session could be opened: every message of the chunk failed this time.
+            return [e] * len(chunk)
+
+    if senders <= 1 or len(chunks) <= 1:
+        results = map(send_chunk, chunks)
+    else:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=senders, thread_name_prefix="digest-sender") as pool:
+            results = list(pool.map(send_chunk, chunks))
+    return [error for chunk_results in results for error in chunk_results]
+
+
+def run_batch(now, batch_size=DIGEST_BATCH_SIZE, senders=DIGEST_SENDERS, limiter=None):
+    """Claim, render, send and record one batch of due digests.
+
+    Returns a dict of counts and timings, or None when no digest is due.
+    """
+    limiter = limiter or RateLimiter(DIGEST_RATE_PER_SECOND)
+    t0 = time.perf_counter()
+    claimed = database.claim_due_digests(now, batch_size, DIGEST_LEASE_SECONDS)
+    if not claimed:
+        return None
+    notes = database.get_new_notes([(row[0], row[4], row[5]) for row in claimed], DIGEST_MAX_NOTES + 1)
+    t1 = time.perf_counter()
+
+    updates, outgoing = [], []
+    for user_id, frequency, email, scheduled_at, after_ts, after_id in claimed:
+        next_at = _next_run(scheduled_at, frequency, now)
+        rows = notes.get(user_id)
+        if not rows:
+            updates.append((user_id, next_at, after_ts, after_id))
+            continue
+        more = len(rows) > DIGEST_MAX_NOTES
+        rows = rows[:DIGEST_MAX_NOTES]
+        outgoing.append((user_id, next_at, rows[-1][1], rows[-1][2], after_ts, after_id,
+                         build_digest(email, rows, more), len(rows)))
+    t2 = time.perf_counter()
+
+    errors = _send_all([item[6] for item in outgoing], senders, limiter)
+    t3 = time.perf_counter()
+
+    sent = failed = notes_sent = 0
+    for (user_id, next_at, last_ts, last_id, after_ts, after_id, _, count), error in zip(outgoing, errors):
+        if error is None:
+            updates.append((user_id, next_at, last_ts, last_id))
+            sent += 1
+            notes_sent += count
+        else:
+            logger.warning(f"Digest for {user_id} failed, retrying in {DIGEST_RETRY_SECONDS}s: {error}")
+            updates.append((user_id, now + DIGEST_RETRY_SECONDS, after_ts, after_id))
+            failed += 1
+    database.record_digests(updates)
+    t4 = time.perf_counter()
+
+    stats = {
+        "claimed": len(claimed), "sent": sent, "failed": failed, "empty": len(claimed) - len(outgoing),
+        "notes": notes_sent, "query_s": t1 - t0, "render_s": t2 - t1, "send_s": t3 - t2, "record_s": t4 - t3,
+        "total_s": t4 - t0,
+    }
+    logger.info(f"Digest batch: {len(claimed)} users, {sent} sent, {failed} failed, {stats['empty']} without new "
+                f"notes; query {stats['query_s'] * 1000:.0f} ms, render {stats['render_s'] * 1000:.0f} ms, "
+                f"send {stats['send_s']:.2f} s ({sent / stats['send_s'] if stats['send_s'] else 0:.0f} msg/s), "
+                f"{len(claimed) / stats['total_s']:.0f} users/s")
+    return stats
+
+
+def run_once(now=None, batch_size=DIGEST_BATCH_SIZE, senders=DIGEST_SENDERS, rate=DIGEST_RATE_PER_SECOND):
+    """Send every digest due at `now`, batch by batch. Returns the per-batch stats."""
+    now = int(now if now is not None else time.time())
+    limiter = RateLimiter(rate)
+    batches = []
+    while True:
+        stats = run_batch(now, batch_size, senders, limiter)
+        if stats is None:
+            break
+        batches.append(stats)
+        if stats["claimed"] < batch_size:
+            break
+    return batches
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Send due digest emails.")
+    parser.add_argument("--once", action="store_true", help="send what is due now and exit")
+    parser.add_argument("--interval", type=int, default=DIGEST_INTERVAL, help="seconds between runs")
+    parser.add_argument("--batch-size", type=int, default=DIGEST_BATCH_SIZE)
+    parser.add_argument("--senders", type=int, default=DIGEST_SENDERS)
+    parser.add_argument("--rate", type=float, default=DIGEST_RATE_PER_SECOND, help="messages per second (0 = no limit)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    database.init_db()
+    while True:
+        batches = run_once(batch_size=args.batch_size, senders=args.senders, rate=args.rate)
+        if batches:
+            logger.info(f"Digest run finished: {sum(b['sent'] for b in batches)} sent, "
+                        f"{sum(b['failed'] for b in batches)} failed in {len(batches)} batch(es)")
+        if args.once:
+            break
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""Server-side store for notes being dictated.
+
+The session only carries a short draft id; the utterances themselves live
+here, so request and response envelopes stay the same size however long the
+dictation runs. With DRAFT_SPILL off, fragments live in a per-process dict,
+which is only correct when a single worker serves every request. With
+DRAFT_SPILL on (the default) they are appended to SQLite instead, so any
+gunicorn worker can continue a session and a draft survives a crash.
+Drafts idle for longer than DRAFT_TIMEOUT (session gone without a clean
+finish) are saved as notes rather than thrown away.
+"""
+import logging
+import os
+import threading
+import time
+import uuid
+
+import database
+import ingest
+
+logger = logging.getLogger(__name__)
+
+DRAFT_SPILL = os.environ.get("DRAFT_SPILL", "True").lower() == "true"
+DRAFT_TIMEOUT = int(os.environ.get("DRAFT_TIMEOUT", 900))
+DRAFT_EVICT_INTERVAL = int(os.environ.get("DRAFT_EVICT_INTERVAL", 60))
+
+
+class _Draft:
+    __slots__ = ("user_id", "fragments", "touched")
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.fragments = []
+        self.touched = time.monotonic()
+
+
+class DraftStore:
+    """Dictation drafts keyed by a short id kept in the session attributes."""
+
+    def __init__(self, spill=DRAFT_SPILL, timeout=DRAFT_TIMEOUT):
+        self.spill = spill
+        self.timeout = timeout
+        self._drafts = {}
+        self._lock = threading.Lock()
+        self._last_eviction = time.monotonic()
+
+    def start(self, user_id):
+        """Open a new empty draft and return its id."""
+        self.maybe_evict()
+        draft_id = uuid.uuid4().hex[:16]
+        if self.spill:
+            database.create_draft(draft_id, user_id)
+        else:
+            with self._lock:
+                self._drafts[draft_id] = _Draft(user_id)
+        return draft_id
+
+    def append(self, draft_id, user_id, fragment):
+        """Add one utterance to a draft (amortized O(1): a list append, or one indexed insert when spilling)."""
+        if self.spill:
+            database.append_draft_fragment(draft_id, user_id, fragment)
+            return
+        with self._lock:
+            draft = self._drafts.get(draft_id)
+            if draft is None:
+                draft = self._drafts[draft_id] = _Draft(user_id)
+            draft.fragments.append(fragment)
+            draft.touched = time.monotonic()
+
+    def fragments(self, draft_id):
+        """All fragments of a draft, in dictation order."""
+        if self.spill:
+            return database.get_draft_fragments(draft_id)
+        with self._lock:
+            draft = self._drafts.get(draft_id)
+            return list(draft.fragments) if draft else []
+
+    def get_text(self, draft_id):
+        """The dictated note so far."""
+        return " ".join(self.fragments(draft_id)) if draft_id else ""
+
+    def has_content(self, draft_id):
+        return bool(draft_id) and bool(self.fragments(draft_id))
+
+    def discard(self, draft_id):
+        """Drop a draft without saving it."""
+        if not draft_id:
+            return
+        with self._lock:
+            self._drafts.pop(draft_id, None)
+        if self.spill:
+            database.delete_draft(draft_id)
+
+    def _claim(self, draft_id, updated_before=None):
+        """Take a draft out of the store: (user_id, fragments), or None if it is gone or was touched since `updated_before`.
+
+        Only one caller can claim a given draft, however many workers sweep at once.
+        """
+        if self.spill:
+            return database.claim_draft(draft_id, updated_before)
+        with self._lock:
+            draft = self._drafts.get(draft_id)
+            if draft is None or (updated_before is not None and draft.touched >= updated_before):
+                return None
+            del self._drafts[draft_id]
+        return draft.user_id, draft.fragments
+
+    def _restore(self, draft_id, user_id, fragments):
+        if self.spill:
+            for fragment in fragments:
+                database.append_draft_fragment(draft_id, user_id, fragment)
+            return
+        draft = _Draft(user_id)
+        draft.fragments = list(fragments)
+        with self._lock:
+            self._drafts.setdefault(draft_id, draft)
+
+    def recover(self, draft_id, updated_before=None):
+        """Save whatever was dictated as a note and drop the draft. Returns True if this call saved a note.
+
+        With `updated_before`, a draft touched since then is left alone.
+        """
+        if not draft_id:
+            return False
+        claimed = self._claim(draft_id, updated_before)
+        if claimed is None:
+            return False
+        user_id, fragments = claimed
+        text = " ".join(fragments)
+        if not (text and user_id):
+            return False
+        try:
+            ingest.save_note(text, user_id)
+        except Exception:
+            # Put it back so the next sweep tries again.
+            self._restore(draft_id, user_id, fragments)
+            raise
+        logger.info(f"Recovered draft {draft_id} ({len(text)} chars) for user {user_id}")
+        return True
+
+    def maybe_evict(self):
+        """Run evict_expired at most once every DRAFT_EVICT_INTERVAL seconds.
+
+        Called when a draft is started and from the outbox workers' idle loop,
+        so abandoned drafts are recovered even when nobody dictates.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_eviction < DRAFT_EVICT_INTERVAL:
+                return
+            self._last_eviction = now
+        try:
+            self.evict_expired()
+        except Exception as e:
+            logger.error(f"Draft eviction failed: {e}", exc_info=True)
+
+    def evict_expired(self):
+        """Recover drafts idle for longer than the timeout; their session is gone without a clean finish."""
+        if self.spill:
+            cutoff = int(time.time()) - self.timeout
+            expired = database.get_stale_drafts(cutoff)
+        else:
+            cutoff = time.monotonic() - self.timeout
+            with self._lock:
+                expired = [draft_id for draft_id, draft in self._drafts.items() if draft.touched < cutoff]
+        for draft_id in expired:
+            self.recover(draft_id, cutoff)
+
+
+store = DraftStore()
@@ -0,0 +1,96 @@
+"""Streaming email export of a user's notes.
+
+Notes are read from the database cursor in batches, rendered line by line
+and written into the current message part; once a part reaches
+EXPORT_MAX_BYTES it is yielded and a new one starts. Only one part is held
+in memory at a time, whatever the size of the history.
+
+EXPORT_FORMAT selects how notes are carried:
+    inline  notes in the message body (default)
+    txt     short body plus a notes.txt attachment
+    csv     short body plus a notes.csv attachment (number, date, content)
+"""
+import csv
+import io
+import os
+
+import config
+import database
+import mailer
+import rendering
+
+EXPORT_FORMAT = os.environ.get("EXPORT_FORMAT", "inline").lower()
+EXPORT_MAX_BYTES = int(os.environ.get("EXPORT_MAX_BYTES", 5 * 1024 * 1024))
+EXPORT_FETCH_SIZE = int(os.environ.get("EXPORT_FETCH_SIZE", 500))
+
+MSG_EMAIL_SUBJECT = config.get().messages["MSG_EMAIL_SUBJECT"]
+MSG_EMAIL_BODY_PREFIX = config.get().messages["MSG_EMAIL_BODY_PREFIX"]
+MSG_EMAIL_PART_SUFFIX = config.get().messages["MSG_EMAIL_PART_SUFFIX"]
+
+
+def _iter_chunks(lines, max_bytes):
+    """Group lines into text chunks of at most ~max_bytes UTF-8 bytes (a single longer line is kept whole)."""
+    buf = io.StringIO()
+    size = 0
+    for line in lines:
+        line_size = len(line.encode("utf-8"))
+        if size and size + line_size > max_bytes:
+            yield buf.getvalue()
+            buf = io.StringIO()
+            size = 0
+        buf.write(line)
+        size += line_size
+    if size:
+        yield buf.getvalue()
+
+
+def iter_csv_lines(rows):
+    """Yield the CSV export of (content, timestamp) rows one line at a time, header first."""
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(("numero", "data", "nota"))
+    for num, (content, timestamp) in enumerate(rows, 1):
+        writer.writerow((num, rendering.format_timestamp(timestamp), content))
+        yield out.getvalue()
+        out.seek(0)
+        out.truncate()
+
+
+def _subject(part):
+    return MSG_EMAIL_SUBJECT if part == 1 else MSG_EMAIL_SUBJECT + MSG_EMAIL_PART_SUFFIX.format(part=part)
+
+
+def _build(recipient, part, chunk, export_format):
+    # Imported here: the web process loads this module long before (if ever) building an export.
+    from email.mime.application import MIMEApplication
+    from email.mime.multipart import MIMEMultipart
+    from email.mime.text import MIMEText
+
+    if export_format == "inline":
+        msg = MIMEText(MSG_EMAIL_BODY_PREFIX + chunk if part == 1 else chunk)
+    else:
+        msg = MIMEMultipart()
+        msg.attach(MIMEText(MSG_EMAIL_BODY_PREFIX.strip()))
+        if export_format == "csv":
+            attachment = MIMEApplication(chunk.encode("utf-8"), "csv")
+            filename = f"note-{part}.csv"
+        else:
+            attachment = MIMEText(chunk)
+            filename = f"note-{part}.txt"
+        attachment.add_header("Content-Disposition", "attachment", filename=filename)
+        msg.attach(attachment)
+    msg['Subject'] = _subject(part)
+    msg['From'] = mailer.get_config().sender
+    msg['To'] = recipient
+    return msg
+
+
+def iter_export_messages(user_id, recipient, export_format=EXPORT_FORMAT, max_bytes=EXPORT_MAX_BYTES):
+    """Yield the export of a user's notes as one or more email messages, built lazily."""
+    rows = database.iter_all_notes(user_id, EXPORT_FETCH_SIZE)
+    if export_format == "csv":
+        lines = iter_csv_lines(rows)
+    else:
+        lines = (line + "\n" for line in rendering.iter_email_lines(rows))
+    for part, chunk in enumerate(_iter_chunks(lines, max_bytes), 1):
+        yield _build(recipient, part, chunk, export_format)
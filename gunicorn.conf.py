@@ -0,0 +1,56 @@
+"""Gunicorn settings for serving main:app.
+
+    gunicorn -c gunicorn.conf.py
+
+The app is preloaded: main.py is imported once in the master, so settings
+are validated, the schema is migrated and signing certificates are
+prewarmed once, and the workers fork with all modules already loaded
+(shared copy-on-write pages instead of one import per worker). Background
+threads do not survive fork, so they are started in each worker instead.
+
+Each worker writes its metrics to PROMETHEUS_MULTIPROC_DIR (a fresh
+directory under the system temp dir unless set) so /metrics reports the
+whole service; see metrics.py.
+"""
+import os
+import shutil
+import tempfile
+
+wsgi_app = "main:app"
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:5000")
+workers = int(os.environ.get("GUNICORN_WORKERS", 4))
+preload_app = os.environ.get("GUNICORN_PRELOAD", "true").lower() == "true"
+# Read by config.SkillConfig while the master imports main.py.
+raw_env = ["START_BACKGROUND_TASKS=false"]
+# Set before the app is loaded so metrics.py, in the master and every worker, sees it.
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "blocco-note-metrics"))
+
+
+def on_starting(server):
+    # Counts of a previous run would otherwise be added to this one.
+    directory = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory, exist_ok=True)
+
+
+def when_ready(server):
+    import database
+
+    # The master is done with the database; workers open their own connections.
+    database.backend.close()
+
+
+def post_fork(server, worker):
+    import cache
+    import main
+
+    # The per-process memory cache would serve stale notes once another worker writes.
+    cache.use_shared_backend_for(server.cfg.workers)
+    main.start_background_tasks()
+
+
+def child_exit(server, worker):
+    import metrics
+
+    # Keep the exited worker's histogram counts, drop its file.
+    metrics.mark_process_dead(worker.pid)
@@ -0,0 +1,123 @@
+"""Group-commit ingestion for saved notes.
+
+Concurrent save requests are queued and a single writer thread inserts
+them with executemany in one transaction. Each flush takes everything queued
+so far, up to INGEST_MAX_BATCH notes; notes arriving while a commit is in
+progress form the next batch, so batches grow with load on their own.
+INGEST_MAX_DELAY_MS optionally lingers before a flush to gather more. The writer's
+connection runs with synchronous=FULL, and save_note() only returns after
+the transaction holding the note has committed, so a note is on disk before
+the skill answers "Salvato". One fsync is paid per batch instead of per note.
+"""
+import logging
+import os
+import queue
+import threading
+import time
+
+import database
+
+logger = logging.getLogger(__name__)
+
+INGEST_GROUP_COMMIT = os.environ.get("INGEST_GROUP_COMMIT", "True").lower() == "true"
+INGEST_MAX_BATCH = int(os.environ.get("INGEST_MAX_BATCH", 256))
+INGEST_MAX_DELAY_MS = float(os.environ.get("INGEST_MAX_DELAY_MS", 0))
+# How long a request waits for the writer to pick its note up before giving up.
+# A note already being committed is waited for until the commit finishes.
+INGEST_COMMIT_TIMEOUT = float(os.environ.get("INGEST_COMMIT_TIMEOUT", 10))
+
+
+class _Pending:
+    __slots__ = ("note", "done", "error", "taken", "cancelled")
+
+    def __init__(self, note):
+        self.note = note
+        self.done = threading.Event()
+        self.error = None
+        # Guarded by GroupCommitWriter._claim_lock: exactly one of them is ever set.
+        self.taken = False
+        self.cancelled = False
+
+
+class GroupCommitWriter:
+    """Single writer thread batching queued notes into one transaction per flush."""
+
+    def __init__(self, max_batch=INGEST_MAX_BATCH, max_delay_ms=INGEST_MAX_DELAY_MS):
+        self.max_batch = max_batch
+        self.max_delay = max_delay_ms / 1000
+        self._queue = queue.Queue()
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._claim_lock = threading.Lock()
+
+    def _ensure_started(self):
+        # Started lazily, and again after a fork, since threads do not survive fork.
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                self._queue = queue.Queue()
+                self._thread = threading.Thread(target=self._run, name="note-writer", daemon=True)
+                self._pid = os.getpid()
+                self._thread.start()
+
+    def save_note(self, text, user_id):
+        """Queue a note and block until it is committed. Raises if the batch failed.
+
+        A TimeoutError means the note was withdrawn before any batch took it,
+        so it is never saved and a retry cannot store it twice.
+        """
+        self._ensure_started()
+        pending = _Pending((text, user_id, int(time.time())))
+        self._queue.put(pending)
+        if not pending.done.wait(INGEST_COMMIT_TIMEOUT):
+            with self._claim_lock:
+                if not pending.taken:
+                    pending.cancelled = True
+            if pending.cancelled:
+                raise TimeoutError("note was not committed in time")
+            # Already in a batch being committed: its outcome is the answer.
+            pending.done.wait()
+        if pending.error is not None:
+            raise pending.error
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            with self._claim_lock:
+                batch = [pending for pending in batch if not pending.cancelled]
+                for pending in batch:
+                    pending.taken = True
+            if not batch:
+                continue
+            try:
+                database.save_notes_batch([pending.note for pending in batch], durable=True)
+            except Exception as e:
+                logger.error(f"Failed to commit {len(batch)} note(s): {e}", exc_info=True)
+                for pending in batch:
+                    pending.error = e
+            for pending in batch:
+                pending.done.set()
+
+
+_writer = GroupCommitWriter()
+
+
+def save_note(text, user_id):
+    """Durably save a note, through the group-commit writer unless INGEST_GROUP_COMMIT is off."""
+    if INGEST_GROUP_COMMIT:
+        _writer.save_note(text, user_id)
+    else:
+        database.save_note(text, user_id)
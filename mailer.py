@@ -0,0 +1,304 @@
+"""SMTP transport.
+
+SMTP_* settings are parsed once into an SmtpConfig. Authenticated sessions
+are kept in a bounded pool and reused across sends: an idle connection is
+checked with NOOP before reuse and replaced if the server dropped it.
+send_messages() delivers several messages over one session. smtplib and
+email.mime are imported on first use, since most processes that import
+this module (web workers between exports) never send anything.
+"""
+import collections
+import contextlib
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+SMTP_POOL_SIZE = int(os.environ.get("SMTP_POOL_SIZE", 4))
+# Idle time after which a pooled connection is probed with NOOP before reuse.
+SMTP_HEALTH_CHECK_AFTER = float(os.environ.get("SMTP_HEALTH_CHECK_AFTER", 10))
+# Idle time after which a pooled connection is closed instead of reused.
+SMTP_MAX_IDLE = float(os.environ.get("SMTP_MAX_IDLE", 240))
+SMTP_TIMEOUT = float(os.environ.get("SMTP_TIMEOUT", 30))
+
+
+class SmtpConfig:
+    """SMTP settings read from the environment once."""
+
+    def __init__(self, server, port, user, password, encryption):
+        self.server = server
+        self.port = port
+        self.user = user
+        self.password = password
+        self.encryption = encryption
+        self.sender = user if user else "alexa@local.test"
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            server=os.environ.get("SMTP_SERVER") or None,
+            port=int(os.environ.get("SMTP_PORT") or 587),
+            # Robust handling for optional credentials
+            user=os.environ.get("SMTP_USER", "").strip() or None,
+            password=os.environ.get("SMTP_PASSWORD", "").strip() or None,
+            encryption=os.environ.get("SMTP_ENCRYPTION", "STARTTLS").upper(),
+        )
+
+    def connect(self):
+        """Open and authenticate a new SMTP session."""
+        if not self.server:
+            raise RuntimeError("SMTP server configuration missing")
+        import smtplib
+        if self.encryption == "SSL":
+            # Use implicit SSL
+            smtp = smtplib.SMTP_SSL(self.server, self.port, timeout=SMTP_TIMEOUT)
+        else:
+            smtp = smtplib.SMTP(self.server, self.port, timeout=SMTP_TIMEOUT)
+            if self.encryption == "STARTTLS":
+                # Use explicit TLS
+                smtp.starttls()
+        if self.user and self.password:
+            smtp.login(self.user, self.password)
+        return smtp
+
+
+class _PooledConnection:
+    def __init__(self, smtp):
+        self.smtp = smtp
+        self.last_used = time.monotonic()
+        self.broken = False
+
+
+class SmtpPool:
+    """Bounded pool of authenticated SMTP sessions with NOOP health checks."""
+
+    def __init__(self, config, max_size=SMTP_POOL_SIZE):
+        self.config = config
+        self.max_size = max_size
+        self._idle = collections.deque()
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._stats = collections.Counter()
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self._stats[name] += n
+
+    def metrics(self):
+        """Counters: connections_opened/reused/closed, health_checks, health_check_failures, reconnects, messages_sent, send_errors."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["idle_connections"] = len(self._idle)
+        return stats
+
+    def _open(self):
+        conn = _PooledConnection(self.config.connect())
+        self._count("connections_opened")
+        return conn
+
+    def _close(self, conn):
+        self._count("connections_closed")
+        try:
+            conn.smtp.quit()
+        except Exception:
+            conn.smtp.close()
+
+    def _checkout(self):
+        while True:
+            with self._lock:
+                conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                return self._open()
+
+            idle_for = time.monotonic() - conn.last_used
+            if idle_for > SMTP_MAX_IDLE:
+                self._close(conn)
+                continue
+            if idle_for > SMTP_HEALTH_CHECK_AFTER:
+                import smtplib
+                self._count("health_checks")
+                try:
+                    code, _ = conn.smtp.noop()
+                except smtplib.SMTPException:
+                    code = None
+                except OSError:
+                    code = None
+                if code != 250:
+                    self._count("health_check_failures")
+                    conn.smtp.close()
+                    continue
+            self._count("connections_reused")
+            return conn
+
+    @contextlib.contextmanager
+    def session(self):
+        """Yield a pooled connection; it goes back to the pool unless the block raised."""
+        self._slots.acquire()
+        conn = None
+        try:
+            conn = self._checkout()
+            yield conn
+        except Exception:
+            if conn is not None:
+                conn.smtp.close()
+                conn = None
+            raise
+        finally:
+            if conn is not None and conn.broken:
+                conn.smtp.close()
+            elif conn is not None:
+                conn.last_used = time.monotonic()
+                with self._lock:
+                    self._idle.append(conn)
+            self._slots.release()
+
+    def _send_one(self, conn, msg):
+        import smtplib
+        try:
+            conn.smtp.send_message(msg)
+        except smtplib.SMTPServerDisconnected:
+            # Dropped between messages: reconnect once and retry this message.
+            self._count("reconnects")
+            conn.smtp.close()
+            conn.smtp = self.config.connect()
+            self._count("connections_opened")
+            conn.smtp.send_message(msg)
+        self._count("messages_sent")
+
+    def send_messages(self, messages, throttle=None):
+        """Send messages over one pooled session. Returns a list with None or the exception for each message.
+
+        `throttle`, if given, is called before each message (e.g. a rate limiter's acquire).
+        """
+        import smtplib
+        results = []
+        with self.session() as conn:
+            for msg in messages:
+                if throttle is not None:
+                    throttle()
+                try:
+                    self._send_one(conn, msg)
+                except (smtplib.SMTPRecipientsRefused, smtplib.SMTPDataError, smtplib.SMTPSenderRefused) as e:
+                    # Per-message rejection: the session is still usable, reset it for the next one.
+                    self._count("send_errors")
+                    results.append(e)
+                    try:
+                        conn.smtp.rset()
+                    except Exception as reset_error:
+                        # Could not reset: the rest of the batch fails like on a dropped session.
+                        conn.broken = True
+                        results.extend([reset_error] * (len(messages) - len(results)))
+                        break
+                    continue
+                except Exception as e:
+                    # Session is unusable: fail this and the remaining messages without losing earlier results.
+                    self._count("send_errors")
+                    conn.broken = True
+                    results.extend([e] * (len(messages) - len(results)))
+                    break
+                results.append(None)
+        return results
+
+    def send_stream(self, messages, on_sent=None):
+        """Send messages pulled lazily from an iterable over one pooled session.
+
+        Calls on_sent(index) after each delivered message and raises on the
+        first failure, so a caller can resume from the last acknowledged index.
+        An exception raised by on_sent stops the stream too, but the session
+        is not at fault, so its connection goes back to the pool.
+        """
+        stopped = None
+        with self.session() as conn:
+            for index, msg in enumerate(messages):
+                try:
+                    self._send_one(conn, msg)
+                except Exception:
+                    self._count("send_errors")
+                    raise
+                if on_sent is not None:
+                    try:
+                        on_sent(index)
+                    except Exception as e:
+                        stopped = e
+                        break
+        if stopped is not None:
+            raise stopped
+
+    def close(self):
+        """Close all idle connections."""
+        with self._lock:
+            idle, self._idle = list(self._idle), collections.deque()
+        for conn in idle:
+            self._close(conn)
+
+
+_config = None
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_config():
+    """The SmtpConfig parsed from the environment on first use."""
+    global _config
+    if _config is None:
+        _config = SmtpConfig.from_env()
+    return _config
+
+
+def get_pool():
+    """The process-wide SmtpPool, created on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = SmtpPool(get_config())
+        return _pool
+
+
+def reset():
+    """Drop the cached config and pool, e.g. after the SMTP_* environment changed."""
+    global _config, _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+        _config, _pool = None, None
+
+
+def is_configured():
+    """True if an SMTP server is configured."""
+    return bool(get_config().server)
+
+
+def build_message(recipient, subject, body):
+    """Build a plain-text message from the configured sender."""
+    from email.mime.text import MIMEText
+    msg = MIMEText(body)
+    msg['Subject'] = subject
+    msg['From'] = get_config().sender
+    msg['To'] = recipient
+    return msg
+
+
+def send_messages(messages, throttle=None):
+    """Deliver messages over one pooled session. Returns a list with None or the exception for each message."""
+    cfg = get_config()
+    logger.info(f"Sending {len(messages)} email(s) via {cfg.server}:{cfg.port} ({cfg.encryption})")
+    return get_pool().send_messages(messages, throttle)
+
+
+def send_stream(messages, on_sent=None):
+    """Deliver messages from an iterable over one pooled session; see SmtpPool.send_stream."""
+    return get_pool().send_stream(messages, on_sent)
+
+
+def send_message(msg):
+    """Deliver one message over a pooled session. Raises on failure."""
+    error = send_messages([msg])[0]
+    if error is not None:
+        raise error
+
+
+def metrics():
+    """Connection reuse counters for the process-wide pool."""
+    return get_pool().metrics() if _pool is not None else {}
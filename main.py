@@ -1,81 +1,187 @@
-from flask import Flask, request
 from dotenv import load_dotenv
-import os
 import logging
+import os
+import time
+from xml.sax.saxutils import escape
 
 # Load environment variables first
 load_dotenv(override=True)
 
 from ask_sdk_core.skill_builder import SkillBuilder
-from ask_sdk_core.dispatch_components import AbstractRequestHandler, AbstractExceptionHandler
-from ask_sdk_core.utils import is_request_type, is_intent_name
-from ask_sdk_core.handler_input import HandlerInput
-from ask_sdk_core.api_client import DefaultApiClient
-from ask_sdk_model import Response
-from ask_sdk_model.ui import SimpleCard
+from ask_sdk_core.dispatch_components import AbstractExceptionHandler
+from ask_sdk_core.dispatch_components import AbstractRequestInterceptor, AbstractResponseInterceptor
+from ask_sdk_core.utils import get_request_type, get_intent_name
+from ask_sdk_model.ui import AskForPermissionsConsentCard
 from ask_sdk_webservice_support.webservice_handler import WebserviceSkillHandler
-from ask_sdk_model.services.ups import UpsServiceClient
-from ask_sdk_model.services.service_exception import ServiceException
+from ask_sdk_webservice_support.verifier import AbstractVerifier, TimestampVerifier
 from ask_sdk_model.dialog import ElicitSlotDirective
-import smtplib
-from email.mime.text import MIMEText
-from datetime import datetime
+import alexa_api
+import cache
+import config
 import database
+import digest
+import drafts
+import ingest
+import mailer
+import metrics
+import outbox
+import rendering
+import retention
+import routing
+import verification
 
-app = Flask(__name__)
 sb = SkillBuilder()
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
-# Initialize DB
+# Read and validate every setting once; a bad value stops the process here
+skill_config = config.get()
+
+# Initialize DB (once in the gunicorn master when the app is preloaded)
 database.init_db()
 
-# Load message constants from environment variables
-MSG_LAUNCH = os.environ.get("MSG_LAUNCH", "Ciao, cosa vuoi fare? Scrivi, Rileggi, Invia o Chiudi?")
-MSG_MENU_FULL = os.environ.get("MSG_MENU_FULL", "Cosa vuoi fare ora? Scrivi, Rileggi, Invia o Chiudi?")
-MSG_MENU_SHORT = os.environ.get("MSG_MENU_SHORT", "Cosa vuoi fare?")
-MSG_START_WRITING = os.environ.get("MSG_START_WRITING", "Dimmi pure.")
-MSG_NOTE_RECEIVED = os.environ.get("MSG_NOTE_RECEIVED", "Ricevuto. Altro?")
-MSG_NOTE_SAVED = os.environ.get("MSG_NOTE_SAVED", "Salvato. Cosa vuoi fare ora? Scrivi, Rileggi, Invia o Chiudi?")
-MSG_NOTHING_SAID = os.environ.get("MSG_NOTHING_SAID", "Non hai detto nulla. Cosa vuoi fare ora?")
-MSG_NOT_WRITING = os.environ.get("MSG_NOT_WRITING", "Non stavo scrivendo. Cosa vuoi fare? Scrivi, Rileggi, Invia o Chiudi?")
-MSG_PENDING_NOTE = os.environ.get("MSG_PENDING_NOTE", "Hai una nota in sospeso. Di 'Fine' per salvarla, o continua a dettare.")
-MSG_PENDING_NOTE_SEND = os.environ.get("MSG_PENDING_NOTE_SEND", "Hai una nota in sospeso. Di 'Fine' per salvarla prima di inviare.")
-MSG_WRITING_IN_PROGRESS = os.environ.get("MSG_WRITING_IN_PROGRESS", "Stai scrivendo. Di 'Fine' quando hai finito.")
-MSG_NO_NOTES = os.environ.get("MSG_NO_NOTES", "Non hai ancora salvato nessuna nota. Cosa vuoi fare?")
-MSG_READ_NOTES_PREFIX = os.environ.get("MSG_READ_NOTES_PREFIX", "Ecco le tue ultime note: ")
-MSG_NOTE_FORMAT = os.environ.get("MSG_NOTE_FORMAT", "Nota {num} del {date}: {content}")
-MSG_EMAIL_SENT = os.environ.get("MSG_EMAIL_SENT", "Email inviata. Cosa vuoi fare ora? Scrivi, Rileggi, Invia o Chiudi?")
-MSG_EMAIL_PERMISSION = os.environ.get("MSG_EMAIL_PERMISSION", "Per inviare le note, ho bisogno del permesso di accedere alla tua email. Ho inviato una scheda alla tua app Alexa. Per favore abilita i permessi nelle impostazioni.")
-MSG_EMAIL_NOT_FOUND = os.environ.get("MSG_EMAIL_NOT_FOUND", "Non riesco a trovare il tuo indirizzo email. Controlla le impostazioni.")
-MSG_NO_NOTES_TO_SEND = os.environ.get("MSG_NO_NOTES_TO_SEND", "Non ci sono note da inviare.")
-MSG_EMAIL_ERROR = os.environ.get("MSG_EMAIL_ERROR", "C'è stato un errore nell'invio dell'email.")
-MSG_EMAIL_SUBJECT = os.environ.get("MSG_EMAIL_SUBJECT", "Le tue note Alexa")
-MSG_EMAIL_BODY_PREFIX = os.environ.get("MSG_EMAIL_BODY_PREFIX", "Ecco le tue note:\n\n")
-MSG_HELP = os.environ.get("MSG_HELP", "Puoi dirmi di scrivere una nota o di rileggere le tue note. Cosa vuoi fare?")
-MSG_NOT_UNDERSTOOD = os.environ.get("MSG_NOT_UNDERSTOOD", "Non ho capito. Vuoi scrivere, rileggere o inviare?")
-MSG_GOODBYE = os.environ.get("MSG_GOODBYE", "Arrivederci!")
-MSG_ERROR = os.environ.get("MSG_ERROR", "Scusa, ho avuto un problema. Riprova.")
-MSG_SMTP_CONFIG_ERROR = os.environ.get("MSG_SMTP_CONFIG_ERROR", "Errore di configurazione del server email.")
-MSG_RETENTION_SET = os.environ.get("MSG_RETENTION_SET", "Ho impostato la scadenza a {days} giorni.")
-MSG_CLEANUP_DONE = os.environ.get("MSG_CLEANUP_DONE", "Ho cancellato {count} vecchie note.")
+# Parse SMTP settings once; pooled sessions are opened on first send
+smtp_config = mailer.get_config()
+logger.info(f"SMTP Config: Server={smtp_config.server}:{smtp_config.port}, Encryption={smtp_config.encryption}, Auth={'Yes' if smtp_config.user else 'No'}")
+
+_background_pid = None
+
+def start_background_tasks():
+    """Start the retention sweeper and outbox workers in this process, once.
+
+    Threads do not survive fork, so a preloaded gunicorn master leaves this
+    to each worker (see gunicorn.conf.py).
+    """
+    global _background_pid
+    if _background_pid == os.getpid():
+        return
+    _background_pid = os.getpid()
+    # Expire old notes in the background instead of on LaunchRequest
+    retention.start_background_sweeper()
+    # Deliver queued emails in the background; idle workers also recover abandoned drafts
+    outbox.start_workers(idle_tasks=[drafts.store.maybe_evict])
+    # Share this process's metrics with the other workers (PROMETHEUS_MULTIPROC_DIR)
+    metrics.start_multiprocess_writer()
+
+if skill_config.start_background_tasks:
+    start_background_tasks()
+
+# Time database calls and SMTP traffic wherever they come from (handlers, outbox, sweeper)
+DB_OPERATIONS = [
+    "save_note", "save_notes_batch", "get_notes", "get_notes_page", "get_all_notes", "has_notes",
+    "set_retention_days", "get_retention_days", "delete_expired_notes", "delete_notes_before", "enqueue_email", "claim_emails",
+    "create_draft", "append_draft_fragment", "get_draft_fragments", "delete_draft", "search_notes",
+    "set_digest", "update_digest_email",
+]
+metrics.instrument(database, DB_OPERATIONS, metrics.db_operation_seconds)
+metrics.instrument(ingest, {"save_note": "ingest.save_note"}, metrics.db_operation_seconds)
+metrics.instrument(mailer.SmtpConfig, {"connect": "smtp_connect"}, metrics.external_call_seconds)
+metrics.instrument(mailer.SmtpPool, {"_send_one": "smtp_send"}, metrics.external_call_seconds)
+metrics.register_collector("cache_events", cache.stats)
+metrics.register_collector("smtp_pool", mailer.metrics)
+metrics.register_collector("profile_email_cache", alexa_api.stats)
+
+# Message constants (defaults and environment overrides in config.py)
+MSG_LAUNCH = skill_config.messages["MSG_LAUNCH"]
+MSG_MENU_FULL = skill_config.messages["MSG_MENU_FULL"]
+MSG_MENU_SHORT = skill_config.messages["MSG_MENU_SHORT"]
+MSG_START_WRITING = skill_config.messages["MSG_START_WRITING"]
+MSG_NOTE_RECEIVED = skill_config.messages["MSG_NOTE_RECEIVED"]
+MSG_NOTE_SAVED = skill_config.messages["MSG_NOTE_SAVED"]
+MSG_NOTHING_SAID = skill_config.messages["MSG_NOTHING_SAID"]
+MSG_NOT_WRITING = skill_config.messages["MSG_NOT_WRITING"]
+MSG_PENDING_NOTE = skill_config.messages["MSG_PENDING_NOTE"]
+MSG_PENDING_NOTE_SEND = skill_config.messages["MSG_PENDING_NOTE_SEND"]
+MSG_WRITING_IN_PROGRESS = skill_config.messages["MSG_WRITING_IN_PROGRESS"]
+MSG_NO_NOTES = skill_config.messages["MSG_NO_NOTES"]
+MSG_READ_NOTES_PREFIX = skill_config.messages["MSG_READ_NOTES_PREFIX"]
+MSG_READ_MORE_PREFIX = skill_config.messages["MSG_READ_MORE_PREFIX"]
+MSG_READ_MORE_PROMPT = skill_config.messages["MSG_READ_MORE_PROMPT"]
+MSG_NO_MORE_NOTES = skill_config.messages["MSG_NO_MORE_NOTES"]
+MSG_SEARCH_ASK = skill_config.messages["MSG_SEARCH_ASK"]
+MSG_SEARCH_RESULTS_PREFIX = skill_config.messages["MSG_SEARCH_RESULTS_PREFIX"]
+MSG_NO_SEARCH_RESULTS = skill_config.messages["MSG_NO_SEARCH_RESULTS"]
+MSG_NO_PREVIOUS_NOTES = skill_config.messages["MSG_NO_PREVIOUS_NOTES"]
+MSG_EMAIL_SENT = skill_config.messages["MSG_EMAIL_SENT"]
+MSG_EMAIL_PERMISSION = skill_config.messages["MSG_EMAIL_PERMISSION"]
+MSG_EMAIL_NOT_FOUND = skill_config.messages["MSG_EMAIL_NOT_FOUND"]
+MSG_NO_NOTES_TO_SEND = skill_config.messages["MSG_NO_NOTES_TO_SEND"]
+MSG_EMAIL_ERROR = skill_config.messages["MSG_EMAIL_ERROR"]
+MSG_HELP = skill_config.messages["MSG_HELP"]
+MSG_NOT_UNDERSTOOD = skill_config.messages["MSG_NOT_UNDERSTOOD"]
+MSG_GOODBYE = skill_config.messages["MSG_GOODBYE"]
+MSG_ERROR = skill_config.messages["MSG_ERROR"]
+MSG_SMTP_CONFIG_ERROR = skill_config.messages["MSG_SMTP_CONFIG_ERROR"]
+MSG_RETENTION_SET = skill_config.messages["MSG_RETENTION_SET"]
+MSG_RETENTION_INVALID = skill_config.messages["MSG_RETENTION_INVALID"]
+MSG_CLEANUP_DONE = skill_config.messages["MSG_CLEANUP_DONE"]
+MSG_DIGEST_ASK = skill_config.messages["MSG_DIGEST_ASK"]
+MSG_DIGEST_DAILY_SET = skill_config.messages["MSG_DIGEST_DAILY_SET"]
+MSG_DIGEST_WEEKLY_SET = skill_config.messages["MSG_DIGEST_WEEKLY_SET"]
+MSG_DIGEST_OFF = skill_config.messages["MSG_DIGEST_OFF"]
+
+READ_PAGE_SIZE = skill_config.read_page_size
+SEARCH_RESULTS_LIMIT = skill_config.search_results_limit
 
 def get_user_id(handler_input):
     """Extract user_id from the Alexa request."""
     return handler_input.request_envelope.session.user.user_id
 
-class LaunchRequestHandler(AbstractRequestHandler):
-    def can_handle(self, handler_input):
-        return is_request_type("LaunchRequest")(handler_input)
+def speak_notes_page(handler_input, page_start):
+    """Read one page of notes starting at page_start = [timestamp, id, note number].
+
+    Fetches one row more than a page so we know whether older notes exist, and
+    stops early if the next note would push the speech past Alexa's SSML limit.
+    Where the following page starts is kept in the "read_next" session attribute.
+    """
+    session_attr = handler_input.attributes_manager.session_attributes
+    user_id = get_user_id(handler_input)
+    before = (page_start[0], page_start[1]) if page_start[0] is not None else None
+    first_number = page_start[2]
+
+    rows = database.get_notes_page(user_id, before, READ_PAGE_SIZE + 1)
+    if not rows:
+        session_attr["read_next"] = None
+        speak_output = MSG_NO_NOTES if before is None else MSG_NO_MORE_NOTES
+        return (
+            handler_input.response_builder
+                .speak(speak_output)
+                .ask(speak_output)
+                .response
+        )
+
+    page_rows = rows[:READ_PAGE_SIZE]
+    prefix = MSG_READ_NOTES_PREFIX if before is None else MSG_READ_MORE_PREFIX
+    # Both candidate prompts are budgeted for, since the choice depends on how many notes fit.
+    budget = (rendering.SPEECH_MAX_CHARS - len("<speak></speak>") - len(prefix) - 2
+              - max(len(MSG_READ_MORE_PROMPT), len(MSG_MENU_FULL)) - 1)
+    # "Nota 1 del [data]: [contenuto]"
+    notes_text, shown = rendering.render_speech_page(page_rows, first_number, budget)
+
+    if len(rows) > READ_PAGE_SIZE or shown < len(page_rows):
+        last = page_rows[shown - 1]
+        session_attr["read_next"] = [last[1], last[2], first_number + shown]
+        prompt = MSG_READ_MORE_PROMPT
+    else:
+        session_attr["read_next"] = None
+        prompt = MSG_MENU_FULL
+
+    speak_output = f"{prefix}{notes_text}. {prompt}"
+    return (
+        handler_input.response_builder
+            .speak(speak_output)
+            .ask(prompt)
+            .response
+    )
+
+class SpeakHandler(routing.RoutedHandler):
+    """Answers with a fixed message and keeps the session open with it."""
+
+    def __init__(self, message):
+        self.message = message
 
     def handle(self, handler_input):
-        # Run cleanup on launch
-        user_id = get_user_id(handler_input)
-        deleted = database.cleanup_old_notes(user_id)
-        if deleted > 0:
-            logger.info(f"Cleaned up {deleted} old notes for user {user_id}")
-            
-        speak_output = MSG_LAUNCH
+        speak_output = self.message
         return (
             handler_input.response_builder
                 .speak(speak_output)
@@ -83,14 +189,70 @@ class LaunchRequestHandler(AbstractRequestHandler):
                 .response
         )
 
-class StartWritingIntentHandler(AbstractRequestHandler):
-    def can_handle(self, handler_input):
-        return is_intent_name("StartWritingIntent")(handler_input)
+class PendingDraftHandler(routing.RoutedHandler):
+    """Menu intents while writing: warn about the unsaved draft, if any."""
+
+    def __init__(self, pending_message):
+        self.pending_message = pending_message
 
+    def handle(self, handler_input):
+        session_attr = handler_input.attributes_manager.session_attributes
+        if drafts.store.has_content(session_attr.get("draft_id")):
+            speak_output = self.pending_message
+        else:
+            speak_output = MSG_WRITING_IN_PROGRESS
+        return (
+            handler_input.response_builder
+                .speak(speak_output)
+                .ask(speak_output)
+                .response
+        )
+
+def finish_writing(handler_input):
+    """Save the session's draft as a note, leave WRITING state and answer."""
+    session_attr = handler_input.attributes_manager.session_attributes
+    user_id = get_user_id(handler_input)
+    draft_id = session_attr.get("draft_id")
+    full_note = drafts.store.get_text(draft_id)
+
+    # Debug logging
+    logger.debug(f"Finishing draft {draft_id}, {len(full_note)} chars")
+
+    if full_note:
+        ingest.save_note(full_note, user_id)
+        speak_output = MSG_NOTE_SAVED
+    else:
+        speak_output = MSG_NOTHING_SAID
+
+    # Reset state
+    session_attr["state"] = "MENU"
+    drafts.store.discard(draft_id)
+    session_attr["draft_id"] = None
+
+    return (
+        handler_input.response_builder
+            .speak(speak_output)
+            .ask(speak_output)
+            .response
+    )
+
+class LaunchRequestHandler(routing.RoutedHandler):
+    def handle(self, handler_input):
+        # Retention is enforced by the background sweeper (retention.py), not here
+        speak_output = MSG_LAUNCH
+        return (
+            handler_input.response_builder
+                .speak(speak_output)
+                .ask(speak_output)
+                .response
+        )
+
+class StartWritingIntentHandler(routing.RoutedHandler):
     def handle(self, handler_input):
         session_attr = handler_input.attributes_manager.session_attributes
         session_attr["state"] = "WRITING"
-        session_attr["note_buffer"] = []
+        drafts.store.discard(session_attr.get("draft_id"))
+        session_attr["draft_id"] = drafts.store.start(get_user_id(handler_input))
         
         speak_output = MSG_START_WRITING
         return (
@@ -100,59 +262,57 @@ class StartWritingIntentHandler(AbstractRequestHandler):
                 .response
         )
 
-class CaptureNoteIntentHandler(AbstractRequestHandler):
-    def can_handle(self, handler_input):
-        return is_intent_name("CaptureNoteIntent")(handler_input)
+class CaptureNoteIntentHandler(routing.RoutedHandler):
+    """Routed in WRITING state only."""
 
     def handle(self, handler_input):
         session_attr = handler_input.attributes_manager.session_attributes
-        state = session_attr.get("state")
+        slots = handler_input.request_envelope.request.intent.slots
+        note_text = slots["note"].value if slots["note"].value else ""
         
-        if state == "WRITING":
-            slots = handler_input.request_envelope.request.intent.slots
-            note_text = slots["note"].value if slots["note"].value else ""
-            
-            # Check if user said a finish keyword
-            finish_keywords = ["fine", "finito", "basta", "ho finito"]
-            if note_text.lower().strip() in finish_keywords:
-                # User wants to finish - save the note
-                user_id = get_user_id(handler_input)
-                buffer = session_attr.get("note_buffer", [])
-                full_note = " ".join(buffer)
-                if full_note:
-                    database.save_note(full_note, user_id)
-                    speak_output = MSG_NOTE_SAVED
-                else:
-                    speak_output = MSG_NOTHING_SAID
-                
-                # Reset state
-                session_attr["state"] = "MENU"
-                session_attr["note_buffer"] = []
-                
-                return (
-                    handler_input.response_builder
-                        .speak(speak_output)
-                        .ask(speak_output)
-                        .response
-                )
-            
-            # Normal note capture
-            buffer = session_attr.get("note_buffer", [])
-            buffer.append(note_text)
-            session_attr["note_buffer"] = buffer
-            
-            # Debug logging
-            logger.info(f"CaptureNoteIntent - Added '{note_text}' to buffer. Buffer now: {buffer}")
-            
-            speak_output = MSG_NOTE_RECEIVED
-            return (
-                handler_input.response_builder
-                    .speak(speak_output)
-                    .ask(speak_output)
-                    .response
-            )
-        else:
-            speak_output = MSG_NOT_UNDERSTOOD
+        # Check if user said a finish keyword
+        finish_keywords = ["fine", "finito", "basta", "ho finito"]
+        if note_text.lower().strip() in finish_keywords:
+            return finish_writing(handler_input)
+        
+        # Normal note capture
+        user_id = get_user_id(handler_input)
+        draft_id = session_attr.get("draft_id")
+        if not draft_id:
+            draft_id = session_attr["draft_id"] = drafts.store.start(user_id)
+        drafts.store.append(draft_id, user_id, note_text)
+        
+        # Debug logging
+        logger.debug(f"CaptureNoteIntent - Added {len(note_text)} chars to draft {draft_id}")
+        
+        speak_output = MSG_NOTE_RECEIVED
+        return (
+            handler_input.response_builder
+                .speak(speak_output)
+                .ask(speak_output)
+                .response
+        )
+
+class FinishIntentHandler(routing.RoutedHandler):
+    """Routed in WRITING state only."""
+
+    def handle(self, handler_input):
+        return finish_writing(handler_input)
+
+class ReadNotesIntentHandler(routing.RoutedHandler):
+    def handle(self, handler_input):
+        session_attr = handler_input.attributes_manager.session_attributes
+        # Read the first page of saved notes
+        first_page = [None, None, 1]
+        session_attr["read_pages"] = [first_page]
+        return speak_notes_page(handler_input, first_page)
+
+class NextPageIntentHandler(routing.RoutedHandler):
+    def handle(self, handler_input):
+        session_attr = handler_input.attributes_manager.session_attributes
+        next_page = session_attr.get("read_next")
+        if not next_page:
+            speak_output = MSG_NO_MORE_NOTES
             return (
                 handler_input.response_builder
                     .speak(speak_output)
@@ -160,136 +320,77 @@ class CaptureNoteIntentHandler(AbstractRequestHandler):
                     .response
             )
 
+        session_attr.setdefault("read_pages", []).append(next_page)
+        return speak_notes_page(handler_input, next_page)
 
-class FinishIntentHandler(AbstractRequestHandler):
-    def can_handle(self, handler_input):
-        return is_intent_name("FinishIntent")(handler_input)
-
+class PreviousPageIntentHandler(routing.RoutedHandler):
     def handle(self, handler_input):
         session_attr = handler_input.attributes_manager.session_attributes
-        state = session_attr.get("state")
-        
-        if state == "WRITING":
-            user_id = get_user_id(handler_input)
-            buffer = session_attr.get("note_buffer", [])
-            full_note = " ".join(buffer)
-            
-            # Debug logging
-            logger.info(f"FinishIntent triggered - Buffer: {buffer}, Full note: '{full_note}'")
-            
-            if full_note:
-                database.save_note(full_note, user_id)
-                speak_output = MSG_NOTE_SAVED
-            else:
-                speak_output = MSG_NOTHING_SAID
-            
-            # Reset state
-            session_attr["state"] = "MENU"
-            session_attr["note_buffer"] = []
-            
+        pages = session_attr.get("read_pages", [])
+        if len(pages) < 2:
+            speak_output = MSG_NO_PREVIOUS_NOTES
             return (
                 handler_input.response_builder
                     .speak(speak_output)
                     .ask(speak_output)
                     .response
             )
-        else:
-            speak_output = MSG_NOT_WRITING
+
+        pages.pop()
+        return speak_notes_page(handler_input, pages[-1])
+
+class SearchNotesIntentHandler(routing.RoutedHandler):
+    def handle(self, handler_input):
+        slots = handler_input.request_envelope.request.intent.slots or {}
+        query_slot = slots.get("query")
+        query = query_slot.value if query_slot else None
+        if not query:
             return (
                 handler_input.response_builder
-                    .speak(speak_output)
-                    .ask(speak_output)
+                    .speak(MSG_SEARCH_ASK)
+                    .ask(MSG_SEARCH_ASK)
+                    .add_directive(
+                        ElicitSlotDirective(
+                            slot_to_elicit="query",
+                            updated_intent=handler_input.request_envelope.request.intent
+                        )
+                    )
                     .response
             )
 
-class ReadNotesIntentHandler(AbstractRequestHandler):
-    def can_handle(self, handler_input):
-        return is_intent_name("ReadNotesIntent")(handler_input)
-
-    def handle(self, handler_input):
-        session_attr = handler_input.attributes_manager.session_attributes
-        state = session_attr.get("state")
-        
-        # Check if user is in WRITING mode
-        if state == "WRITING":
-            buffer = session_attr.get("note_buffer", [])
-            if buffer:
-                speak_output = MSG_PENDING_NOTE
-            else:
-                speak_output = MSG_WRITING_IN_PROGRESS
+        rows = database.search_notes(get_user_id(handler_input), query, SEARCH_RESULTS_LIMIT)
+        if not rows:
+            speak_output = MSG_NO_SEARCH_RESULTS.format(query=escape(query))
             return (
                 handler_input.response_builder
                     .speak(speak_output)
-                    .ask(speak_output)
+                    .ask(MSG_MENU_SHORT)
                     .response
             )
-        
-        # Normal flow: read saved notes
-        user_id = get_user_id(handler_input)
-        notes_data = database.get_notes(user_id)
-        if notes_data:
-            # Format notes
-            date_format = os.environ.get("DATE_FORMAT", "%d/%m/%Y %H:%M")
-            formatted_notes = []
-            
-            for i, (content, timestamp) in enumerate(notes_data, 1):
-                try:
-                    dt = datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S")
-                    formatted_date = dt.strftime(date_format)
-                except Exception as e:
-                    logger.error(f"Date parsing error: {e}")
-                    formatted_date = timestamp
-                
-                # "Nota 1 del [data]: [contenuto]"
-                formatted_notes.append(MSG_NOTE_FORMAT.format(num=i, date=formatted_date, content=content))
-            notes_text = ". ".join(formatted_notes)
-            speak_output = f"{MSG_READ_NOTES_PREFIX}{notes_text}. {MSG_MENU_FULL}"
-        else:
-            speak_output = MSG_NO_NOTES
-            
+
+        budget = (rendering.SPEECH_MAX_CHARS - len("<speak></speak>") - len(MSG_SEARCH_RESULTS_PREFIX) - 2
+                  - len(MSG_MENU_FULL) - 1)
+        notes_text, _ = rendering.render_speech_page(rows, 1, budget)
+        speak_output = f"{MSG_SEARCH_RESULTS_PREFIX}{notes_text}. {MSG_MENU_FULL}"
         return (
             handler_input.response_builder
                 .speak(speak_output)
-                .ask(speak_output)
+                .ask(MSG_MENU_FULL)
                 .response
         )
 
-class SendEmailIntentHandler(AbstractRequestHandler):
-    def can_handle(self, handler_input):
-        return is_intent_name("SendEmailIntent")(handler_input)
-
+class SendEmailIntentHandler(routing.RoutedHandler):
     def handle(self, handler_input):
-        session_attr = handler_input.attributes_manager.session_attributes
-        state = session_attr.get("state")
-        
-        # Check if user is in WRITING mode
-        if state == "WRITING":
-            buffer = session_attr.get("note_buffer", [])
-            if buffer:
-                speak_output = MSG_PENDING_NOTE_SEND
-            else:
-                speak_output = MSG_WRITING_IN_PROGRESS
-            return (
-                handler_input.response_builder
-                    .speak(speak_output)
-                    .ask(speak_output)
-                    .response
-            )
-        
-        # Normal flow: send email
-        # Get user email from Alexa API
-        svc_client_fact = handler_input.service_client_factory
-        ups_service = svc_client_fact.get_ups_service()
-        
+        # Get user email (cached per user, otherwise from the Alexa API)
         try:
-            email_addr = ups_service.get_profile_email()
+            email_addr = alexa_api.get_profile_email(handler_input)
         except Exception as e:
             logger.error(f"Error fetching email: {e}", exc_info=True)
             # If permission is missing, ask for it
             return (
                 handler_input.response_builder
                     .speak(MSG_EMAIL_PERMISSION)
-                    .with_ask_for_permissions_consent_card(["alexa::profile:email:read"])
+                    .set_card(AskForPermissionsConsentCard(permissions=["alexa::profile:email:read"]))
                     .response
             )
 
@@ -300,46 +401,15 @@ class SendEmailIntentHandler(AbstractRequestHandler):
                     .response
             )
 
-        # Get notes
         user_id = get_user_id(handler_input)
-        notes_data = database.get_all_notes(user_id)
-        if not notes_data:
+        if not database.has_notes(user_id):
              return (
                 handler_input.response_builder
                     .speak(MSG_NO_NOTES_TO_SEND)
                     .response
             )
 
-        # Format notes
-        date_format = os.environ.get("DATE_FORMAT", "%d/%m/%Y %H:%M")
-        formatted_notes = []
-        
-        for i, (content, timestamp) in enumerate(notes_data, 1):
-            try:
-                # SQLite default timestamp is YYYY-MM-DD HH:MM:SS
-                dt = datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S")
-                formatted_date = dt.strftime(date_format)
-            except Exception as e:
-                logger.error(f"Date parsing error: {e}")
-                formatted_date = timestamp
-                
-            formatted_notes.append(f"{i}. [{formatted_date}] {content}")
-            
-        notes_text = "\n".join(formatted_notes)
-        
-        # Send Email via SMTP
-        smtp_server = os.environ.get("SMTP_SERVER")
-        smtp_port = int(os.environ.get("SMTP_PORT", 587))
-        
-        # Robust handling for optional credentials
-        smtp_user = os.environ.get("SMTP_USER", "").strip() or None
-        smtp_password = os.environ.get("SMTP_PASSWORD", "").strip() or None
-        
-        smtp_encryption = os.environ.get("SMTP_ENCRYPTION", "STARTTLS").upper()
-        
-        logger.info(f"SMTP Config: Server={smtp_server}:{smtp_port}, Encryption={smtp_encryption}, Auth={'Yes' if smtp_user else 'No'} (User='{smtp_user}')")
-
-        if not smtp_server:
+        if not mailer.is_configured():
              logger.error("SMTP server configuration missing")
              return (
                 handler_input.response_builder
@@ -347,45 +417,19 @@ class SendEmailIntentHandler(AbstractRequestHandler):
                     .response
             )
 
+        # Queue the export; notes are streamed into the email by the outbox workers
         try:
-            msg = MIMEText(f"{MSG_EMAIL_BODY_PREFIX}{notes_text}")
-            msg['Subject'] = MSG_EMAIL_SUBJECT
-            msg['From'] = smtp_user if smtp_user else "alexa@local.test"
-            msg['To'] = email_addr
-
-            logger.info(f"Sending email to {email_addr} via {smtp_server}:{smtp_port} ({smtp_encryption})")
-            
-            if smtp_encryption == "SSL":
-                # Use implicit SSL
-                with smtplib.SMTP_SSL(smtp_server, smtp_port) as server:
-                    if smtp_user and smtp_password:
-                        server.login(smtp_user, smtp_password)
-                    server.send_message(msg)
-            elif smtp_encryption == "STARTTLS":
-                # Use explicit TLS
-                with smtplib.SMTP(smtp_server, smtp_port) as server:
-                    server.starttls()
-                    if smtp_user and smtp_password:
-                        server.login(smtp_user, smtp_password)
-                    server.send_message(msg)
-            else:
-                # No encryption (NONE)
-                with smtplib.SMTP(smtp_server, smtp_port) as server:
-                    if smtp_user and smtp_password:
-                        server.login(smtp_user, smtp_password)
-                    server.send_message(msg)
-            
-            logger.info("Email sent successfully")
-                
+            email_id = outbox.enqueue_export(user_id, email_addr)
+            logger.info(f"Queued notes export {email_id} for {email_addr}")
         except Exception as e:
-            logger.error(f"Failed to send email: {e}")
+            logger.error(f"Failed to queue email: {e}")
             return (
                 handler_input.response_builder
                     .speak(MSG_EMAIL_ERROR)
                     .response
             )
 
-
+        speak_output = MSG_EMAIL_SENT
         return (
             handler_input.response_builder
                 .speak(speak_output)
@@ -393,26 +437,19 @@ class SendEmailIntentHandler(AbstractRequestHandler):
                 .response
         )
 
-class SetRetentionIntentHandler(AbstractRequestHandler):
-    def can_handle(self, handler_input):
-        return is_intent_name("SetRetentionIntent")(handler_input)
-
+class SetRetentionIntentHandler(routing.RoutedHandler):
     def handle(self, handler_input):
         slots = handler_input.request_envelope.request.intent.slots
         days_slot = slots.get("days")
         days = days_slot.value if days_slot else None
-        
-        if days:
-            try:
-                days_int = int(days)
-                user_id = get_user_id(handler_input)
-                database.set_retention_days(user_id, days_int)
-                speak_output = MSG_RETENTION_SET.format(days=days_int)
-            except ValueError:
-                speak_output = MSG_ERROR
-        else:
-            # If days is missing, ask for it
-            speak_output = "Per quanti giorni vuoi conservare le note?"
+
+        try:
+            days_int = int(days) if days else None
+        except ValueError:
+            days_int = None
+        if days_int is None or days_int < 1:
+            # Missing, or a period that would delete every note: ask (again)
+            speak_output = MSG_RETENTION_INVALID if days else "Per quanti giorni vuoi conservare le note?"
             return (
                 handler_input.response_builder
                     .speak(speak_output)
@@ -426,6 +463,9 @@ class SetRetentionIntentHandler(AbstractRequestHandler):
                     .response
             )
 
+        user_id = get_user_id(handler_input)
+        database.set_retention_days(user_id, days_int)
+        speak_output = MSG_RETENTION_SET.format(days=days_int)
         return (
             handler_input.response_builder
                 .speak(speak_output)
@@ -433,24 +473,84 @@ class SetRetentionIntentHandler(AbstractRequestHandler):
                 .response
         )
 
-class CloseIntentHandler(AbstractRequestHandler):
-    def can_handle(self, handler_input):
-        return is_intent_name("CloseIntent")(handler_input)
+def resolved_slot_id(slot):
+    """The id of the value an entity-resolution authority matched for `slot`, or None."""
+    resolutions = slot.resolutions if slot else None
+    for authority in (resolutions.resolutions_per_authority if resolutions else None) or []:
+        if authority.values:
+            return authority.values[0].value.id
+    return None
+
+class SetDigestIntentHandler(routing.RoutedHandler):
+    def handle(self, handler_input):
+        slots = handler_input.request_envelope.request.intent.slots or {}
+        frequency = resolved_slot_id(slots.get("frequency"))
+        if frequency not in ("daily", "weekly", "off"):
+            # Missing or not one of the DigestFrequency values: ask for it
+            return (
+                handler_input.response_builder
+                    .speak(MSG_DIGEST_ASK)
+                    .ask(MSG_DIGEST_ASK)
+                    .add_directive(
+                        ElicitSlotDirective(
+                            slot_to_elicit="frequency",
+                            updated_intent=handler_input.request_envelope.request.intent
+                        )
+                    )
+                    .response
+            )
+
+        user_id = get_user_id(handler_input)
+        if frequency == "off":
+            digest.unsubscribe(user_id)
+            return (
+                handler_input.response_builder
+                    .speak(MSG_DIGEST_OFF)
+                    .ask(MSG_MENU_SHORT)
+                    .response
+            )
+
+        # The digest goes to the profile email, stored with the subscription (later lookups keep it current)
+        try:
+            email_addr = alexa_api.get_profile_email(handler_input)
+        except Exception as e:
+            logger.error(f"Error fetching email: {e}", exc_info=True)
+            return (
+                handler_input.response_builder
+                    .speak(MSG_EMAIL_PERMISSION)
+                    .set_card(AskForPermissionsConsentCard(permissions=["alexa::profile:email:read"]))
+                    .response
+            )
+
+        if not email_addr:
+            return (
+                handler_input.response_builder
+                    .speak(MSG_EMAIL_NOT_FOUND)
+                    .response
+            )
+
+        digest.subscribe(user_id, frequency, email_addr)
+        speak_output = MSG_DIGEST_DAILY_SET if frequency == "daily" else MSG_DIGEST_WEEKLY_SET
+        return (
+            handler_input.response_builder
+                .speak(speak_output)
+                .ask(MSG_MENU_SHORT)
+                .response
+        )
 
+class CloseIntentHandler(routing.RoutedHandler):
     def handle(self, handler_input):
         # Clear any pending buffer if in WRITING mode (discard unsaved notes)
         session_attr = handler_input.attributes_manager.session_attributes
         if session_attr.get("state") == "WRITING":
             session_attr["state"] = "MENU"
-            session_attr["note_buffer"] = []
+            drafts.store.discard(session_attr.get("draft_id"))
+            session_attr["draft_id"] = None
         
         # Silent exit as requested
         return handler_input.response_builder.response
 
-class HelpIntentHandler(AbstractRequestHandler):
-    def can_handle(self, handler_input):
-        return is_intent_name("AMAZON.HelpIntent")(handler_input)
-
+class HelpIntentHandler(routing.RoutedHandler):
     def handle(self, handler_input):
         speak_output = MSG_HELP
         return (
@@ -460,20 +560,42 @@ class HelpIntentHandler(AbstractRequestHandler):
                 .response
         )
 
-class CancelOrStopIntentHandler(AbstractRequestHandler):
-    def can_handle(self, handler_input):
-        return (is_intent_name("AMAZON.CancelIntent")(handler_input) or
-                is_intent_name("AMAZON.StopIntent")(handler_input))
-
+class CancelOrStopIntentHandler(routing.RoutedHandler):
     def handle(self, handler_input):
+        session_attr = handler_input.attributes_manager.session_attributes
+        drafts.store.discard(session_attr.get("draft_id"))
+        session_attr["draft_id"] = None
         speak_output = MSG_GOODBYE
         return handler_input.response_builder.speak(speak_output).response
 
-class SessionEndedRequestHandler(AbstractRequestHandler):
-    def can_handle(self, handler_input):
-        return is_request_type("SessionEndedRequest")(handler_input)
+class SessionEndedRequestHandler(routing.RoutedHandler):
+    def handle(self, handler_input):
+        # A draft left open by a timeout or error is saved rather than lost;
+        # one the user walked away from on purpose is discarded.
+        session_attr = handler_input.attributes_manager.session_attributes
+        draft_id = session_attr.get("draft_id")
+        if draft_id:
+            reason = handler_input.request_envelope.request.reason
+            if getattr(reason, "value", reason) != "USER_INITIATED":
+                drafts.store.recover(draft_id)
+            else:
+                drafts.store.discard(draft_id)
+        return handler_input.response_builder.response
+
+class ConsentWithdrawnHandler(routing.RoutedHandler):
+    """Skill disabled, or its permissions changed: without the email permission, stop the digest."""
 
     def handle(self, handler_input):
+        request = handler_input.request_envelope.request
+        if get_request_type(handler_input) == "AlexaSkillEvent.SkillPermissionChanged":
+            accepted = request.body.accepted_permissions if request.body is not None else None
+            if any(permission.scope == "alexa::profile:email:read" for permission in accepted or ()):
+                return handler_input.response_builder.response
+        # Skill events carry no session; the user is in the request context.
+        user_id = handler_input.request_envelope.context.system.user.user_id
+        database.delete_profile_email(user_id)
+        database.update_digest_email(user_id, None)
+        logger.info(f"Email consent withdrawn ({get_request_type(handler_input)}), digest cancelled for {user_id}")
         return handler_input.response_builder.response
 
 class CatchAllExceptionHandler(AbstractExceptionHandler):
@@ -490,31 +612,119 @@ class CatchAllExceptionHandler(AbstractExceptionHandler):
                 .response
         )
 
-# Register handlers
-sb.add_request_handler(LaunchRequestHandler())
-sb.add_request_handler(StartWritingIntentHandler())
-sb.add_request_handler(CaptureNoteIntentHandler())
-sb.add_request_handler(FinishIntentHandler())
-sb.add_request_handler(ReadNotesIntentHandler())
-sb.add_request_handler(SendEmailIntentHandler())
-sb.add_request_handler(SetRetentionIntentHandler())
-sb.add_request_handler(CloseIntentHandler())
-sb.add_request_handler(HelpIntentHandler())
-sb.add_request_handler(CancelOrStopIntentHandler())
-sb.add_request_handler(SessionEndedRequestHandler()) 
+def request_label(handler_input):
+    """Intent name for IntentRequests, otherwise the request type."""
+    request_type = get_request_type(handler_input)
+    if request_type == "IntentRequest":
+        return get_intent_name(handler_input)
+    return request_type
+
+class RequestTimingInterceptor(AbstractRequestInterceptor):
+    def process(self, handler_input):
+        handler_input.attributes_manager.request_attributes["started_at"] = time.perf_counter()
+
+class ResponseTimingInterceptor(AbstractResponseInterceptor):
+    def process(self, handler_input, response):
+        started_at = handler_input.attributes_manager.request_attributes.get("started_at")
+        if started_at is not None:
+            metrics.intent_seconds.observe(request_label(handler_input), time.perf_counter() - started_at)
+
+class TimedVerifier(AbstractVerifier):
+    """Wraps a request verifier to record how long it takes."""
+
+    def __init__(self, verifier):
+        self.verifier = verifier
+        self.label = type(verifier).__name__
+
+    def verify(self, headers, serialized_request_env, deserialized_request_env):
+        with metrics.verification_seconds.time(self.label):
+            self.verifier.verify(headers, serialized_request_env, deserialized_request_env)
+
+# Route requests by (request type, intent, session state); the exact state wins over ANY_STATE
+WRITING = ("WRITING",)
+routes = routing.RoutingTable()
+routes.add(LaunchRequestHandler(), request_type="LaunchRequest")
+routes.add(StartWritingIntentHandler(), ["StartWritingIntent"])
+routes.add(CaptureNoteIntentHandler(), ["CaptureNoteIntent"], states=WRITING)
+routes.add(SpeakHandler(MSG_NOT_UNDERSTOOD), ["CaptureNoteIntent"])
+routes.add(FinishIntentHandler(), ["FinishIntent"], states=WRITING)
+routes.add(SpeakHandler(MSG_NOT_WRITING), ["FinishIntent"])
+routes.add(ReadNotesIntentHandler(), ["ReadNotesIntent"])
+routes.add(PendingDraftHandler(MSG_PENDING_NOTE), ["ReadNotesIntent"], states=WRITING)
+routes.add(NextPageIntentHandler(), ["AMAZON.NextIntent"])
+routes.add(PreviousPageIntentHandler(), ["AMAZON.PreviousIntent"])
+routes.add(SearchNotesIntentHandler(), ["SearchNotesIntent"])
+routes.add(SpeakHandler(MSG_WRITING_IN_PROGRESS), ["AMAZON.NextIntent", "AMAZON.PreviousIntent", "SearchNotesIntent"],
+           states=WRITING)
+routes.add(SendEmailIntentHandler(), ["SendEmailIntent"])
+routes.add(PendingDraftHandler(MSG_PENDING_NOTE_SEND), ["SendEmailIntent"], states=WRITING)
+routes.add(SetRetentionIntentHandler(), ["SetRetentionIntent"])
+routes.add(SetDigestIntentHandler(), ["SetDigestIntent"])
+routes.add(CloseIntentHandler(), ["CloseIntent"])
+routes.add(HelpIntentHandler(), ["AMAZON.HelpIntent"])
+routes.add(CancelOrStopIntentHandler(), ["AMAZON.CancelIntent", "AMAZON.StopIntent"])
+routes.add(SessionEndedRequestHandler(), request_type="SessionEndedRequest")
+routes.add(ConsentWithdrawnHandler(), request_type="AlexaSkillEvent.SkillDisabled")
+routes.add(ConsentWithdrawnHandler(), request_type="AlexaSkillEvent.SkillPermissionChanged")
 sb.add_exception_handler(CatchAllExceptionHandler())
+if metrics.METRICS_ENABLED:
+    sb.add_global_request_interceptor(RequestTimingInterceptor())
+    sb.add_global_response_interceptor(ResponseTimingInterceptor())
 
-# Configure API Client
-# sb.skill_configuration.api_client = DefaultApiClient()
-
-verify_signature = os.environ.get("VERIFY_SIGNATURE", "True").lower() == "true"
 skill = sb.create()
-skill.api_client = DefaultApiClient()
-skill_adapter = WebserviceSkillHandler(skill=skill, verify_signature=verify_signature, verify_timestamp=verify_signature)
-
-@app.route("/", methods=['POST'])
-def invoke_skill():
-    return skill_adapter.verify_request_and_dispatch(request.headers, request.data)
+routes.install(skill)
+# Configure API Client (one keep-alive session for all Alexa API calls)
+skill.api_client = alexa_api.KeepAliveApiClient()
+verifiers = []
+if skill_config.verify_signature:
+    # Signing certificates are validated once and cached (on disk too, shared by workers)
+    request_verifier = verification.CachingRequestVerifier()
+    warmed = request_verifier.prewarm(verification.VERIFIER_PREWARM_URLS)
+    logger.info(f"Signature verification enabled, {warmed} certificate chain(s) prewarmed")
+    verifiers = [request_verifier, TimestampVerifier()]
+if metrics.METRICS_ENABLED:
+    verifiers = [TimedVerifier(v) for v in verifiers]
+skill_adapter = WebserviceSkillHandler(skill=skill, verify_signature=False, verify_timestamp=False, verifiers=verifiers)
+
+def dispatch_skill_request(headers, body):
+    """Verify and handle one skill request; returns the response envelope as a dict.
+
+    Shared by the Flask app below and the ASGI entry point in asgi.py.
+    """
+    if not metrics.METRICS_ENABLED:
+        return skill_adapter.verify_request_and_dispatch(headers, body)
+    with metrics.profiler.request("invoke_skill"), metrics.http_request_seconds.time("invoke_skill"):
+        return skill_adapter.verify_request_and_dispatch(headers, body)
+
+_app = None
+
+def create_app():
+    """The Flask app serving the skill (built on first use, so ASGI and tools never import Flask)."""
+    global _app
+    if _app is not None:
+        return _app
+    from flask import Flask, request
+
+    app = Flask(__name__)
+
+    @app.route("/", methods=['POST'])
+    def invoke_skill():
+        return dispatch_skill_request(request.headers, request.data)
+
+    @app.route("/metrics", methods=['GET'])
+    def metrics_endpoint():
+        if not metrics.METRICS_ENABLED:
+            return "Not Found", 404
+        return app.response_class(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+    _app = app
+    return app
+
+def __getattr__(name):
+    # `main:app` (gunicorn, the Flask test client) keeps working without an eager Flask import.
+    if name == "app":
+        return create_app()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 if __name__ == '__main__':
-    app.run(debug=True)
+    create_app().run(debug=True)
@@ -0,0 +1,377 @@
+"""Latency histograms and a Prometheus text exposition for /metrics.
+
+Histograms use fixed buckets and one lock each, so an observation is a
+bisect and three additions. instrument() replaces functions on a module or
+class with timed wrappers, which is how database operations and SMTP calls
+are measured without touching their call sites.
+
+SlowRequestProfiler is an optional stack sampler: while enabled it samples
+the frames of threads serving a request every METRICS_PROFILE_INTERVAL_MS
+and logs the most frequent stacks of any request slower than
+METRICS_PROFILE_SLOW_MS. Nothing is sampled when it is off (the default).
+
+With several worker processes (gunicorn), set PROMETHEUS_MULTIPROC_DIR:
+each process then writes its counts to <dir>/metrics_<pid>.json every
+METRICS_FLUSH_SECONDS and /metrics sums the files of all processes, so a
+scrape shows the whole service whichever worker answers it. The histograms
+of a worker that exited are folded into metrics_dead.json by
+mark_process_dead (gunicorn.conf.py calls it from child_exit), so their
+counts never go backwards; its collector values are dropped.
+"""
+import bisect
+import collections
+import contextlib
+import functools
+import glob
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "True").lower() == "true"
+METRICS_PREFIX = "blocco_note_"
+# 0 disables the slow request profiler.
+METRICS_PROFILE_SLOW_MS = float(os.environ.get("METRICS_PROFILE_SLOW_MS", 0))
+METRICS_PROFILE_INTERVAL_MS = float(os.environ.get("METRICS_PROFILE_INTERVAL_MS", 5))
+METRICS_PROFILE_TOP = int(os.environ.get("METRICS_PROFILE_TOP", 5))
+# Shared by all worker processes; empty means single-process metrics.
+METRICS_MULTIPROC_DIR = os.environ.get("PROMETHEUS_MULTIPROC_DIR", "")
+METRICS_FLUSH_SECONDS = float(os.environ.get("METRICS_FLUSH_SECONDS", 1))
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """Cumulative-bucket latency histogram with one series per label value."""
+
+    def __init__(self, name, help_text, label, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        # label value -> [per-bucket counts (+Inf last), sum, count]
+        self._series = {}
+
+    def observe(self, label_value, seconds):
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                series = self._series[label_value] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += seconds
+            series[2] += 1
+
+    @contextlib.contextmanager
+    def time(self, label_value):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(label_value, time.perf_counter() - t0)
+
+    def raw(self):
+        """{label value: [per-bucket counts (+Inf last), sum, count]}, not cumulative."""
+        with self._lock:
+            return {value: [list(s[0]), s[1], s[2]] for value, s in self._series.items()}
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+
+    def snapshot(self, raw=None):
+        """{label value: (cumulative bucket counts, sum, count)}, of `raw` if given."""
+        result = {}
+        for value, (counts, total, count) in (self.raw() if raw is None else raw).items():
+            running, cumulative = 0, []
+            for c in counts:
+                running += c
+                cumulative.append(running)
+            result[value] = (cumulative, total, count)
+        return result
+
+    def render(self, raw=None):
+        name = METRICS_PREFIX + self.name
+        lines = [f"# HELP {name} {self.help_text}", f"# TYPE {name} histogram"]
+        for value, (cumulative, total, count) in sorted(self.snapshot(raw).items()):
+            label = f'{self.label}="{_escape(value)}"'
+            for bound, c in zip(self.buckets, cumulative):
+                lines.append(f'{name}_bucket{{{label},le="{bound}"}} {c}')
+            lines.append(f'{name}_bucket{{{label},le="+Inf"}} {cumulative[-1]}')
+            lines.append(f"{name}_sum{{{label}}} {total:.6f}")
+            lines.append(f"{name}_count{{{label}}} {count}")
+        return lines
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+http_request_seconds = Histogram("http_request_seconds", "Time in the skill route, verification included.", "route")
+verification_seconds = Histogram("verification_seconds", "Time spent in each request verifier.", "verifier")
+intent_seconds = Histogram("intent_seconds", "Time from request to response interceptor, per intent.", "intent")
+db_operation_seconds = Histogram("db_operation_seconds", "Time per database module call.", "operation")
+external_call_seconds = Histogram("external_call_seconds", "Time per call to an external service.", "call")
+
+HISTOGRAMS = [http_request_seconds, verification_seconds, intent_seconds, db_operation_seconds, external_call_seconds]
+
+# name -> callable returning {key: number}, rendered as gauges labelled by key
+_collectors = {}
+# The process whose counts are its own; a forked child starts from zero (see start_multiprocess_writer).
+_import_pid = os.getpid()
+
+
+def register_collector(name, collect):
+    """Expose a dict of counters (e.g. cache.stats) as METRICS_PREFIX + name{key="..."}."""
+    _collectors[name] = collect
+
+
+def instrument(owner, names, histogram):
+    """Replace owner.<name> with a wrapper that times every call.
+
+    `names` is a list of attribute names (used as label values) or a dict
+    mapping attribute names to label values.
+    """
+    if not METRICS_ENABLED:
+        return
+    labels = names if isinstance(names, dict) else {name: name for name in names}
+    for name, label_value in labels.items():
+        func = getattr(owner, name)
+        if getattr(func, "_instrumented", False):
+            continue
+        setattr(owner, name, _timed(func, histogram, label_value))
+
+
+def _timed(func, histogram, label_value):
+    observe = histogram.observe
+    clock = time.perf_counter
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        t0 = clock()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            observe(label_value, clock() - t0)
+
+    wrapper._instrumented = True
+    return wrapper
+
+
+def _collect_all():
+    """{collector name: {key: number}} for this process."""
+    result = {}
+    for name, collect in _collectors.items():
+        try:
+            result[name] = collect()
+        except Exception as e:
+            logger.error(f"Metrics collector {name} failed: {e}")
+    return result
+
+
+def _local_state():
+    return {
+        "histograms": {histogram.name: histogram.raw() for histogram in HISTOGRAMS},
+        "collectors": _collect_all(),
+    }
+
+
+def _merge_histograms(into, histograms):
+    for name, series in histograms.items():
+        target = into.setdefault(name, {})
+        for value, (counts, total, count) in series.items():
+            current = target.get(value)
+            if current is None:
+                target[value] = [list(counts), total, count]
+            else:
+                current[0] = [a + b for a, b in zip(current[0], counts)]
+                current[1] += total
+                current[2] += count
+
+
+def _read_state(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        # Gone (its worker was just marked dead) or unreadable: skip it this scrape.
+        return None
+
+
+def _write_state(path, state):
+    tmp = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(tmp, path)
+
+
+def _process_path(pid, directory=None):
+    return os.path.join(directory or METRICS_MULTIPROC_DIR, f"metrics_{pid}.json")
+
+
+def flush():
+    """Write this process's counts to PROMETHEUS_MULTIPROC_DIR (no-op without it)."""
+    if METRICS_MULTIPROC_DIR:
+        _write_state(_process_path(os.getpid()), _local_state())
+
+
+def _aggregate_state():
+    """Histograms and collectors summed over every process in PROMETHEUS_MULTIPROC_DIR."""
+    flush()
+    histograms, collectors = {}, {}
+    for path in glob.glob(os.path.join(METRICS_MULTIPROC_DIR, "metrics_*.json")):
+        state = _read_state(path)
+        if state is None:
+            continue
+        _merge_histograms(histograms, state.get("histograms", {}))
+        for name, values in state.get("collectors", {}).items():
+            target = collectors.setdefault(name, {})
+            for key, value in values.items():
+                target[key] = target.get(key, 0) + value
+    return {"histograms": histograms, "collectors": collectors}
+
+
+def mark_process_dead(pid, directory=None):
+    """Fold the histograms of exited process `pid` into metrics_dead.json and drop its file.
+
+    Called from the gunicorn master (child_exit), the only writer of metrics_dead.json.
+    """
+    directory = directory or METRICS_MULTIPROC_DIR
+    if not directory:
+        return
+    path = _process_path(pid, directory)
+    state = _read_state(path)
+    if state is None:
+        return
+    dead_path = os.path.join(directory, "metrics_dead.json")
+    dead = _read_state(dead_path) or {"histograms": {}, "collectors": {}}
+    _merge_histograms(dead["histograms"], state.get("histograms", {}))
+    _write_state(dead_path, dead)
+    os.remove(path)
+
+
+_writer_pid = None
+
+
+def start_multiprocess_writer():
+    """Flush this process's counts every METRICS_FLUSH_SECONDS, once per process.
+
+    Counts inherited from the parent (observed before fork) are dropped first,
+    or every worker would report them again.
+    """
+    global _writer_pid
+    if not METRICS_MULTIPROC_DIR or _writer_pid == os.getpid():
+        return
+    if _writer_pid is not None or os.getpid() != _import_pid:
+        for histogram in HISTOGRAMS:
+            histogram.reset()
+    _writer_pid = os.getpid()
+    os.makedirs(METRICS_MULTIPROC_DIR, exist_ok=True)
+    threading.Thread(target=_flush_loop, name="metrics-writer", daemon=True).start()
+
+
+def _flush_loop():
+    while True:
+        time.sleep(METRICS_FLUSH_SECONDS)
+        try:
+            flush()
+        except Exception as e:
+            logger.error(f"Failed to write metrics to {METRICS_MULTIPROC_DIR}: {e}")
+
+
+def render():
+    """All metrics in the Prometheus text exposition format, summed over processes if configured."""
+    if METRICS_MULTIPROC_DIR:
+        state = _aggregate_state()
+        raw = state["histograms"]
+    else:
+        state = {"collectors": _collect_all()}
+        raw = {histogram.name: None for histogram in HISTOGRAMS}
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines.extend(histogram.render(raw.get(histogram.name, {})))
+    for name, values in sorted(state["collectors"].items()):
+        full = METRICS_PREFIX + name
+        lines.append(f"# TYPE {full} gauge")
+        for key, value in sorted(values.items()):
+            lines.append(f'{full}{{key="{_escape(key)}"}} {value}')
+    return "\n".join(lines) + "\n"
+
+
+class SlowRequestProfiler:
+    """Samples the stacks of in-flight requests and logs them for slow ones."""
+
+    def __init__(self, slow_ms=METRICS_PROFILE_SLOW_MS, interval_ms=METRICS_PROFILE_INTERVAL_MS, top=METRICS_PROFILE_TOP):
+        self.slow_seconds = slow_ms / 1000
+        self.interval = interval_ms / 1000
+        self.top = top
+        self._lock = threading.Lock()
+        # thread id -> Counter of stacks seen while that thread served the current request
+        self._active = {}
+        self._thread = None
+
+    @property
+    def enabled(self):
+        return self.slow_seconds > 0
+
+    def _ensure_started(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="slow-request-profiler", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._active:
+                    continue
+                frames = sys._current_frames()
+                for thread_id, samples in self._active.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        samples[_stack(frame)] += 1
+
+    @contextlib.contextmanager
+    def request(self, label):
+        """Sample the current thread for the duration of the block."""
+        if not self.enabled:
+            yield
+            return
+        thread_id = threading.get_ident()
+        with self._lock:
+            self._active[thread_id] = collections.Counter()
+            self._ensure_started()
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - t0
+            with self._lock:
+                samples = self._active.pop(thread_id, None)
+            if elapsed >= self.slow_seconds and samples:
+                self._report(label, elapsed, samples)
+
+    def _report(self, label, elapsed, samples):
+        total = sum(samples.values())
+        lines = [f"Slow request {label}: {elapsed * 1000:.1f} ms, {total} samples"]
+        for stack, count in samples.most_common(self.top):
+            lines.append(f"  {count / total:6.1%}  {' <- '.join(stack)}")
+        logger.warning("\n".join(lines))
+
+
+def _stack(frame, depth=12):
+    """The innermost `depth` frames as "file:function:line" strings."""
+    stack = []
+    while frame is not None and len(stack) < depth:
+        code = frame.f_code
+        stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+        frame = frame.f_back
+    return tuple(stack)
+
+
+profiler = SlowRequestProfiler()
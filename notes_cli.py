@@ -0,0 +1,348 @@
+"""Bulk operations on the notes database from the command line.
+
+    python notes_cli.py export notes.jsonl.gz [--user ID ...] [--users-file FILE]
+    python notes_cli.py import notes.jsonl.gz [--batch-size 5000]
+    python notes_cli.py retention [--days N] [--workers 4]
+    python notes_cli.py render out/ [--format txt|csv] [--workers 4]
+
+export  streams every (or the selected) user's notes, newest first per user,
+        as JSONL ({"user_id", "timestamp", "content"} per line) or CSV with
+        the same columns. The format follows the file name (.jsonl/.csv,
+        gzipped when it ends in .gz) unless --format/--gzip say otherwise;
+        "-" writes to stdout.
+import  reads that format back and saves the notes --batch-size at a time,
+        one transaction per batch. Notes get new ids, so importing the same
+        file twice stores them twice.
+retention
+        applies each user's retention setting (or --days to every user with
+        notes) in a pool of --workers processes, a chunk of users per task.
+render  re-renders every user's notes into out/<user_id>.txt (the email
+        export lines) or .csv (the CSV attachment), in a pool of processes.
+
+Progress and rows/second go to stderr once a second and at the end, so
+migration and backfill times can be estimated from a sample. With SQLite
+all writers share one file lock: retention scales with --workers only up
+to that lock, rendering scales with cores. Uses DB_BACKEND/DB_NAME/
+DATABASE_URL like the skill, from the environment or .env.
+"""
+if __name__ == "__main__":
+    # Run as a job: read .env like main.py, before the modules below read their settings.
+    from dotenv import load_dotenv
+
+    load_dotenv(override=True)
+
+import argparse
+import concurrent.futures
+import contextlib
+import csv
+import gzip
+import itertools
+import json
+import logging
+import os
+import re
+import sys
+import time
+
+import database
+import export
+import rendering
+import retention
+
+NOTES_CLI_BATCH_SIZE = int(os.environ.get("NOTES_CLI_BATCH_SIZE", 5000))
+# Users handed to a pool worker per task.
+NOTES_CLI_CHUNK_USERS = int(os.environ.get("NOTES_CLI_CHUNK_USERS", 50))
+
+FIELDS = ("user_id", "timestamp", "content")
+# Level 6 (zlib's default) compresses within a few percent of 9 at several times the speed.
+GZIP_LEVEL = 6
+_encode_json = json.JSONEncoder(ensure_ascii=False).encode
+
+
+class Progress:
+    """Running row/user counts with a rows/second rate, printed to stderr at most every `interval` seconds."""
+
+    def __init__(self, label, interval=1.0, stream=sys.stderr):
+        self.label = label
+        self.interval = interval
+        self.stream = stream
+        self.rows = 0
+        self.users = 0
+        self.started = time.perf_counter()
+        self._printed = self.started
+
+    def add(self, rows, users=0):
+        self.rows += rows
+        self.users += users
+        now = time.perf_counter()
+        if now - self._printed >= self.interval:
+            self._printed = now
+            self._print(now, end="\r" if self.stream.isatty() else "\n")
+
+    def done(self):
+        self._print(time.perf_counter(), end="\n", final=True)
+
+    def _print(self, now, end, final=False):
+        elapsed = now - self.started
+        rate = self.rows / elapsed if elapsed > 0 else 0.0
+        users = f", {self.users:,} users" if self.users else ""
+        summary = f" in {elapsed:.1f}s" if final else ""
+        print(f"{self.label}: {self.rows:,} rows{users}, {rate:,.0f} rows/s{summary}",
+              end=end, file=self.stream, flush=True)
+
+
+def _format_of(path, explicit):
+    if explicit:
+        return explicit
+    name = path[:-3] if path.endswith(".gz") else path
+    return "csv" if name.endswith(".csv") else "jsonl"
+
+
+def _open(path, mode, compress):
+    """Text stream for `path` ("-" is stdin/stdout), gzipped if asked or if the name ends in .gz."""
+    if path == "-":
+        stream = sys.stdout if mode == "w" else sys.stdin
+        if compress:
+            # Closing the gzip stream flushes it but leaves stdin/stdout open.
+            return gzip.open(stream.buffer, mode + "t", GZIP_LEVEL, encoding="utf-8", newline="")
+        return contextlib.nullcontext(stream)
+    if compress or path.endswith(".gz"):
+        return gzip.open(path, mode + "t", GZIP_LEVEL, encoding="utf-8", newline="")
+    return open(path, mode, encoding="utf-8", newline="")
+
+
+def _iter_users(selected):
+    """The selected user ids, or every user with notes, paged from the database."""
+    if selected:
+        yield from selected
+        return
+    after = None
+    while True:
+        page = database.get_note_users(after, NOTES_CLI_CHUNK_USERS * 10)
+        if not page:
+            return
+        yield from page
+        after = page[-1]
+
+
+def _chunks(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def export_notes(path, user_ids=(), fmt=None, compress=False, fetch_size=export.EXPORT_FETCH_SIZE):
+    """Stream notes to `path`. Returns the number of rows written."""
+    fmt = _format_of(path, fmt)
+    progress = Progress("export")
+    with _open(path, "w", compress) as out:
+        writer = csv.writer(out) if fmt == "csv" else None
+        if writer:
+            writer.writerow(FIELDS)
+        for user_id in _iter_users(user_ids):
+            for content, timestamp in database.iter_all_notes(user_id, fetch_size):
+                if writer:
+                    writer.writerow((user_id, timestamp, content))
+                else:
+                    out.write(_encode_json({"user_id": user_id, "timestamp": timestamp, "content": content}) + "\n")
+                progress.add(1)
+            progress.add(0, users=1)
+    progress.done()
+    return progress.rows
+
+
+def _read_notes(stream, fmt, path):
+    """Yield validated (content, user_id, timestamp) tuples, as save_notes_batch takes them."""
+    records = csv.DictReader(stream) if fmt == "csv" else (line for line in stream if line.strip())
+    for number, record in enumerate(records, 1):
+        try:
+            if fmt != "csv":
+                record = json.loads(record)
+            user_id, content = record["user_id"], record["content"]
+            timestamp = int(record["timestamp"])
+        except (KeyError, TypeError, ValueError) as e:
+            raise ValueError(f"{path}: record {number}: expected {', '.join(FIELDS)} ({e!r})") from e
+        if not user_id or not content:
+            raise ValueError(f"{path}: record {number}: empty user_id or content")
+        yield content, user_id, timestamp
+
+
+def import_notes(path, fmt=None, compress=False, batch_size=NOTES_CLI_BATCH_SIZE):
+    """Save the notes in `path`, one transaction per `batch_size` notes. Returns the number imported."""
+    fmt = _format_of(path, fmt)
+    progress = Progress("import")
+    with _open(path, "r", compress) as stream:
+        for batch in _chunks(_read_notes(stream, fmt, path), batch_size):
+            database.save_notes_batch(batch)
+            progress.add(len(batch))
+    progress.done()
+    return progress.rows
+
+
+def _expire_chunk(settings, now, batch_size):
+    """Pool task: apply retention to (user_id, days) pairs. Returns (deleted, users)."""
+    return sum(retention.expire_user_notes(user_id, days, now, batch_size) for user_id, days in settings), len(settings)
+
+
+def _safe_name(user_id):
+    return re.sub(r"[^A-Za-z0-9._-]", "_", user_id)
+
+
+class _CountingIterator:
+    """Pass items through, counting them."""
+
+    def __init__(self, iterable):
+        self._items = iter(iterable)
+        self.count = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        item = next(self._items)
+        self.count += 1
+        return item
+
+
+def _render_chunk(user_ids, out_dir, fmt, fetch_size):
+    """Pool task: write each user's rendered notes to out_dir. Returns (rows, users)."""
+    rows_total = 0
+    for user_id in user_ids:
+        path = os.path.join(out_dir, f"{_safe_name(user_id)}.{fmt}")
+        rows = iter(database.iter_all_notes(user_id, fetch_size))
+        first = next(rows, None)
+        if first is None:
+            # Every note of theirs has expired: drop the file an earlier run wrote.
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+            continue
+        rows = _CountingIterator(itertools.chain((first,), rows))
+        lines = export.iter_csv_lines(rows) if fmt == "csv" else (line + "\n" for line in rendering.iter_email_lines(rows))
+        with open(path, "w", encoding="utf-8", newline="") as out:
+            out.writelines(lines)
+        rows_total += rows.count
+    return rows_total, len(user_ids)
+
+
+def run_parallel(task, chunks, workers, progress, *args):
+    """Run task(chunk, *args) for every chunk in `workers` processes; each returns a (rows, users) pair.
+
+    At most two tasks per worker are queued at a time, so the chunk source
+    (usually a database cursor) is consumed as the pool drains it.
+    """
+    if workers <= 1:
+        for chunk in chunks:
+            progress.add(*task(chunk, *args))
+        return
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = set()
+        for chunk in chunks:
+            if len(pending) >= workers * 2:
+                finished, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in finished:
+                    progress.add(*future.result())
+            pending.add(pool.submit(task, chunk, *args))
+        for future in concurrent.futures.as_completed(pending):
+            progress.add(*future.result())
+
+
+def _iter_settings_pages():
+    after = None
+    while True:
+        page = database.get_retention_settings(after, NOTES_CLI_CHUNK_USERS * 10)
+        if not page:
+            return
+        yield [tuple(row) for row in page]
+        after = page[-1][0]
+
+
+def run_retention(days=None, workers=os.cpu_count(), batch_size=retention.RETENTION_BATCH_SIZE):
+    """Apply retention per user in parallel: each user's own setting, or `days` for every user with notes."""
+    now = int(time.time())
+    if days is None:
+        settings = (row for page in _iter_settings_pages() for row in page)
+    else:
+        settings = ((user_id, days) for user_id in _iter_users(()))
+    progress = Progress("retention")
+    run_parallel(_expire_chunk, _chunks(settings, NOTES_CLI_CHUNK_USERS), workers, progress, now, batch_size)
+    progress.done()
+    return progress.rows
+
+
+def run_render(out_dir, fmt="txt", user_ids=(), workers=os.cpu_count(), fetch_size=export.EXPORT_FETCH_SIZE):
+    """Re-render every (or the selected) user's notes into out_dir, in parallel."""
+    os.makedirs(out_dir, exist_ok=True)
+    progress = Progress("render")
+    run_parallel(_render_chunk, _chunks(_iter_users(user_ids), NOTES_CLI_CHUNK_USERS), workers, progress,
+                 out_dir, fmt, fetch_size)
+    progress.done()
+    return progress.rows
+
+
+def _selected_users(args):
+    users = list(args.user or ())
+    if args.users_file:
+        with open(args.users_file, encoding="utf-8") as f:
+            users += [line.strip() for line in f if line.strip()]
+    return users
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk export, import, retention and re-rendering of notes.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    def add_user_selection(command):
+        command.add_argument("--user", action="append", help="only this user id (repeatable)")
+        command.add_argument("--users-file", help="file with one user id per line")
+
+    def add_workers(command):
+        command.add_argument("--workers", type=int, default=os.cpu_count(), help="processes (1 = no pool)")
+
+    command = commands.add_parser("export", help="stream notes to JSONL or CSV")
+    command.add_argument("path", help='output file, or "-" for stdout')
+    command.add_argument("--format", choices=("jsonl", "csv"))
+    command.add_argument("--gzip", action="store_true")
+    add_user_selection(command)
+
+    command = commands.add_parser("import", help="load notes from JSONL or CSV")
+    command.add_argument("path", help='input file, or "-" for stdin')
+    command.add_argument("--format", choices=("jsonl", "csv"))
+    command.add_argument("--gzip", action="store_true")
+    command.add_argument("--batch-size", type=int, default=NOTES_CLI_BATCH_SIZE)
+
+    command = commands.add_parser("retention", help="apply retention per user in parallel")
+    command.add_argument("--days", type=int, help="keep this many days for every user instead of their setting")
+    command.add_argument("--batch-size", type=int, default=retention.RETENTION_BATCH_SIZE)
+    add_workers(command)
+
+    command = commands.add_parser("render", help="re-render each user's notes to a file, in parallel")
+    command.add_argument("out_dir")
+    command.add_argument("--format", choices=("txt", "csv"), default="txt")
+    add_user_selection(command)
+    add_workers(command)
+
+    args = parser.parse_args(argv)
+    if args.command == "retention" and args.days is not None and args.days < 1:
+        parser.error("retention --days must be at least 1 (0 would delete every note)")
+    logging.basicConfig(level=logging.INFO)
+    database.init_db()
+    try:
+        if args.command == "export":
+            export_notes(args.path, _selected_users(args), args.format, args.gzip)
+        elif args.command == "import":
+            import_notes(args.path, args.format, args.gzip, args.batch_size)
+        elif args.command == "retention":
+            run_retention(args.days, args.workers, args.batch_size)
+        else:
+            run_render(args.out_dir, args.format, _selected_users(args), args.workers)
+    except ValueError as e:
+        parser.exit(1, f"{e}\n")
+
+
+if __name__ == "__main__":
+    main()
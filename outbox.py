@@ -0,0 +1,231 @@
+"""Durable outbound email queue.
+
+The skill only enqueues mail (a row in email_outbox) and answers Alexa right
+away; a pool of worker threads delivers it with retries and exponential
+backoff. Workers can run inside the web process (start_workers) or on their
+own:
+
+    python outbox.py run --workers 4
+    python outbox.py status 42
+"""
+if __name__ == "__main__":
+    # Run as a job: read .env like main.py, before the modules below read their settings.
+    from dotenv import load_dotenv
+
+    load_dotenv(override=True)
+
+import argparse
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+
+import database
+import export
+import mailer
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_WORKERS = int(os.environ.get("OUTBOX_WORKERS", 2))
+OUTBOX_POLL_INTERVAL = float(os.environ.get("OUTBOX_POLL_INTERVAL", 2.0))
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get("OUTBOX_MAX_ATTEMPTS", 6))
+OUTBOX_BACKOFF_BASE = int(os.environ.get("OUTBOX_BACKOFF_BASE", 30))
+OUTBOX_BACKOFF_MAX = int(os.environ.get("OUTBOX_BACKOFF_MAX", 3600))
+# Emails claimed at once by a worker and pipelined over one SMTP session.
+OUTBOX_BATCH_SIZE = int(os.environ.get("OUTBOX_BATCH_SIZE", 20))
+# How long a claimed email stays reserved before another worker may retry it;
+# an export renews it after every part it sends.
+OUTBOX_LEASE_SECONDS = int(os.environ.get("OUTBOX_LEASE_SECONDS", 300))
+
+# Set by enqueue so in-process workers wake up without waiting for the next poll.
+_wakeup = threading.Event()
+
+
+def enqueue(user_id, recipient, subject, body):
+    """Queue an email and return its outbox id."""
+    email_id = database.enqueue_email(user_id, recipient, subject, body)
+    _wakeup.set()
+    return email_id
+
+
+def enqueue_export(user_id, recipient):
+    """Queue an export of all of a user's notes; it is rendered and split into parts at delivery time."""
+    email_id = database.enqueue_email(user_id, recipient, export.MSG_EMAIL_SUBJECT, "", kind="notes_export")
+    _wakeup.set()
+    return email_id
+
+
+def get_status(email_id):
+    """Delivery status of a queued email ('pending', 'sending', 'sent' or 'failed'), or None."""
+    return database.get_email_status(email_id)
+
+
+def backoff_delay(attempts):
+    """Seconds to wait before retrying after `attempts` failed attempts."""
+    return min(OUTBOX_BACKOFF_BASE * 2 ** (attempts - 1), OUTBOX_BACKOFF_MAX)
+
+
+class _LeaseLost(Exception):
+    """Another worker claimed the email this one is still sending."""
+
+
+def _record_failure(email_id, attempts, error):
+    if attempts >= OUTBOX_MAX_ATTEMPTS:
+        logger.error(f"Email {email_id} failed permanently after {attempts} attempts: {error}")
+        database.mark_email_failed(email_id, str(error), attempt=attempts)
+    else:
+        delay = backoff_delay(attempts)
+        logger.warning(f"Email {email_id} attempt {attempts} failed, retrying in {delay}s: {error}")
+        database.mark_email_failed(email_id, str(error), retry_at=int(time.time()) + delay, attempt=attempts)
+
+
+def _deliver_export(email_id, user_id, recipient, attempts, parts_sent):
+    """Stream a notes export, skipping parts a previous attempt already delivered.
+
+    Each delivered part is recorded together with a fresh lease, so a large
+    export keeps its claim for as long as parts keep going out. Records are
+    conditional on `attempts` (bumped by every claim): if another worker took
+    the email over anyway, this one stops at the next part.
+    """
+    messages = itertools.islice(export.iter_export_messages(user_id, recipient), parts_sent, None)
+    sent = [parts_sent]
+
+    def on_sent(index):
+        sent[0] = parts_sent + index + 1
+        if not database.set_email_parts_sent(email_id, sent[0], attempts, OUTBOX_LEASE_SECONDS):
+            raise _LeaseLost()
+
+    try:
+        mailer.send_stream(messages, on_sent)
+    except _LeaseLost:
+        logger.warning(f"Export {email_id} was claimed by another worker after part {sent[0]}; stopping here")
+        return False
+    except Exception as e:
+        _record_failure(email_id, attempts, e)
+        return False
+    if not database.mark_email_sent(email_id, attempts):
+        logger.warning(f"Export {email_id} was claimed by another worker while its last part was sent")
+        return False
+    logger.info(f"Export {email_id} sent in {sent[0]} part(s)")
+    return True
+
+
+def deliver(rows):
+    """Deliver claimed outbox rows and record outcomes. Returns the number delivered.
+
+    Plain messages in the batch share one SMTP session; exports are streamed
+    part by part.
+    """
+    messages = [row for row in rows if row[1] != "notes_export"]
+    exports = [row for row in rows if row[1] == "notes_export"]
+
+    sent = 0
+    if messages:
+        try:
+            built = [mailer.build_message(recipient, subject, body) for _, _, _, recipient, subject, body, _, _ in messages]
+            results = mailer.send_messages(built)
+        except Exception as e:
+            # Could not get a session at all: every claimed email failed this attempt.
+            results = [e] * len(messages)
+        for (email_id, _, _, _, _, _, attempts, _), error in zip(messages, results):
+            if error is None:
+                database.mark_email_sent(email_id, attempts)
+                sent += 1
+            else:
+                _record_failure(email_id, attempts, error)
+        if sent:
+            logger.info(f"Sent {sent} queued email(s)")
+
+    for email_id, _, user_id, recipient, _, _, attempts, parts_sent in exports:
+        sent += _deliver_export(email_id, user_id, recipient, attempts, parts_sent)
+    return sent
+
+
+def process_due(limit=None):
+    """Claim and deliver up to `limit` due emails (default OUTBOX_BATCH_SIZE). Returns how many were claimed."""
+    claimed = database.claim_emails(limit or OUTBOX_BATCH_SIZE, OUTBOX_LEASE_SECONDS)
+    if claimed:
+        deliver(claimed)
+    return len(claimed)
+
+
+class OutboxWorkerPool:
+    """Fixed pool of daemon threads draining the outbox.
+
+    `idle_tasks` are called whenever a worker finds nothing due, before it
+    sleeps; they must throttle themselves (e.g. drafts.store.maybe_evict).
+    """
+
+    def __init__(self, workers=OUTBOX_WORKERS, poll_interval=OUTBOX_POLL_INTERVAL, idle_tasks=()):
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.idle_tasks = list(idle_tasks)
+        self._stop_event = threading.Event()
+        self._threads = []
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                if process_due():
+                    continue
+            except Exception as e:
+                logger.error(f"Outbox worker error: {e}", exc_info=True)
+            for task in self.idle_tasks:
+                try:
+                    task()
+                except Exception as e:
+                    logger.error(f"Outbox idle task error: {e}", exc_info=True)
+            _wakeup.wait(self.poll_interval)
+            _wakeup.clear()
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"outbox-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self, timeout=None):
+        self._stop_event.set()
+        _wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+
+def start_workers(workers=OUTBOX_WORKERS, idle_tasks=()):
+    """Start the in-process worker pool. Returns None when disabled (workers <= 0)."""
+    if workers <= 0:
+        return None
+    return OutboxWorkerPool(workers, idle_tasks=idle_tasks).start()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Deliver queued emails or inspect their status.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    run = sub.add_parser("run", help="run the worker pool in the foreground")
+    run.add_argument("--workers", type=int, default=OUTBOX_WORKERS)
+    status = sub.add_parser("status", help="print the delivery status of an email")
+    status.add_argument("email_id", type=int)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    database.init_db()
+    if args.command == "status":
+        print(json.dumps(get_status(args.email_id)))
+        return
+
+    # Spilled drafts live in the database, so this process can recover abandoned ones too.
+    import drafts
+    idle_tasks = [drafts.store.maybe_evict] if drafts.DRAFT_SPILL else []
+    pool = OutboxWorkerPool(max(args.workers, 1), idle_tasks=idle_tasks).start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pool.stop(timeout=5)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,576 @@
+"""PostgreSQL storage backend (DB_BACKEND=postgres), for running several hosts.
+
+Implements the same operations as database.SqliteBackend over a pool of
+connections to DATABASE_URL (needs the `psycopg2` package). Compared with
+SQLite:
+
+    notes     partitioned by month on timestamp. A month's partition is
+              created on the first insert into it, and delete_notes_before
+              drops whole months before the cutoff instead of deleting rows.
+    inserts   one multi-row INSERT per batch (execute_values)
+    exports   iter_all_notes streams through a server-side (named) cursor
+    search    GIN-indexed tsvector of the same folded tokens the SQLite FTS
+              index uses, so both backends find the same notes
+    outbox    claims use FOR UPDATE SKIP LOCKED, so workers on every host
+              share the queue without waiting on each other
+
+Connections are taken from a ThreadedConnectionPool of DB_POOL_MAX
+connections per process; callers beyond that wait for a free connection.
+Set CACHE_BACKEND=redis (or none) as well when several hosts serve traffic.
+"""
+import contextlib
+import datetime
+import logging
+import os
+import threading
+import time
+import uuid
+
+import psycopg2
+import psycopg2.errors
+import psycopg2.extras
+import psycopg2.pool
+
+import database
+
+logger = logging.getLogger(__name__)
+
+DATABASE_URL = os.environ.get("DATABASE_URL", "postgresql:///blocco_note")
+DB_POOL_MIN = int(os.environ.get("DB_POOL_MIN", 1))
+DB_POOL_MAX = int(os.environ.get("DB_POOL_MAX", 20))
+
+# pg_advisory_xact_lock keys, so hosts starting together migrate and add partitions one at a time.
+_MIGRATION_LOCK = 0x626e0001
+_PARTITION_LOCK = 0x626e0002
+
+
+def _migration_1(cur):
+    """Schema equivalent to SQLite migrations 1-8, with notes partitioned by month."""
+    cur.execute('CREATE SEQUENCE notes_id_seq AS BIGINT')
+    cur.execute('''
+        CREATE TABLE notes (
+            id BIGINT NOT NULL DEFAULT nextval('notes_id_seq'),
+            content TEXT NOT NULL,
+            timestamp BIGINT NOT NULL,
+            user_id TEXT NOT NULL,
+            search TSVECTOR NOT NULL,
+            PRIMARY KEY (timestamp, id)
+        ) PARTITION BY RANGE (timestamp)
+    ''')
+    cur.execute('CREATE INDEX idx_notes_user_ts ON notes (user_id, timestamp DESC, id DESC)')
+    cur.execute('CREATE INDEX idx_notes_search ON notes USING GIN (search)')
+    cur.execute('''
+        CREATE TABLE user_settings (
+            user_id TEXT PRIMARY KEY,
+            retention_days INTEGER NOT NULL
+        )
+    ''')
+    cur.execute('''
+        CREATE TABLE retention_progress (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            last_user_id TEXT,
+            sweep_started_at BIGINT,
+            sweep_finished_at BIGINT,
+            lease_owner TEXT,
+            lease_until BIGINT
+        )
+    ''')
+    cur.execute('INSERT INTO retention_progress (id) VALUES (1)')
+    cur.execute('''
+        CREATE TABLE email_outbox (
+            id BIGSERIAL PRIMARY KEY,
+            user_id TEXT,
+            recipient TEXT NOT NULL,
+            subject TEXT NOT NULL,
+            body TEXT NOT NULL,
+            kind TEXT NOT NULL DEFAULT 'message',
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            parts_sent INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at BIGINT NOT NULL,
+            last_error TEXT,
+            created_at BIGINT NOT NULL,
+            updated_at BIGINT NOT NULL
+        )
+    ''')
+    cur.execute('CREATE INDEX idx_outbox_due ON email_outbox (status, next_attempt_at)')
+    cur.execute('''
+        CREATE TABLE drafts (
+            draft_id TEXT PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            updated_at BIGINT NOT NULL
+        )
+    ''')
+    cur.execute('CREATE INDEX idx_drafts_updated ON drafts (updated_at)')
+    cur.execute('''
+        CREATE TABLE draft_fragments (
+            id BIGSERIAL PRIMARY KEY,
+            draft_id TEXT NOT NULL REFERENCES drafts (draft_id) ON DELETE CASCADE,
+            fragment TEXT NOT NULL
+        )
+    ''')
+    cur.execute('CREATE INDEX idx_draft_fragments_draft ON draft_fragments (draft_id, id)')
+    cur.execute('''
+        CREATE TABLE profile_emails (
+            user_id TEXT PRIMARY KEY,
+            email TEXT NOT NULL,
+            fetched_at BIGINT NOT NULL
+        )
+    ''')
+
+def _migration_2(cur):
+    """Opt-in digest emails (SQLite migration 11): schedule, address and note cursor in user_settings."""
+    cur.execute('ALTER TABLE user_settings ALTER COLUMN retention_days DROP NOT NULL')
+    cur.execute('''
+        ALTER TABLE user_settings
+            ADD COLUMN digest_frequency TEXT,
+            ADD COLUMN digest_email TEXT,
+            ADD COLUMN digest_next_at BIGINT,
+            ADD COLUMN digest_after_ts BIGINT NOT NULL DEFAULT 0,
+            ADD COLUMN digest_after_id BIGINT NOT NULL DEFAULT 0
+    ''')
+    cur.execute('CREATE INDEX idx_user_settings_digest_due ON user_settings (digest_next_at) '
+                'WHERE digest_frequency IS NOT NULL')
+
+# Ordered schema migrations, recorded in the one-row schema_version table;
+# append new migrations at the end and never edit one that has shipped.
+MIGRATIONS = [
+    _migration_1,
+    _migration_2,
+]
+
+
+def _month_of(ts):
+    """(year, month) of the UTC month containing epoch `ts`."""
+    day = datetime.datetime.fromtimestamp(ts, datetime.timezone.utc)
+    return day.year, day.month
+
+
+def _month_bounds(year, month):
+    start = datetime.datetime(year, month, 1, tzinfo=datetime.timezone.utc)
+    end = datetime.datetime(year + month // 12, month % 12 + 1, 1, tzinfo=datetime.timezone.utc)
+    return int(start.timestamp()), int(end.timestamp())
+
+
+def _search_text(content):
+    """The folded tokens of a note, as indexed by the SQLite FTS table."""
+    return " ".join(database._fts_tokens(content))
+
+
+class PostgresBackend:
+    """Storage in a PostgreSQL database shared by every host."""
+
+    name = "postgres"
+
+    def __init__(self, dsn=DATABASE_URL, min_size=DB_POOL_MIN, max_size=DB_POOL_MAX):
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pool_pid = None
+        self._slots = None
+        # Months known to have a partition, so inserts skip the catalog check.
+        self._partitions = set()
+
+    def _get_pool(self):
+        # Created lazily and per process: gunicorn forks workers after import.
+        with self._lock:
+            if self._pool is None or self._pool_pid != os.getpid():
+                self._pool = psycopg2.pool.ThreadedConnectionPool(self.min_size, self.max_size, self.dsn)
+                self._pool_pid = os.getpid()
+                self._slots = threading.BoundedSemaphore(self.max_size)
+            return self._pool, self._slots
+
+    @contextlib.contextmanager
+    def _connection(self):
+        """A pooled connection inside one transaction: committed on success, rolled back on error."""
+        pool, slots = self._get_pool()
+        # ThreadedConnectionPool raises when exhausted; wait for a free connection instead.
+        slots.acquire()
+        try:
+            conn = pool.getconn()
+            try:
+                with conn:
+                    yield conn
+            finally:
+                pool.putconn(conn)
+        finally:
+            slots.release()
+
+    def _execute(self, sql, args=()):
+        """Run one statement in its own transaction. Returns the row count."""
+        with self._connection() as conn, conn.cursor() as cur:
+            cur.execute(sql, args)
+            return cur.rowcount
+
+    def _fetchall(self, sql, args=()):
+        with self._connection() as conn, conn.cursor() as cur:
+            cur.execute(sql, args)
+            return cur.fetchall()
+
+    def _fetchone(self, sql, args=()):
+        with self._connection() as conn, conn.cursor() as cur:
+            cur.execute(sql, args)
+            return cur.fetchone()
+
+    def init_db(self):
+        with self._connection() as conn, conn.cursor() as cur:
+            cur.execute('SELECT pg_advisory_xact_lock(%s)', (_MIGRATION_LOCK,))
+            cur.execute('CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)')
+            cur.execute('SELECT version FROM schema_version')
+            row = cur.fetchone()
+            if row is None:
+                cur.execute('INSERT INTO schema_version (version) VALUES (0)')
+            version = row[0] if row else 0
+            for number, migration in enumerate(MIGRATIONS[version:], version + 1):
+                migration(cur)
+                cur.execute('UPDATE schema_version SET version = %s', (number,))
+        self._ensure_partitions([int(time.time())])
+
+    def close(self):
+        with self._lock:
+            if self._pool is not None and self._pool_pid == os.getpid():
+                self._pool.closeall()
+            self._pool = None
+
+    # Notes
+
+    def _ensure_partitions(self, timestamps):
+        months = {_month_of(ts) for ts in timestamps} - self._partitions
+        if not months:
+            return
+        with self._connection() as conn, conn.cursor() as cur:
+            cur.execute('SELECT pg_advisory_xact_lock(%s)', (_PARTITION_LOCK,))
+            for year, month in sorted(months):
+                start, end = _month_bounds(year, month)
+                cur.execute(f'CREATE TABLE IF NOT EXISTS notes_p{year:04d}{month:02d} PARTITION OF notes '
+                            f'FOR VALUES FROM ({start}) TO ({end})')
+        self._partitions |= months
+
+    def save_notes_batch(self, notes, durable=False):
+        # Commits are durable as long as synchronous_commit is on (the server default).
+        rows = [(text, user_id, timestamp, _search_text(text)) for text, user_id, timestamp in notes]
+        self._ensure_partitions([row[2] for row in rows])
+        try:
+            self._insert_notes(rows)
+        except psycopg2.errors.CheckViolation:
+            # Another host dropped a month we thought existed (retention): recreate it.
+            self._partitions.clear()
+            self._ensure_partitions([row[2] for row in rows])
+            self._insert_notes(rows)
+
+    def _insert_notes(self, rows):
+        with self._connection() as conn, conn.cursor() as cur:
+            psycopg2.extras.execute_values(
+                cur, 'INSERT INTO notes (content, user_id, timestamp, search) VALUES %s', rows,
+                template="(%s, %s, %s, to_tsvector('simple', %s))", page_size=1000)
+
+    def get_notes_page(self, user_id, before, limit):
+        if before is None:
+            return self._fetchall('''
+                SELECT content, timestamp, id FROM notes WHERE user_id = %s
+                ORDER BY timestamp DESC, id DESC LIMIT %s
+            ''', (user_id, limit))
+        return self._fetchall('''
+            SELECT content, timestamp, id FROM notes WHERE user_id = %s AND (timestamp, id) < (%s, %s)
+            ORDER BY timestamp DESC, id DESC LIMIT %s
+        ''', (user_id, before[0], before[1], limit))
+
+    def get_all_notes(self, user_id):
+        return self._fetchall('SELECT content, timestamp FROM notes WHERE user_id = %s ORDER BY timestamp DESC, id DESC',
+                              (user_id,))
+
+    def iter_all_notes(self, user_id, batch_size):
+        with self._connection() as conn:
+            # Named cursor: rows stay on the server and arrive batch_size at a time.
+            with conn.cursor(name=f"export_{uuid.uuid4().hex}") as cur:
+                cur.itersize = batch_size
+                cur.execute('SELECT content, timestamp FROM notes WHERE user_id = %s ORDER BY timestamp DESC, id DESC',
+                            (user_id,))
+                yield from cur
+
+    def count_notes(self):
+        return self._fetchone('SELECT count(*) FROM notes')[0]
+
+    def get_note_users(self, after_user_id, limit):
+        # DISTINCT walks idx_notes_user_ts in user_id order and stops after `limit` users.
+        rows = self._fetchall('SELECT DISTINCT user_id FROM notes WHERE user_id > %s ORDER BY user_id LIMIT %s',
+                              (after_user_id or '', limit))
+        return [row[0] for row in rows]
+
+    def has_notes(self, user_id):
+        return self._fetchone('SELECT 1 FROM notes WHERE user_id = %s LIMIT 1', (user_id,)) is not None
+
+    def search_candidates(self, user_id, terms, prefix, limit):
+        # Terms are \w+ tokens; quoting keeps them literal inside to_tsquery.
+        lexemes = [f"'{term}'" for term in terms]
+        if prefix:
+            lexemes[-1] += ":*"
+        return self._fetchall('''
+            SELECT content, timestamp, id FROM notes
+            WHERE user_id = %s AND search @@ to_tsquery('simple', %s)
+            ORDER BY id DESC LIMIT %s
+        ''', (user_id, " & ".join(lexemes), limit))
+
+    # Settings and retention
+
+    def set_retention_days(self, user_id, days):
+        self._execute('''
+            INSERT INTO user_settings (user_id, retention_days) VALUES (%s, %s)
+            ON CONFLICT (user_id) DO UPDATE SET retention_days = excluded.retention_days
+        ''', (user_id, days))
+
+    def get_retention_days(self, user_id):
+        row = self._fetchone('SELECT retention_days FROM user_settings WHERE user_id = %s', (user_id,))
+        return row[0] if row else None
+
+    def delete_expired_notes(self, user_id, cutoff, batch_size):
+        if batch_size is None:
+            return self._execute('DELETE FROM notes WHERE user_id = %s AND timestamp < %s', (user_id, cutoff))
+        return self._execute('''
+            DELETE FROM notes WHERE (timestamp, id) IN (
+                SELECT timestamp, id FROM notes WHERE user_id = %s AND timestamp < %s LIMIT %s
+            )
+        ''', (user_id, cutoff, batch_size))
+
+    def delete_notes_before(self, cutoff, batch_size):
+        deleted = 0
+        with self._connection() as conn, conn.cursor() as cur:
+            cur.execute('SELECT pg_advisory_xact_lock(%s)', (_PARTITION_LOCK,))
+            cur.execute('''
+                SELECT child.relname FROM pg_inherits
+                JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+                WHERE pg_inherits.inhparent = 'notes'::regclass
+            ''')
+            for (table,) in cur.fetchall():
+                year, month = int(table[-6:-2]), int(table[-2:])
+                if _month_bounds(year, month)[1] <= cutoff:
+                    cur.execute(f'SELECT count(*) FROM {table}')
+                    deleted += cur.fetchone()[0]
+                    cur.execute(f'DROP TABLE {table}')
+                    self._partitions.discard((year, month))
+                    logger.info(f"Dropped notes partition {table}")
+        # The month straddling the cutoff keeps its newer rows.
+        deleted += self._execute('''
+            DELETE FROM notes WHERE (timestamp, id) IN (
+                SELECT timestamp, id FROM notes WHERE timestamp < %s LIMIT %s
+            )
+        ''', (cutoff, batch_size))
+        return deleted
+
+    def reclaim_space(self, max_pages):
+        # Autovacuum keeps dead tuples in check and dropped partitions free their files at once.
+        return 0
+
+    def get_retention_settings(self, after_user_id, limit):
+        return self._fetchall(
+            'SELECT user_id, retention_days FROM user_settings '
+            'WHERE user_id > %s AND retention_days > 0 ORDER BY user_id LIMIT %s',
+            (after_user_id or '', limit))
+
+    def acquire_retention_lease(self, owner, ttl_seconds):
+        now = int(time.time())
+        return self._execute('''
+            UPDATE retention_progress SET lease_owner = %s, lease_until = %s
+            WHERE id = 1 AND (lease_owner IS NULL OR lease_owner = %s OR lease_until < %s)
+        ''', (owner, now + ttl_seconds, owner, now)) == 1
+
+    def release_retention_lease(self, owner):
+        self._execute('UPDATE retention_progress SET lease_owner = NULL, lease_until = NULL WHERE id = 1 AND lease_owner = %s',
+                      (owner,))
+
+    def get_retention_progress(self):
+        return self._fetchone('SELECT last_user_id, sweep_started_at, sweep_finished_at FROM retention_progress WHERE id = 1')
+
+    def set_retention_progress(self, last_user_id, started_at, finished_at):
+        self._execute('''
+            UPDATE retention_progress
+            SET last_user_id = %s,
+                sweep_started_at = COALESCE(%s, sweep_started_at),
+                sweep_finished_at = COALESCE(%s, sweep_finished_at)
+            WHERE id = 1
+        ''', (last_user_id, started_at, finished_at))
+
+    # Digests
+
+    def set_digest(self, user_id, frequency, email, next_at, after_ts):
+        self._execute('''
+            INSERT INTO user_settings (user_id, digest_frequency, digest_email, digest_next_at, digest_after_ts)
+            VALUES (%s, %s, %s, %s, %s)
+            ON CONFLICT (user_id) DO UPDATE SET
+                digest_after_ts = CASE WHEN user_settings.digest_frequency IS NULL
+                                       THEN excluded.digest_after_ts ELSE user_settings.digest_after_ts END,
+                digest_after_id = CASE WHEN user_settings.digest_frequency IS NULL
+                                       THEN 0 ELSE user_settings.digest_after_id END,
+                digest_frequency = excluded.digest_frequency,
+                digest_email = excluded.digest_email,
+                digest_next_at = excluded.digest_next_at
+        ''', (user_id, frequency, email, next_at, after_ts or 0))
+
+    def get_digest(self, user_id):
+        return self._fetchone(
+            'SELECT digest_frequency, digest_email, digest_next_at FROM user_settings '
+            'WHERE user_id = %s AND digest_frequency IS NOT NULL', (user_id,))
+
+    def update_digest_email(self, user_id, email):
+        self._execute('''
+            UPDATE user_settings SET
+                digest_email = COALESCE(%s, digest_email),
+                digest_frequency = CASE WHEN %s::text IS NULL THEN NULL ELSE digest_frequency END,
+                digest_next_at = CASE WHEN %s::text IS NULL THEN NULL ELSE digest_next_at END
+            WHERE user_id = %s AND digest_frequency IS NOT NULL
+        ''', (email, email, email, user_id))
+
+    def claim_due_digests(self, now, limit, lease_seconds):
+        # SKIP LOCKED: jobs on several hosts split the due users between them.
+        return self._fetchall('''
+            WITH due AS (
+                SELECT user_id, digest_next_at FROM user_settings
+                WHERE digest_frequency IS NOT NULL AND digest_next_at <= %s
+                ORDER BY digest_next_at LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            )
+            UPDATE user_settings SET digest_next_at = %s FROM due WHERE user_settings.user_id = due.user_id
+            RETURNING user_settings.user_id, digest_frequency, digest_email, due.digest_next_at,
+                      digest_after_ts, digest_after_id
+        ''', (now, limit, now + lease_seconds))
+
+    def get_new_notes(self, cursors, limit):
+        if not cursors:
+            return {}
+        user_ids, after_ts, after_ids = zip(*cursors)
+        # One round trip per batch: an index range scan of idx_notes_user_ts per user.
+        rows = self._fetchall('''
+            SELECT c.user_id, n.content, n.timestamp, n.id
+            FROM unnest(%s::text[], %s::bigint[], %s::bigint[]) AS c (user_id, after_ts, after_id)
+            CROSS JOIN LATERAL (
+                SELECT content, timestamp, id FROM notes
+                WHERE notes.user_id = c.user_id AND (timestamp, id) > (c.after_ts, c.after_id)
+                ORDER BY timestamp, id LIMIT %s
+            ) AS n
+            ORDER BY c.user_id, n.timestamp, n.id
+        ''', (list(user_ids), list(after_ts), list(after_ids), limit))
+        notes = {}
+        for user_id, content, timestamp, note_id in rows:
+            notes.setdefault(user_id, []).append((content, timestamp, note_id))
+        return notes
+
+    def record_digests(self, updates):
+        with self._connection() as conn, conn.cursor() as cur:
+            psycopg2.extras.execute_batch(cur, '''
+                UPDATE user_settings SET digest_next_at = %s, digest_after_ts = %s, digest_after_id = %s
+                WHERE user_id = %s AND digest_frequency IS NOT NULL
+            ''', [(next_at, after_ts, after_id, user_id) for user_id, next_at, after_ts, after_id in updates])
+
+    # Email outbox
+
+    def enqueue_email(self, user_id, recipient, subject, body, kind):
+        now = int(time.time())
+        return self._fetchone('''
+            INSERT INTO email_outbox (user_id, recipient, subject, body, kind, next_attempt_at, created_at, updated_at)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s) RETURNING id
+        ''', (user_id, recipient, subject, body, kind, now, now, now))[0]
+
+    def claim_emails(self, limit, lease_seconds):
+        now = int(time.time())
+        return self._fetchall('''
+            UPDATE email_outbox
+            SET status = 'sending', attempts = attempts + 1, next_attempt_at = %s, updated_at = %s
+            WHERE id IN (
+                SELECT id FROM email_outbox
+                WHERE status IN ('pending', 'sending') AND next_attempt_at <= %s
+                ORDER BY next_attempt_at LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING id, kind, user_id, recipient, subject, body, attempts, parts_sent
+        ''', (now + lease_seconds, now, now, limit))
+
+    def mark_email_sent(self, email_id, attempt):
+        return self._execute(
+            "UPDATE email_outbox SET status = 'sent', last_error = NULL, updated_at = %s "
+            "WHERE id = %s AND (%s IS NULL OR attempts = %s)",
+            (int(time.time()), email_id, attempt, attempt)) == 1
+
+    def mark_email_failed(self, email_id, error, retry_at, attempt):
+        if retry_at is None:
+            return self._execute(
+                "UPDATE email_outbox SET status = 'failed', last_error = %s, updated_at = %s "
+                "WHERE id = %s AND (%s IS NULL OR attempts = %s)",
+                (error, int(time.time()), email_id, attempt, attempt)) == 1
+        return self._execute(
+            "UPDATE email_outbox SET status = 'pending', last_error = %s, next_attempt_at = %s, updated_at = %s "
+            "WHERE id = %s AND (%s IS NULL OR attempts = %s)",
+            (error, retry_at, int(time.time()), email_id, attempt, attempt)) == 1
+
+    def set_email_parts_sent(self, email_id, parts_sent, attempt, lease_until):
+        return self._execute(
+            'UPDATE email_outbox SET parts_sent = %s, next_attempt_at = COALESCE(%s, next_attempt_at), updated_at = %s '
+            'WHERE id = %s AND (%s IS NULL OR attempts = %s)',
+            (parts_sent, lease_until, int(time.time()), email_id, attempt, attempt)) == 1
+
+    def get_email_status(self, email_id):
+        return self._fetchone('SELECT status, attempts, last_error, updated_at FROM email_outbox WHERE id = %s', (email_id,))
+
+    # Dictation drafts
+
+    def create_draft(self, draft_id, user_id):
+        with self._connection() as conn, conn.cursor() as cur:
+            # Like SQLite's INSERT OR REPLACE: a reused id starts from an empty draft.
+            cur.execute('DELETE FROM drafts WHERE draft_id = %s', (draft_id,))
+            cur.execute('INSERT INTO drafts (draft_id, user_id, updated_at) VALUES (%s, %s, %s)',
+                        (draft_id, user_id, int(time.time())))
+
+    def append_draft_fragment(self, draft_id, user_id, fragment):
+        with self._connection() as conn, conn.cursor() as cur:
+            cur.execute('''
+                INSERT INTO drafts (draft_id, user_id, updated_at) VALUES (%s, %s, %s)
+                ON CONFLICT (draft_id) DO UPDATE SET updated_at = excluded.updated_at
+            ''', (draft_id, user_id, int(time.time())))
+            cur.execute('INSERT INTO draft_fragments (draft_id, fragment) VALUES (%s, %s)', (draft_id, fragment))
+
+    def get_draft_fragments(self, draft_id):
+        return [row[0] for row in self._fetchall('SELECT fragment FROM draft_fragments WHERE draft_id = %s ORDER BY id',
+                                                 (draft_id,))]
+
+    def get_draft_user(self, draft_id):
+        row = self._fetchone('SELECT user_id FROM drafts WHERE draft_id = %s', (draft_id,))
+        return row[0] if row else None
+
+    def delete_draft(self, draft_id):
+        self._execute('DELETE FROM drafts WHERE draft_id = %s', (draft_id,))
+
+    def claim_draft(self, draft_id, updated_before):
+        # The select sees the statement's snapshot, taken before the cascade removes the fragments.
+        rows = self._fetchall('''
+            WITH taken AS (
+                DELETE FROM drafts WHERE draft_id = %s AND updated_at < COALESCE(%s, updated_at + 1)
+                RETURNING draft_id, user_id
+            )
+            SELECT taken.user_id, f.fragment
+            FROM taken LEFT JOIN draft_fragments f ON f.draft_id = taken.draft_id
+            ORDER BY f.id
+        ''', (draft_id, updated_before))
+        if not rows:
+            return None
+        return rows[0][0], [row[1] for row in rows if row[1] is not None]
+
+    def get_stale_drafts(self, updated_before, limit):
+        return [row[0] for row in self._fetchall(
+            'SELECT draft_id FROM drafts WHERE updated_at < %s ORDER BY updated_at LIMIT %s', (updated_before, limit))]
+
+    # Profile emails
+
+    def get_profile_email(self, user_id, fetched_after):
+        row = self._fetchone('SELECT email FROM profile_emails WHERE user_id = %s AND fetched_at > %s',
+                             (user_id, fetched_after))
+        return row[0] if row else None
+
+    def set_profile_email(self, user_id, email):
+        self._execute('''
+            INSERT INTO profile_emails (user_id, email, fetched_at) VALUES (%s, %s, %s)
+            ON CONFLICT (user_id) DO UPDATE SET email = excluded.email, fetched_at = excluded.fetched_at
+        ''', (user_id, email, int(time.time())))
+
+    def delete_profile_email(self, user_id):
+        self._execute('DELETE FROM profile_emails WHERE user_id = %s', (user_id,))
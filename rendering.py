@@ -0,0 +1,97 @@
+"""Turn (content, epoch timestamp) note rows into speech and email text.
+
+Format settings are read once at import. Dates are rendered with
+time.strftime on the UTC epoch and memoized; when DATE_FORMAT has no
+seconds field the memo is keyed by minute, so notes dictated in the same
+minute share one strftime call.
+"""
+import functools
+import logging
+import time
+from xml.sax.saxutils import escape
+
+import config
+
+logger = logging.getLogger(__name__)
+
+DATE_FORMAT = config.get().date_format
+MSG_NOTE_FORMAT = config.get().messages["MSG_NOTE_FORMAT"]
+EMAIL_NOTE_FORMAT = "{num}. [{date}] {content}"
+
+# Alexa rejects outputSpeech longer than 8000 characters including SSML markup.
+SPEECH_MAX_CHARS = 8000
+SPEECH_SEPARATOR = ". "
+
+_SECONDS_DIRECTIVES = ("%S", "%T", "%X", "%c", "%s", "%r")
+_MINUTE_RESOLUTION = not any(d in DATE_FORMAT for d in _SECONDS_DIRECTIVES)
+
+
+@functools.lru_cache(maxsize=4096)
+def _format_bucket(ts):
+    return time.strftime(DATE_FORMAT, time.gmtime(ts))
+
+
+def format_timestamp(ts):
+    """Render a UTC epoch timestamp with DATE_FORMAT; non-numeric values are returned as text."""
+    try:
+        return _format_bucket(ts - ts % 60 if _MINUTE_RESOLUTION else ts)
+    except (TypeError, ValueError, OverflowError) as e:
+        logger.error(f"Date formatting error: {e}")
+        return str(ts)
+
+
+def iter_lines(rows, line_format, start=1):
+    """Yield one formatted line per (content, timestamp, ...) row, numbered from `start`."""
+    fmt = line_format.format
+    date = format_timestamp
+    for num, (content, timestamp, *_) in enumerate(rows, start):
+        yield fmt(num=num, date=date(timestamp), content=content)
+
+
+def iter_speech_lines(rows, start=1):
+    """Yield "Nota N del <date>: <content>" lines for read-back."""
+    return iter_lines(rows, MSG_NOTE_FORMAT, start)
+
+
+def iter_email_lines(rows, start=1):
+    """Yield "N. [<date>] <content>" lines for the email body."""
+    return iter_lines(rows, EMAIL_NOTE_FORMAT, start)
+
+
+def render_speech(rows, start=1):
+    """Join speech lines into one read-back string."""
+    return ". ".join(iter_speech_lines(rows, start))
+
+
+def render_email_body(rows, start=1):
+    """Join email lines into one body string."""
+    return "\n".join(iter_email_lines(rows, start))
+
+
+def render_speech_page(rows, start, budget):
+    """Render as many rows as fit in `budget` characters of SSML-escaped speech.
+
+    Returns (text, shown) where `shown` is the number of rows used. The first
+    row is always included, truncated if it alone exceeds the budget.
+    """
+    parts = []
+    used = 0
+    for line in iter_speech_lines(rows, start):
+        line = escape(line)
+        cost = len(line) + (len(SPEECH_SEPARATOR) if parts else 0)
+        if used + cost > budget:
+            if not parts:
+                parts.append(_truncate_escaped(line, budget - 1) + "…")
+            break
+        parts.append(line)
+        used += cost
+    return SPEECH_SEPARATOR.join(parts), len(parts)
+
+
+def _truncate_escaped(text, limit):
+    """Cut SSML-escaped text to `limit` characters without splitting an &entity;."""
+    text = text[:max(limit, 0)]
+    amp = text.rfind("&", max(len(text) - 5, 0))
+    if amp != -1 and ";" not in text[amp:]:
+        text = text[:amp]
+    return text
@@ -0,0 +1,153 @@
+"""Background retention sweeper.
+
+Deletes expired notes for every user listed in user_settings, in bounded
+chunks, recording progress in retention_progress so an interrupted sweep
+resumes from the last finished user. With RETENTION_MAX_DAYS set, every
+note older than that is deleted first, whatever the user's own setting;
+backends that partition notes by time drop whole partitions for it. After
+each sweep up to RETENTION_VACUUM_PAGES free pages are handed back to the
+filesystem (SQLite incremental auto-vacuum), so the file shrinks a step at
+a time instead of in one long VACUUM. Runs either as a daemon thread inside
+the web process (see start_background_sweeper) or from the command line:
+
+    python retention.py --once
+    python retention.py --interval 3600
+"""
+if __name__ == "__main__":
+    # Run as a job: read .env like main.py, before the modules below read their settings.
+    from dotenv import load_dotenv
+
+    load_dotenv(override=True)
+
+import argparse
+import logging
+import os
+import socket
+import threading
+import time
+
+import database
+
+logger = logging.getLogger(__name__)
+
+RETENTION_SWEEP_INTERVAL = int(os.environ.get("RETENTION_SWEEP_INTERVAL", 3600))
+RETENTION_BATCH_SIZE = int(os.environ.get("RETENTION_BATCH_SIZE", 1000))
+RETENTION_USERS_PER_PAGE = int(os.environ.get("RETENTION_USERS_PER_PAGE", 500))
+# Lease held while sweeping so gunicorn workers do not sweep concurrently.
+RETENTION_LEASE_SECONDS = int(os.environ.get("RETENTION_LEASE_SECONDS", 300))
+# Age in days past which any note is deleted (0 = no global limit).
+RETENTION_MAX_DAYS = int(os.environ.get("RETENTION_MAX_DAYS", 0))
+# Free pages released per sweep (0 = never shrink the file).
+RETENTION_VACUUM_PAGES = int(os.environ.get("RETENTION_VACUUM_PAGES", 10000))
+
+
+def _owner_id():
+    return f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+
+
+def expire_user_notes(user_id, days, now, batch_size=RETENTION_BATCH_SIZE):
+    """Delete one user's notes older than `days` before `now`, batch_size at a time. Returns how many were deleted."""
+    cutoff = database.retention_cutoff(days, now)
+    deleted_total = 0
+    while True:
+        deleted = database.delete_expired_notes(user_id, cutoff, batch_size)
+        deleted_total += deleted
+        if deleted < batch_size:
+            return deleted_total
+
+
+def sweep_once(batch_size=RETENTION_BATCH_SIZE, users_per_page=RETENTION_USERS_PER_PAGE, stop_event=None,
+               max_days=RETENTION_MAX_DAYS):
+    """Run (or resume) one full sweep. Returns number of deleted notes, or None if another worker holds the lease."""
+    owner = _owner_id()
+    if not database.acquire_retention_lease(owner, RETENTION_LEASE_SECONDS):
+        return None
+
+    deleted_total = 0
+    try:
+        last_user_id, started_at, _ = database.get_retention_progress()
+        if last_user_id is None:
+            started_at = int(time.time())
+            database.set_retention_progress(None, started_at=started_at)
+        else:
+            logger.info(f"Resuming retention sweep after user {last_user_id}")
+
+        # One cutoff reference for the whole sweep keeps results consistent across pages.
+        now = int(time.time())
+        if max_days > 0:
+            cutoff = database.retention_cutoff(max_days, now)
+            while True:
+                deleted = database.delete_notes_before(cutoff, batch_size)
+                deleted_total += deleted
+                if deleted < batch_size:
+                    break
+                database.acquire_retention_lease(owner, RETENTION_LEASE_SECONDS)
+        while True:
+            page = database.get_retention_settings(last_user_id, users_per_page)
+            if not page:
+                break
+            for user_id, days in page:
+                if stop_event is not None and stop_event.is_set():
+                    return deleted_total
+                deleted_total += expire_user_notes(user_id, days, now, batch_size)
+                last_user_id = user_id
+                database.set_retention_progress(last_user_id)
+                database.acquire_retention_lease(owner, RETENTION_LEASE_SECONDS)
+
+        database.set_retention_progress(None, finished_at=int(time.time()))
+        released = database.reclaim_space(RETENTION_VACUUM_PAGES) if RETENTION_VACUUM_PAGES > 0 else 0
+        logger.info(f"Retention sweep finished: deleted {deleted_total} notes, released {released} pages")
+        return deleted_total
+    finally:
+        database.release_retention_lease(owner)
+
+
+class RetentionSweeper(threading.Thread):
+    """Daemon thread that runs sweep_once every `interval` seconds until stopped."""
+
+    def __init__(self, interval=RETENTION_SWEEP_INTERVAL):
+        super().__init__(name="retention-sweeper", daemon=True)
+        self.interval = interval
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            try:
+                sweep_once(stop_event=self._stop_event)
+            except Exception as e:
+                logger.error(f"Retention sweep failed: {e}", exc_info=True)
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+
+
+def start_background_sweeper(interval=RETENTION_SWEEP_INTERVAL):
+    """Start the sweeper thread. Returns None when disabled (interval <= 0)."""
+    if interval <= 0:
+        return None
+    sweeper = RetentionSweeper(interval)
+    sweeper.start()
+    return sweeper
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Delete expired notes for all users.")
+    parser.add_argument("--once", action="store_true", help="run a single sweep and exit")
+    parser.add_argument("--interval", type=int, default=RETENTION_SWEEP_INTERVAL, help="seconds between sweeps")
+    parser.add_argument("--batch-size", type=int, default=RETENTION_BATCH_SIZE)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    database.init_db()
+    while True:
+        deleted = sweep_once(batch_size=args.batch_size)
+        if deleted is None:
+            logger.info("Another worker is sweeping; skipping")
+        if args.once:
+            break
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""Table-driven request routing for the skill.
+
+The SDK's default request mapper asks every registered handler's can_handle
+in turn, and each of those builds a fresh is_intent_name/is_request_type
+predicate per call. RoutingTable is filled once at startup with keys of
+(request type, intent name, session state) and finds a handler with at most
+two dict lookups: the exact state first, then the route for any state. The
+session state machine therefore lives in the table instead of in `if state
+== "WRITING"` branches inside each handler.
+"""
+from ask_sdk_core.dispatch_components import AbstractRequestHandler
+from ask_sdk_runtime.dispatch_components.request_components import (
+    AbstractRequestMapper, GenericRequestHandlerChain)
+
+# Routes registered with this state match whatever the session state is.
+ANY_STATE = None
+
+
+class RoutedHandler(AbstractRequestHandler):
+    """Request handler reached through a RoutingTable, which has already matched the request."""
+
+    def can_handle(self, handler_input):
+        return True
+
+
+class RoutingTable(AbstractRequestMapper):
+    """Maps (request type, intent name, session "state" attribute) to a handler chain."""
+
+    def __init__(self):
+        self._chains = {}
+
+    def add(self, handler, intents=(), request_type="IntentRequest", states=(ANY_STATE,)):
+        """Route each of `intents` (or, for other request types, the request itself) in each of `states` to `handler`."""
+        chain = GenericRequestHandlerChain(request_handler=handler)
+        for intent in intents or (None,):
+            for state in states:
+                key = (request_type, intent, state)
+                if key in self._chains:
+                    raise ValueError(f"Route {key} already goes to {type(self._chains[key].request_handler).__name__}")
+                self._chains[key] = chain
+
+    def routes(self):
+        """(request type, intent, state) -> handler, for inspection and benchmarks."""
+        return {key: chain.request_handler for key, chain in self._chains.items()}
+
+    def get_request_handler_chain(self, handler_input):
+        envelope = handler_input.request_envelope
+        request = envelope.request
+        request_type = request.object_type
+        intent = request.intent.name if request_type == "IntentRequest" else None
+        session = envelope.session
+        state = session.attributes.get("state") if session is not None and session.attributes else ANY_STATE
+        chains = self._chains
+        return chains.get((request_type, intent, state)) or chains.get((request_type, intent, ANY_STATE))
+
+    def install(self, skill):
+        """Consult this table before the SDK's own (linear) mapper on a created skill."""
+        skill.request_dispatcher.request_mappers.insert(0, self)
@@ -0,0 +1,147 @@
+"""Local HTTPS stand-in for the Alexa profile API (Profile.email).
+
+Stand-in for api.amazonalexa.com when exercising alexa_api.py:
+
+    python -m tools.alexa_api_stub --port 8443 --email me@example.com
+
+It serves a freshly generated self-signed certificate for 127.0.0.1; point
+requests at it with REQUESTS_CA_BUNDLE=<printed cert path>, and use
+https://127.0.0.1:8443 as the apiEndpoint of the request envelope. Set
+`status` to 403 to simulate a revoked permission. Use AlexaApiStub from
+Python to run it in a background thread and count calls and connections.
+"""
+import argparse
+import datetime
+import http.server
+import ipaddress
+import json
+import os
+import ssl
+import tempfile
+import threading
+import time
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+
+
+def write_self_signed_cert(directory):
+    """Write cert.pem and key.pem for 127.0.0.1 into `directory`; returns their paths."""
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "127.0.0.1")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name).issuer_name(name).public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(days=1)).not_valid_after(now + datetime.timedelta(days=7))
+        .add_extension(x509.SubjectAlternativeName([x509.IPAddress(ipaddress.ip_address("127.0.0.1"))]), critical=False)
+        .add_extension(x509.BasicConstraints(ca=True, path_length=None), critical=True)
+        .sign(key, hashes.SHA256())
+    )
+    cert_path = os.path.join(directory, "cert.pem")
+    key_path = os.path.join(directory, "key.pem")
+    with open(cert_path, "wb") as f:
+        f.write(cert.public_bytes(serialization.Encoding.PEM))
+    with open(key_path, "wb") as f:
+        f.write(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                  serialization.NoEncryption()))
+    return cert_path, key_path
+
+
+class _ApiHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real API
+    disable_nagle_algorithm = True  # headers and body are separate writes
+
+    def setup(self):
+        super().setup()
+        with self.server.stub.lock:
+            self.server.stub.connections += 1
+
+    def do_GET(self):
+        stub = self.server.stub
+        with stub.lock:
+            stub.calls += 1
+        if stub.delay:
+            time.sleep(stub.delay)
+        if not self.path.endswith("/Profile.email"):
+            status, body = 404, {"code": "NOT_FOUND", "message": "Unknown path"}
+        elif stub.status == 200:
+            status, body = 200, stub.email
+        else:
+            status, body = stub.status, {"code": "ACCESS_DENIED", "message": "Access denied with reason: FORBIDDEN"}
+        raw = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(raw)))
+        self.end_headers()
+        self.wfile.write(raw)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class AlexaApiStub:
+    """Profile API stub over HTTPS in a background thread."""
+
+    def __init__(self, host="127.0.0.1", port=0, email="user@example.com", delay=0.0):
+        self.email = email
+        self.status = 200
+        self.delay = delay
+        self.calls = 0
+        self.connections = 0
+        self.lock = threading.Lock()
+        self._dir = tempfile.TemporaryDirectory()
+        self.cert_path, key_path = write_self_signed_cert(self._dir.name)
+        self._server = http.server.ThreadingHTTPServer((host, port), _ApiHandler)
+        self._server.daemon_threads = True
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(self.cert_path, key_path)
+        self._server.socket = context.wrap_socket(self._server.socket, server_side=True)
+        self._server.stub = self
+        self.host, self.port = self._server.server_address[:2]
+        self.endpoint = f"https://{self.host}:{self.port}"
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="alexa-api-stub", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._dir.cleanup()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local Alexa profile API stub.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8443)
+    parser.add_argument("--email", default="user@example.com")
+    parser.add_argument("--status", type=int, default=200, help="HTTP status for Profile.email (403 = permission revoked)")
+    parser.add_argument("--delay", type=float, default=0.0, help="seconds to wait before each reply")
+    args = parser.parse_args()
+
+    stub = AlexaApiStub(args.host, args.port, args.email, args.delay)
+    stub.status = args.status
+    stub.start()
+    print(f"Alexa API stub on {stub.endpoint} (REQUESTS_CA_BUNDLE={stub.cert_path})")
+    try:
+        while True:
+            time.sleep(5)
+            print(f"connections={stub.connections} calls={stub.calls}")
+    except KeyboardInterrupt:
+        stub.stop()
+
+
+if __name__ == "__main__":
+    main()
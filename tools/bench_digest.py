@@ -0,0 +1,102 @@
+"""Throughput of the digest job against a local SMTP sink, with thousands of synthetic subscribers.
+
+Usage: python -m tools.bench_digest [--users 5000] [--notes 6] [--idle-share 0.1] [--senders 2] [--rate 0]
+
+Creates --users opted-in users whose digest is due, each with --notes notes
+from before their last digest and --notes saved since, except --idle-share
+of them who saved nothing new. Runs digest.run_once against the sink and
+prints one line per batch (query, render and send time, messages/second),
+then checks that each user with new notes got exactly one email, that no
+note from before a cursor was sent again, that a second run sends nothing,
+and how many SMTP connections were opened. --delay adds per-command latency
+on the sink to mimic a remote relay.
+"""
+import argparse
+import email
+import os
+import random
+import tempfile
+import time
+
+import database
+import digest
+import mailer
+from tools.smtp_sink import SmtpSink
+
+WORDS = "comprare latte pane chiamare mario domani riunione ufficio pagare bolletta dentista".split()
+
+
+def _populate(users, notes_per_user, idle_share, now, rng):
+    """Subscribe users due at `now`; returns the ids of those with new notes."""
+    cursor_ts = now - 86400
+    active, batch = [], []
+    for i in range(users):
+        user_id = f"amzn1.ask.account.DIGEST{i:06d}"
+        for n in range(notes_per_user):
+            batch.append((f"OLD {' '.join(rng.choices(WORDS, k=6))}", user_id, cursor_ts - 3600 - n * 60))
+        if rng.random() >= idle_share:
+            active.append(user_id)
+            for n in range(notes_per_user):
+                batch.append((f"NEW {' '.join(rng.choices(WORDS, k=6))}", user_id, cursor_ts + 60 + n * 60))
+        if len(batch) >= 5000:
+            database.save_notes_batch(batch)
+            batch = []
+    if batch:
+        database.save_notes_batch(batch)
+    for i in range(users):
+        database.set_digest(f"amzn1.ask.account.DIGEST{i:06d}", rng.choice(("daily", "weekly")),
+                            f"user{i}@example.com", next_at=now - rng.randrange(3600), after_ts=cursor_ts)
+    return active
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--notes', type=int, default=6, help='old and new notes per user')
+    parser.add_argument('--idle-share', type=float, default=0.1, help='share of users without new notes')
+    parser.add_argument('--batch-size', type=int, default=digest.DIGEST_BATCH_SIZE)
+    parser.add_argument('--senders', type=int, default=digest.DIGEST_SENDERS)
+    parser.add_argument('--rate', type=float, default=0, help='messages per second (0 = no limit)')
+    parser.add_argument('--delay', type=float, default=0.0, help='seconds of latency per SMTP command')
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    now = int(time.time())
+    with tempfile.TemporaryDirectory() as tmp, SmtpSink(delay=args.delay) as sink:
+        database.DB_NAME = os.path.join(tmp, 'bench.db')
+        database.init_db()
+        os.environ.update(SMTP_SERVER=sink.host, SMTP_PORT=str(sink.port), SMTP_ENCRYPTION='NONE')
+        mailer.reset()
+
+        t0 = time.perf_counter()
+        active = _populate(args.users, args.notes, args.idle_share, now, rng)
+        print(f"{args.users} subscribers, {len(active)} with new notes, set up in {time.perf_counter() - t0:.1f}s")
+
+        t0 = time.perf_counter()
+        batches = digest.run_once(now, args.batch_size, args.senders, args.rate)
+        elapsed = time.perf_counter() - t0
+        print(f"\n{'batch':>5} {'users':>6} {'sent':>6} {'empty':>6} {'failed':>6} "
+              f"{'query ms':>9} {'render ms':>9} {'send s':>7} {'msg/s':>7}")
+        for number, b in enumerate(batches, 1):
+            rate = b['sent'] / b['send_s'] if b['send_s'] else 0
+            print(f"{number:>5} {b['claimed']:>6} {b['sent']:>6} {b['empty']:>6} {b['failed']:>6} "
+                  f"{b['query_s'] * 1000:>9.1f} {b['render_s'] * 1000:>9.1f} {b['send_s']:>7.2f} {rate:>7.0f}")
+        sent = sum(b['sent'] for b in batches)
+        print(f"\ntotal: {sent} emails, {sum(b['notes'] for b in batches)} notes in {elapsed:.2f}s "
+              f"({sent / elapsed:.0f} msg/s, {args.users / elapsed:.0f} users/s), "
+              f"{sink.connections} SMTP connection(s)")
+
+        recipients = [rcpt for _, rcpts, _ in sink.messages for rcpt in rcpts]
+        bodies = [email.message_from_bytes(data).get_payload(decode=True).decode('utf-8')
+                  for _, _, data in sink.messages]
+        resent_old = sum('OLD ' in body for body in bodies)
+        again = digest.run_once(now, args.batch_size, args.senders, args.rate)
+        database.close_connections()
+
+    print(f"one email per active user: {sorted(recipients) == sorted(set(recipients)) and len(recipients) == len(active)}")
+    print(f"emails containing notes from before the cursor: {resent_old}")
+    print(f"emails sent by a second run: {sum(b['sent'] for b in again)}")
+
+
+if __name__ == '__main__':
+    main()
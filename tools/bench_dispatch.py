@@ -0,0 +1,102 @@
+"""Request dispatch overhead: linear can_handle scan vs. the routing table.
+
+Usage: python -m tools.bench_dispatch [--iterations 100000]
+
+For a few requests at the front, middle and back of the old handler order,
+times how long it takes to pick the handler: once with the SDK's
+GenericRequestMapper over predicate handlers registered in the order main.py
+used to register them (each can_handle building fresh is_intent_name /
+is_request_type closures), once with main.routes. For scale, it also times a
+whole skill.invoke of AMAZON.HelpIntent, which does no I/O.
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from ask_sdk_core.dispatch_components import AbstractRequestHandler
+from ask_sdk_core.handler_input import HandlerInput
+from ask_sdk_core.serialize import DefaultSerializer
+from ask_sdk_core.utils import is_intent_name, is_request_type
+from ask_sdk_model import RequestEnvelope
+from ask_sdk_runtime.dispatch_components.request_components import GenericRequestHandlerChain, GenericRequestMapper
+
+from tools.loadtest import _intent, build_envelope
+
+# Handler predicates in the order they were registered before the routing table.
+LINEAR_ORDER = [
+    ("LaunchRequest", None), ("IntentRequest", "StartWritingIntent"), ("IntentRequest", "CaptureNoteIntent"),
+    ("IntentRequest", "FinishIntent"), ("IntentRequest", "ReadNotesIntent"), ("IntentRequest", "AMAZON.NextIntent"),
+    ("IntentRequest", "AMAZON.PreviousIntent"), ("IntentRequest", "SearchNotesIntent"),
+    ("IntentRequest", "SendEmailIntent"), ("IntentRequest", "SetRetentionIntent"), ("IntentRequest", "CloseIntent"),
+    ("IntentRequest", "AMAZON.HelpIntent"), ("IntentRequest", "AMAZON.CancelIntent"),
+    ("SessionEndedRequest", None),
+]
+REQUESTS = [
+    ("LaunchRequest", {"type": "LaunchRequest"}, {}),
+    ("CaptureNoteIntent", {"type": "IntentRequest", "intent": _intent("CaptureNoteIntent", note="latte")},
+     {"state": "WRITING"}),
+    ("SendEmailIntent", {"type": "IntentRequest", "intent": _intent("SendEmailIntent")}, {"state": "MENU"}),
+    ("AMAZON.HelpIntent", {"type": "IntentRequest", "intent": _intent("AMAZON.HelpIntent")}, {}),
+    ("SessionEndedRequest", {"type": "SessionEndedRequest", "reason": "USER_INITIATED"}, {}),
+]
+
+
+class PredicateHandler(AbstractRequestHandler):
+    """can_handle as the handlers used to write it; never handles anything here."""
+
+    def __init__(self, request_type, intent):
+        self.request_type = request_type
+        self.intent = intent
+
+    def can_handle(self, handler_input):
+        if self.intent is None:
+            return is_request_type(self.request_type)(handler_input)
+        return is_intent_name(self.intent)(handler_input)
+
+    def handle(self, handler_input):
+        raise NotImplementedError
+
+
+def _envelope(request, attributes):
+    session = {"id": "amzn1.echo-api.session.bench", "user_id": "amzn1.ask.account.BENCH",
+               "attributes": attributes, "new": False}
+    return DefaultSerializer().deserialize(json.dumps(build_envelope(session, request)), RequestEnvelope)
+
+
+def _per_call_us(func, arg, iterations):
+    t0 = time.perf_counter()
+    for _ in range(iterations):
+        func(arg)
+    return (time.perf_counter() - t0) / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=100000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ.update(DB_NAME=os.path.join(tmp, 'bench.db'), VERIFY_SIGNATURE='false',
+                          RETENTION_SWEEP_INTERVAL='0', METRICS_ENABLED='false')
+        import main as skill_main  # imported late: the environment must be set up first
+
+        linear = GenericRequestMapper([GenericRequestHandlerChain(PredicateHandler(request_type, intent))
+                                       for request_type, intent in LINEAR_ORDER])
+        print(f"{'request':<22} {'linear us':>10} {'table us':>9} {'speedup':>8}")
+        for label, request, attributes in REQUESTS:
+            handler_input = HandlerInput(request_envelope=_envelope(request, attributes))
+            assert skill_main.routes.get_request_handler_chain(handler_input) is not None, label
+            linear_us = _per_call_us(linear.get_request_handler_chain, handler_input, args.iterations)
+            table_us = _per_call_us(skill_main.routes.get_request_handler_chain, handler_input, args.iterations)
+            print(f"{label:<22} {linear_us:>10.3f} {table_us:>9.3f} {linear_us / table_us:>7.1f}x")
+
+        help_request = _envelope(REQUESTS[3][1], {})
+        invoke_us = _per_call_us(lambda envelope: skill_main.skill.invoke(request_envelope=envelope, context=None),
+                                 help_request, max(1, args.iterations // 10))
+        print(f"full skill.invoke of AMAZON.HelpIntent: {invoke_us:.1f} us")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""Peak memory of the old get_all_notes export against the streaming export.
+
+Usage: python -m tools.bench_export [--notes 50000] [--max-bytes 1048576] [--format inline]
+
+The legacy path fetches every row, builds a list of lines and one MIMEText;
+the streaming path (export.iter_export_messages) holds one part at a time.
+Each message is serialized, as it would be on the wire, and then dropped.
+"""
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+from email.mime.text import MIMEText
+
+import database
+import export
+import rendering
+
+
+def _legacy(user_id):
+    notes_data = database.get_all_notes(user_id)
+    notes_text = rendering.render_email_body(notes_data)
+    msg = MIMEText(f"{export.MSG_EMAIL_BODY_PREFIX}{notes_text}")
+    return [len(msg.as_bytes())]
+
+
+def _streaming(user_id, export_format, max_bytes):
+    return [len(msg.as_bytes()) for msg in export.iter_export_messages(user_id, "user@example.com", export_format, max_bytes)]
+
+
+def _measure(fn, *args):
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    sizes = fn(*args)
+    elapsed = time.perf_counter() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak, elapsed, sizes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--notes', type=int, default=50000)
+    parser.add_argument('--note-size', type=int, default=200, help='characters per note')
+    parser.add_argument('--max-bytes', type=int, default=1024 * 1024)
+    parser.add_argument('--format', default='inline', choices=('inline', 'txt', 'csv'))
+    args = parser.parse_args()
+
+    user_id = "amzn1.ask.account.BENCH"
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_NAME = os.path.join(tmp, 'bench.db')
+        database.init_db()
+        now = int(time.time())
+        body = ("appuntamento dal dentista " * (args.note_size // 26 + 1))[:args.note_size]
+        database.save_notes_batch([(f"{i} {body}", user_id, now - i * 30) for i in range(args.notes)])
+
+        for label, fn, fn_args in (("get_all_notes + one MIMEText", _legacy, (user_id,)),
+                                   (f"streaming ({args.format})", _streaming, (user_id, args.format, args.max_bytes))):
+            peak, elapsed, sizes = _measure(fn, *fn_args)
+            print(f"{label:<30} peak {peak / 1048576:7.1f} MiB  {elapsed:6.2f} s  "
+                  f"{len(sizes)} message(s), {sum(sizes) / 1048576:.1f} MiB total")
+        database.close_connections()
+
+
+if __name__ == '__main__':
+    main()
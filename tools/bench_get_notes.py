@@ -0,0 +1,88 @@
+"""Benchmark get_notes latency as the shared notes table grows.
+
+Usage: python -m tools.bench_get_notes [--sizes 10000,100000,1000000] [--users 1000]
+
+Builds a throwaway database, grows it to each size and times get_notes for
+random users. With idx_notes_user_ts in place the per-call latency should stay
+flat; pass --no-index to see the full-scan behaviour the index replaces
+(dropped from every monthly partition).
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+
+import database
+
+
+def _grow(users, target, start_ts):
+    current = database.count_notes()
+    batch = []
+    for i in range(current, target):
+        batch.append((f"nota numero {i}", random.choice(users), start_ts + i))
+        if len(batch) >= 50000:
+            database.save_notes_batch(batch)
+            batch = []
+    if batch:
+        database.save_notes_batch(batch)
+
+
+def _drop_indexes(conn):
+    for name in database._list_partitions(conn):
+        conn.execute(f'DROP INDEX IF EXISTS idx_{name}_user_ts')
+
+
+def _time_calls(users, calls):
+    samples = []
+    for _ in range(calls):
+        user_id = random.choice(users)
+        t0 = time.perf_counter()
+        database.get_notes(user_id)
+        samples.append((time.perf_counter() - t0) * 1000)
+    samples.sort()
+    return statistics.mean(samples), samples[int(len(samples) * 0.95) - 1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='10000,100000,1000000')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--calls', type=int, default=500)
+    parser.add_argument('--no-index', action='store_true', help='drop idx_notes_user_ts before measuring')
+    args = parser.parse_args()
+
+    sizes = [int(s) for s in args.sizes.split(',')]
+    users = [f"amzn1.ask.account.BENCH{i:06d}" for i in range(args.users)]
+    random.seed(42)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_NAME = os.path.join(tmp, 'bench.db')
+        database.init_db()
+        conn = database.get_connection()
+        # Partitions created while growing start without the index as well.
+        no_index = args.no_index
+        if no_index:
+            _drop_indexes(conn)
+
+        plan = conn.execute(
+            'EXPLAIN QUERY PLAN SELECT content, timestamp FROM notes WHERE user_key = ? '
+            'ORDER BY timestamp DESC, id DESC LIMIT ?', (1, 5)).fetchall()
+        print("plan:", "; ".join(row[-1] for row in plan if row[-1].startswith(("SEARCH", "SCAN"))))
+        print(f"{'rows':>10} {'mean ms':>10} {'p95 ms':>10}")
+
+        start_ts = int(time.time()) - max(sizes)
+        for size in sizes:
+            _grow(users, size, start_ts)
+            if no_index:
+                _drop_indexes(conn)
+            conn.execute('ANALYZE')
+            mean, p95 = _time_calls(users, args.calls)
+            print(f"{size:>10} {mean:>10.3f} {p95:>10.3f}")
+
+        database.close_connections()
+
+
+if __name__ == '__main__':
+    main()
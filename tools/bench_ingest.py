@@ -0,0 +1,66 @@
+"""Write throughput of one commit per note against group commit (ingest.py).
+
+Usage: python -m tools.bench_ingest [--threads 32] [--notes 200]
+
+Each thread stands in for a request saving notes back to back. The baseline
+is database.save_note (one transaction per note); it is measured with
+synchronous=NORMAL (the pool default) and FULL (same durability as group
+commit).
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+import database
+import ingest
+
+
+def _run(threads, notes, save):
+    def worker(n):
+        for i in range(notes):
+            save(f"nota {n}-{i}", f"amzn1.ask.account.BENCH{n:04d}")
+
+    pool = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    t0 = time.perf_counter()
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    return threads * notes / (time.perf_counter() - t0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--notes', type=int, default=200, help='notes per thread')
+    parser.add_argument('--dir', default=None, help='directory for the database (use a real disk, not tmpfs)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        database.DB_NAME = os.path.join(tmp, 'bench.db')
+        database.init_db()
+
+        for sync in ("NORMAL", "FULL"):
+            tuned = threading.local()
+
+            def save(text, user_id, sync=sync, tuned=tuned):
+                if not getattr(tuned, "done", False):
+                    database.get_connection().execute(f"PRAGMA synchronous={sync}")
+                    tuned.done = True
+                database.save_note(text, user_id)
+
+            rate = _run(args.threads, args.notes, save)
+            print(f"commit per note (synchronous={sync}):".ljust(42) + f"{rate:10.0f} notes/s")
+            database.close_connections()
+
+        rate = _run(args.threads, args.notes, ingest._writer.save_note)
+        print("group commit (synchronous=FULL):".ljust(42) + f"{rate:10.0f} notes/s")
+
+        count = database.get_connection().execute('SELECT COUNT(*) FROM notes').fetchone()[0]
+        print(f"rows written: {count}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""Profile email lookups: SDK DefaultApiClient vs. keep-alive client vs. cached (alexa_api.py).
+
+Usage: python -m tools.bench_profile_email [--calls 200] [--delay 0.02]
+
+Runs against the local HTTPS stub in tools.alexa_api_stub; --delay adds
+server-side latency to mimic the real API. Also checks that a 403 from the
+API drops the cached address.
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from ask_sdk_core.api_client import DefaultApiClient
+from ask_sdk_core.serialize import DefaultSerializer
+from ask_sdk_model.services import ApiConfiguration, ServiceClientFactory
+
+import alexa_api
+import database
+from tools.alexa_api_stub import AlexaApiStub
+
+
+class _Namespace:
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+
+def handler_input_for(user_id, api_client, endpoint):
+    """The parts of a HandlerInput that alexa_api.get_profile_email uses."""
+    config = ApiConfiguration(serializer=DefaultSerializer(), api_client=api_client,
+                              authorization_value="bench-token", api_endpoint=endpoint)
+    session = _Namespace(user=_Namespace(user_id=user_id))
+    context = _Namespace(system=_Namespace(user=_Namespace(permissions=_Namespace(consent_token="bench-consent"))))
+    return _Namespace(request_envelope=_Namespace(session=session, context=context),
+                      service_client_factory=ServiceClientFactory(config))
+
+
+def _run(stub, calls, lookup):
+    stub.calls = stub.connections = 0
+    t0 = time.perf_counter()
+    for _ in range(calls):
+        lookup()
+    elapsed = time.perf_counter() - t0
+    return elapsed / calls * 1000, stub.calls, stub.connections
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--calls', type=int, default=200)
+    parser.add_argument('--delay', type=float, default=0.02, help='seconds of API latency per call')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp, AlexaApiStub(delay=args.delay) as stub:
+        database.DB_NAME = os.path.join(tmp, 'bench.db')
+        database.init_db()
+        os.environ["REQUESTS_CA_BUNDLE"] = stub.cert_path
+        user_id = "amzn1.ask.account.BENCH"
+
+        sdk = handler_input_for(user_id, DefaultApiClient(), stub.endpoint)
+        pooled = handler_input_for(user_id, alexa_api.KeepAliveApiClient(), stub.endpoint)
+        results = [
+            ("SDK client, no cache", _run(stub, args.calls, lambda: sdk.service_client_factory.get_ups_service().get_profile_email())),
+            ("keep-alive, no cache", _run(stub, args.calls, lambda: pooled.service_client_factory.get_ups_service().get_profile_email())),
+            ("keep-alive + cache", _run(stub, args.calls, lambda: alexa_api.get_profile_email(pooled))),
+        ]
+        for label, (ms, api_calls, connections) in results:
+            print(f"{label:<22} {ms:8.3f} ms/lookup  api calls={api_calls:<5} connections={connections}")
+
+        # An expired entry sends the next lookup to the API; a 403 there must drop the entry.
+        conn = database.get_connection()
+        with conn:
+            conn.execute('UPDATE profile_emails SET fetched_at = 0')
+        stub.status = 403
+        try:
+            alexa_api.get_profile_email(pooled)
+        except Exception as e:
+            remaining = conn.execute('SELECT COUNT(*) FROM profile_emails').fetchone()[0]
+            print(f"403 from API -> {type(e).__name__} raised, cached rows left: {remaining}")
+        print("cache stats:", alexa_api.stats())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+"""Compare the old per-row strptime/strftime loop with rendering.render_email_body.
+
+Usage: python -m tools.bench_rendering [--notes 20000]
+"""
+import argparse
+import time
+from datetime import datetime
+
+import rendering
+
+
+def _legacy(rows, date_format):
+    formatted_notes = []
+    for i, (content, timestamp) in enumerate(rows, 1):
+        try:
+            dt = datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S")
+            formatted_date = dt.strftime(date_format)
+        except Exception:
+            formatted_date = timestamp
+        formatted_notes.append(f"{i}. [{formatted_date}] {content}")
+    return "\n".join(formatted_notes)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--notes', type=int, default=20000)
+    args = parser.parse_args()
+
+    now = int(time.time())
+    # Heavy dictation: a few notes per minute over several days.
+    epochs = [now - i * 20 for i in range(args.notes)]
+    rows = [(f"nota numero {i}", ts) for i, ts in enumerate(epochs)]
+    legacy_rows = [(c, time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(ts))) for c, ts in rows]
+
+    t0 = time.perf_counter()
+    old = _legacy(legacy_rows, rendering.DATE_FORMAT)
+    legacy_s = time.perf_counter() - t0
+
+    rendering._format_bucket.cache_clear()
+    t0 = time.perf_counter()
+    new = rendering.render_email_body(rows)
+    new_s = time.perf_counter() - t0
+
+    assert old == new, "renderers disagree"
+    print(f"strptime loop:  {legacy_s * 1000:8.1f} ms for {args.notes} notes")
+    print(f"rendering:      {new_s * 1000:8.1f} ms ({legacy_s / new_s:.1f}x)")
+
+
+if __name__ == '__main__':
+    main()
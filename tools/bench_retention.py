@@ -0,0 +1,124 @@
+"""Expire old notes: batched DELETE on one table vs. dropping monthly partitions.
+
+Usage: python -m tools.bench_retention [--notes 500000] [--months 24] [--keep-months 12]
+
+Spreads --notes notes evenly over the last --months months, then deletes
+everything older than --keep-months twice. The first run uses a single
+notes table laid out like schema version 8 (index plus FTS triggers), with
+1000-row DELETE transactions as the sweeper used to. The second run uses
+database.delete_notes_before on the partitioned schema. Reports the total
+time, the longest single write transaction (how long other writers could
+be blocked), and the file size before and after reclaiming free pages.
+"""
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+import database
+
+BATCH = 1000
+WORDS = "comprare latte pane chiamare mario domani riunione ufficio pagare bolletta dentista".split()
+
+
+def _notes(count, months, rng):
+    now = int(time.time())
+    span = months * 30 * 86400
+    for i in range(count):
+        text = " ".join(rng.choice(WORDS) for _ in range(rng.randint(4, 16)))
+        yield text, f"amzn1.ask.account.BENCH{rng.randrange(2000):06d}", now - span + i * span // count
+
+
+def _size(path):
+    return sum(os.path.getsize(path + suffix) for suffix in ("", "-wal") if os.path.exists(path + suffix))
+
+
+def _checkpoint(conn):
+    conn.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchall()
+
+
+def single_table(path, notes, cutoff):
+    conn = sqlite3.connect(path)
+    conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('CREATE TABLE notes (id INTEGER PRIMARY KEY AUTOINCREMENT, content TEXT NOT NULL, '
+                 'timestamp INTEGER NOT NULL, user_id TEXT)')
+    conn.execute('CREATE INDEX idx_notes_user_ts ON notes (user_id, timestamp DESC, id DESC)')
+    database._create_partition_v9(conn, "notes_000001")  # only for its FTS table and trigger SQL
+    conn.execute('DROP TABLE notes_000001')
+    for statement in conn.execute("SELECT sql FROM sqlite_master WHERE type = 'trigger'").fetchall():
+        conn.execute(statement[0].replace("ON notes_000001", "ON notes"))
+    with conn:
+        conn.executemany('INSERT INTO notes (content, user_id, timestamp) VALUES (?, ?, ?)', notes)
+    _checkpoint(conn)
+    size_before = _size(path)
+
+    deleted, longest, t0 = 0, 0.0, time.perf_counter()
+    while True:
+        t1 = time.perf_counter()
+        with conn:
+            cur = conn.execute('DELETE FROM notes WHERE id IN (SELECT id FROM notes WHERE timestamp < ? LIMIT ?)',
+                               (cutoff, BATCH))
+        longest = max(longest, time.perf_counter() - t1)
+        deleted += cur.rowcount
+        if cur.rowcount < BATCH:
+            break
+    elapsed = time.perf_counter() - t0
+    _checkpoint(conn)
+    size_after = _size(path)
+    conn.executescript('PRAGMA incremental_vacuum')
+    _checkpoint(conn)
+    conn.close()
+    return deleted, elapsed, longest, size_before, size_after, _size(path)
+
+
+def partitioned(path, notes, cutoff):
+    database.DB_NAME = path
+    database.init_db()
+    database.save_notes_batch(list(notes))
+    conn = database.get_connection()
+    _checkpoint(conn)
+    size_before = _size(path)
+
+    # Step the cutoff one month boundary at a time so each call is a single drop transaction.
+    bounds = [database._partition_bounds(name)[1] for name in database._list_partitions(conn)]
+    deleted, longest, t0 = 0, 0.0, time.perf_counter()
+    for step in [end for end in bounds if end < cutoff] + [cutoff]:
+        while True:
+            t1 = time.perf_counter()
+            batch = database.delete_notes_before(step, BATCH)
+            longest = max(longest, time.perf_counter() - t1)
+            deleted += batch
+            if batch < BATCH:
+                break
+    elapsed = time.perf_counter() - t0
+    _checkpoint(conn)
+    size_after = _size(path)
+    database.reclaim_space(1 << 30)
+    _checkpoint(conn)
+    database.close_connections()
+    return deleted, elapsed, longest, size_before, size_after, _size(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--notes', type=int, default=500000)
+    parser.add_argument('--months', type=int, default=24)
+    parser.add_argument('--keep-months', type=int, default=12)
+    args = parser.parse_args()
+
+    cutoff = database.retention_cutoff(args.keep_months * 30)
+    print(f"{'layout':<22} {'deleted':>8} {'total s':>8} {'longest tx ms':>14} "
+          f"{'MiB before':>11} {'after':>8} {'reclaimed':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for label, run in (("single table, DELETE", single_table), ("monthly partitions", partitioned)):
+            notes = _notes(args.notes, args.months, random.Random(42))
+            deleted, elapsed, longest, before, after, reclaimed = run(os.path.join(tmp, f"{run.__name__}.db"), notes, cutoff)
+            print(f"{label:<22} {deleted:>8} {elapsed:>8.2f} {longest * 1000:>14.1f} "
+                  f"{before / 1048576:>11.1f} {after / 1048576:>8.1f} {reclaimed / 1048576:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""Compare search_notes (FTS5, BM25) with a naive LIKE scan of the user's notes.
+
+Usage: python -m tools.bench_search [--notes 200000] [--heavy-notes 50000] [--users 500]
+
+Builds a throwaway database where one "heavy" user owns --heavy-notes of the
+notes and the rest are spread over --users other users, then times searches
+for words of varying frequency in the heavy user's history. Note words follow
+a Zipf distribution over a few thousand words, so the first ones are very
+common. LIKE stops early when the newest notes match and scans the whole
+history when few or none do ("zanzara" never occurs).
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+
+import database
+
+WORDS = ("comprare latte pane uova chiamare mario giulia domani lunedi riunione ufficio alle dieci "
+         "ricordarsi pagare bolletta luce gas prenotare volo treno libro regalo compleanno mamma "
+         "medico farmacia palestra scadenza assicurazione auto meccanico").split()
+VOCABULARY = WORDS + [f"parola{i}" for i in range(3000)]
+# Zipf weights: the i-th word is 1/i as frequent as the first.
+CUM_WEIGHTS = []
+for _rank in range(1, len(VOCABULARY) + 1):
+    CUM_WEIGHTS.append((CUM_WEIGHTS[-1] if CUM_WEIGHTS else 0) + 1 / _rank)
+RARE = "dentista"
+
+QUERIES = ("comprare", "pagare bolletta", "meccanico", "dentista", "dent", "zanzara")
+
+
+def _seed(heavy_user, users, heavy_notes, total, rng):
+    start_ts = int(time.time()) - total
+    batch = []
+    for i in range(total):
+        user_id = heavy_user if i < heavy_notes else rng.choice(users)
+        words = rng.choices(VOCABULARY, cum_weights=CUM_WEIGHTS, k=rng.randint(4, 16))
+        if rng.random() < 0.001:
+            words.insert(rng.randrange(len(words)), RARE)
+        batch.append((" ".join(words), user_id, start_ts + i))
+        if len(batch) >= 50000:
+            database.save_notes_batch(batch)
+            batch = []
+    if batch:
+        database.save_notes_batch(batch)
+
+
+def like_search(user_id, query, limit):
+    """The naive alternative: scan all of the user's notes with LIKE, newest first."""
+    words = query.split()
+    where = " AND ".join("note_text(content) LIKE ?" for _ in words)
+    conn = database.get_connection()
+    return conn.execute(
+        f'SELECT note_text(content), timestamp, notes.id FROM notes JOIN users ON users.id = notes.user_key '
+        f'WHERE users.user_id = ? AND {where} ORDER BY timestamp DESC LIMIT ?',
+        (user_id, *[f"%{w}%" for w in words], limit)).fetchall()
+
+
+def _time(func, user_id, query, calls):
+    samples = []
+    for _ in range(calls):
+        t0 = time.perf_counter()
+        rows = func(user_id, query, 5)
+        samples.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(samples), len(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--notes', type=int, default=200000, help='total notes')
+    parser.add_argument('--heavy-notes', type=int, default=50000, help="notes owned by the searched user")
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--calls', type=int, default=20)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    heavy_user = "amzn1.ask.account.HEAVY"
+    users = [f"amzn1.ask.account.BENCH{i:06d}" for i in range(args.users)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_NAME = os.path.join(tmp, 'bench.db')
+        database.init_db()
+        t0 = time.perf_counter()
+        _seed(heavy_user, users, args.heavy_notes, args.notes, rng)
+        print(f"seeded {args.notes} notes (FTS kept in sync by triggers) in {time.perf_counter() - t0:.1f}s")
+
+        print(f"{'query':<18} {'FTS ms':>8} {'LIKE ms':>9} {'hits':>5}")
+        for query in QUERIES:
+            fts_ms, hits = _time(database.search_notes, heavy_user, query, args.calls)
+            like_ms, _ = _time(like_search, heavy_user, query, args.calls)
+            print(f"{query:<18} {fts_ms:>8.2f} {like_ms:>9.2f} {hits:>5}")
+
+        database.close_connections()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+"""Compare one SMTP session per email against the pooled transport in mailer.py.
+
+Usage: python -m tools.bench_smtp [--messages 500] [--delay 0.002]
+
+Runs against a local SMTP sink; --delay adds per-command latency to mimic a
+remote relay, which is where the saved handshakes show up.
+"""
+import argparse
+import os
+import smtplib
+import time
+
+import mailer
+from tools.smtp_sink import SmtpSink
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=500)
+    parser.add_argument('--batch', type=int, default=20, help='messages per pooled session')
+    parser.add_argument('--delay', type=float, default=0.002, help='seconds of latency per SMTP command')
+    args = parser.parse_args()
+
+    with SmtpSink(keep_messages=False, delay=args.delay) as sink:
+        os.environ.update(SMTP_SERVER=sink.host, SMTP_PORT=str(sink.port), SMTP_ENCRYPTION='NONE')
+        mailer.reset()
+        messages = [mailer.build_message(f"user{i}@example.com", "Le tue note Alexa", f"nota {i}") for i in range(args.messages)]
+
+        t0 = time.perf_counter()
+        for msg in messages:
+            with smtplib.SMTP(sink.host, sink.port) as server:
+                server.send_message(msg)
+        per_message = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        for i in range(0, len(messages), args.batch):
+            mailer.send_messages(messages[i:i + args.batch])
+        pooled = time.perf_counter() - t0
+
+        print(f"new session per email: {args.messages / per_message:8.1f} msg/s")
+        print(f"pooled, batch={args.batch}:".ljust(23) + f"{args.messages / pooled:8.1f} msg/s")
+        print("pool metrics:", mailer.metrics())
+        mailer.reset()
+
+
+if __name__ == '__main__':
+    main()
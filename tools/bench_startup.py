@@ -0,0 +1,152 @@
+"""Cold start of the skill: import time of main.py and memory per gunicorn worker.
+
+Usage: python -m tools.bench_startup [--runs 5] [--workers 4] [--no-gunicorn]
+
+1. Imports main.py --runs times in fresh interpreters under
+   `python -X importtime` and reports the median total, the slowest modules
+   main.py pulls in directly, whether the rarely needed modules (Flask,
+   smtplib, email.mime, the UPS client) were loaded, and the RSS afterwards.
+2. Starts gunicorn with gunicorn.conf.py twice, with and without preload,
+   and reports the time until the first request is answered plus RSS and
+   PSS per worker (PSS splits pages shared with the master between the
+   processes that share them, so it shows what preloading saves).
+
+Every run uses a temporary database and VERIFY_SIGNATURE=false, so no
+network access is needed.
+"""
+import argparse
+import os
+import re
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LAZY_MODULES = ["flask", "smtplib", "email.mime.text", "ask_sdk_model.services.ups"]
+PROBE = (
+    "import resource, sys, main; "
+    f"print(*[name in sys.modules for name in {LAZY_MODULES!r}]); "
+    "print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)"
+)
+
+
+def _env(tmp, **extra):
+    env = dict(os.environ, DB_NAME=os.path.join(tmp, "startup.db"), VERIFY_SIGNATURE="false",
+               RETENTION_SWEEP_INTERVAL="0", START_BACKGROUND_TASKS="false")
+    env.update(extra)
+    return env
+
+
+def _parse_importtime(stderr):
+    """(total microseconds for main, [(cumulative us, module)] imported directly by main)."""
+    entries = []
+    for line in stderr.splitlines():
+        match = re.match(r"import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)", line)
+        if match:
+            entries.append((int(match.group(2)), len(match.group(3)) // 2, match.group(4)))
+    total = next(cumulative for cumulative, depth, name in entries if name == "main" and depth == 0)
+    # importtime lists children before their parent, one indent level deeper.
+    return total, [(cumulative, name) for cumulative, depth, name in entries if depth == 1]
+
+
+def import_runs(tmp, runs):
+    totals, children, probe = [], {}, None
+    for _ in range(runs):
+        result = subprocess.run([sys.executable, "-X", "importtime", "-c", PROBE], cwd=ROOT, env=_env(tmp),
+                                capture_output=True, text=True, check=True)
+        total, direct = _parse_importtime(result.stderr)
+        totals.append(total)
+        for cumulative, name in direct:
+            children.setdefault(name, []).append(cumulative)
+        probe = result.stdout.split("\n")
+    loaded = probe[-3].split()
+    print(f"import main: median {statistics.median(totals) / 1000:.1f} ms over {runs} run(s), "
+          f"RSS after import {int(probe[-2]) / 1024:.1f} MiB")
+    print("slowest direct imports (median cumulative ms):")
+    slowest = sorted(((statistics.median(times), name) for name, times in children.items()), reverse=True)[:8]
+    for cumulative, name in slowest:
+        print(f"  {cumulative / 1000:8.1f}  {name}")
+    print("loaded at import: " + ", ".join(f"{name}={flag}" for name, flag in zip(LAZY_MODULES, loaded)))
+
+
+def _memory_kib(pid):
+    """(RSS, PSS) in KiB from /proc/<pid>/smaps_rollup."""
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if parts[0] in ("Rss:", "Pss:"):
+                values[parts[0]] = int(parts[1])
+    return values["Rss:"], values["Pss:"]
+
+
+def _children(pid):
+    with open(f"/proc/{pid}/task/{pid}/children") as f:
+        return [int(child) for child in f.read().split()]
+
+
+def gunicorn_run(tmp, workers, preload, port):
+    env = _env(tmp, GUNICORN_BIND=f"127.0.0.1:{port}", GUNICORN_WORKERS=str(workers),
+               GUNICORN_PRELOAD="true" if preload else "false")
+    t0 = time.perf_counter()
+    master = subprocess.Popen([sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py"], cwd=ROOT, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        # GET / is answered 405 by a worker once one is up.
+        while True:
+            try:
+                urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=1)
+            except urllib.error.HTTPError:
+                break
+            except OSError:
+                if master.poll() is not None:
+                    raise RuntimeError("gunicorn exited during startup")
+                time.sleep(0.01)
+        first_response = time.perf_counter() - t0
+        # Let every worker finish booting before measuring it.
+        deadline = time.time() + 30
+        while len(_children(master.pid)) < workers and time.time() < deadline:
+            time.sleep(0.05)
+        for _ in range(workers * 4):
+            try:
+                urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=5)
+            except urllib.error.HTTPError:
+                pass
+        memory = [_memory_kib(pid) for pid in _children(master.pid)]
+        master_rss, master_pss = _memory_kib(master.pid)
+    finally:
+        master.send_signal(signal.SIGTERM)
+        master.wait(30)
+    rss = statistics.mean(m[0] for m in memory) / 1024
+    pss = statistics.mean(m[1] for m in memory) / 1024
+    total_pss = (sum(m[1] for m in memory) + master_pss) / 1024
+    print(f"{'preload' if preload else 'no preload':<11} {first_response * 1000:>12.0f} {rss:>12.1f} {pss:>12.1f} "
+          f"{master_rss / 1024:>11.1f} {total_pss:>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--port', type=int, default=5099)
+    parser.add_argument('--no-gunicorn', action='store_true', help='only measure the import')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        import_runs(tmp, args.runs)
+        if args.no_gunicorn:
+            return
+        print(f"\ngunicorn, {args.workers} workers:")
+        print(f"{'mode':<11} {'first req ms':>12} {'worker RSS':>12} {'worker PSS':>12} {'master RSS':>11} "
+              f"{'total PSS':>10}  (MiB)")
+        for preload in (False, True):
+            gunicorn_run(tmp, args.workers, preload, args.port)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+"""Size and read latency of the notes storage before and after migration 10.
+
+Usage: python -m tools.bench_storage [--notes 200000] [--users 200] [--long-share 0.2]
+
+Builds a schema 9 database (user ids repeated on every row, bodies as plain
+TEXT) with Alexa-length user ids, where --long-share of the notes are long
+dictated lists and the rest a few words. It reports the file size and the
+pages used by note rows, their index, the full-text index and the users
+table, and times a first page of notes, a full export and a search for
+random users. Then it runs migration 10 (users surrogate keys, compressed
+long bodies), VACUUMs both files the same way and measures again. The
+schema 9 reads use the queries the schema 9 backend ran.
+"""
+import argparse
+import os
+import random
+import statistics
+import string
+import tempfile
+import time
+
+import database
+
+WORDS = ("comprare latte pane uova chiamare mario giulia domani lunedi riunione ufficio alle dieci "
+         "ricordarsi pagare bolletta luce gas prenotare volo treno libro regalo compleanno mamma "
+         "medico farmacia palestra scadenza assicurazione auto meccanico di il la per con e "
+         "dentista portare ritirare pacco posta banca cena sabato sera").split()
+PAGE = 5
+
+
+def _user_ids(count, rng):
+    # Real ids are "amzn1.ask.account." followed by about 200 characters.
+    return [f"amzn1.ask.account.{''.join(rng.choices(string.ascii_uppercase + string.digits, k=200))}"
+            for _ in range(count)]
+
+
+def _notes(count, user_ids, long_share, rng):
+    start_ts = int(time.time()) - count * 60
+    for i in range(count):
+        length = rng.randint(40, 120) if rng.random() < long_share else rng.randint(4, 16)
+        yield " ".join(rng.choices(WORDS, k=length)), rng.choice(user_ids), start_ts + i * 60
+
+
+def build_v9(notes):
+    """A database at schema 9, written the way the schema 9 backend wrote it."""
+    conn = database.get_connection()
+    conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+    with conn:
+        for number, migration in enumerate(database.MIGRATIONS[:9], 1):
+            migration(conn)
+            conn.execute(f'PRAGMA user_version = {number}')
+    by_partition = {}
+    for note_id, (text, user_id, timestamp) in enumerate(notes, 1):
+        by_partition.setdefault(database._partition_for(timestamp), []).append((note_id, text, user_id, timestamp))
+    with conn:
+        for name, rows in by_partition.items():
+            if name not in database._list_partitions(conn):
+                database._create_partition_v9(conn, name)
+            conn.executemany(f'INSERT INTO {name} (id, content, user_id, timestamp) VALUES (?, ?, ?, ?)', rows)
+        database._refresh_notes_view_v9(conn)
+        conn.execute('UPDATE note_id_seq SET next_id = ?', (sum(map(len, by_partition.values())) + 1,))
+
+
+def _v9_page(user_id):
+    return database.get_connection().execute(
+        'SELECT content, timestamp, id FROM notes WHERE user_id = ? ORDER BY timestamp DESC, id DESC LIMIT ?',
+        (user_id, PAGE)).fetchall()
+
+
+def _v9_export(user_id):
+    return database.get_connection().execute(
+        'SELECT content, timestamp FROM notes WHERE user_id = ? ORDER BY timestamp DESC, id DESC',
+        (user_id,)).fetchall()
+
+
+def _v9_search(user_id):
+    conn = database.get_connection()
+    match = f'owner : u{user_id.encode("utf-8").hex()} AND content : ("dentista")'
+    rows = []
+    for name in reversed(database._list_partitions(conn)):
+        fts = name.replace("notes_", "notes_fts_")
+        rows += conn.execute(f'''
+            SELECT {name}.content, {name}.timestamp, {name}.id
+            FROM (SELECT rowid FROM {fts} WHERE {fts} MATCH ? ORDER BY rowid DESC LIMIT ?) AS hits
+            JOIN {name} ON {name}.id = hits.rowid WHERE {name}.user_id = ?
+        ''', (match, database.SEARCH_CANDIDATES - len(rows), user_id)).fetchall()
+        if len(rows) >= database.SEARCH_CANDIDATES:
+            break
+    return rows
+
+
+READS_V9 = {"first page": _v9_page, "export": _v9_export, "search": _v9_search}
+READS_V10 = {
+    "first page": lambda user_id: database.backend.get_notes_page(user_id, None, PAGE),
+    "export": database.backend.get_all_notes,
+    "search": lambda user_id: database.backend.search_candidates(user_id, ["dentista"], False,
+                                                                 database.SEARCH_CANDIDATES),
+}
+
+
+def _compact(path):
+    conn = database.get_connection()
+    conn.execute('VACUUM')
+    conn.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchall()
+    sizes = {"notes": 0, "notes index": 0, "full-text": 0, "users": 0}
+    for name, size in conn.execute('SELECT name, SUM(pgsize) FROM dbstat GROUP BY name'):
+        if name.startswith("notes_fts_"):
+            sizes["full-text"] += size
+        elif name.startswith("idx_notes_"):
+            sizes["notes index"] += size
+        elif name.startswith("notes_"):
+            sizes["notes"] += size
+        elif name in ("users", "sqlite_autoindex_users_1"):
+            sizes["users"] += size
+    sizes["file"] = os.path.getsize(path)
+    return sizes
+
+
+def _latencies(reads, user_ids, calls):
+    result = {}
+    for label, read in reads.items():
+        samples = []
+        for user_id in user_ids[:calls]:
+            t0 = time.perf_counter()
+            read(user_id)
+            samples.append((time.perf_counter() - t0) * 1000)
+        samples.sort()
+        result[label] = (statistics.mean(samples), samples[int(len(samples) * 0.95) - 1])
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--notes', type=int, default=200000)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--long-share', type=float, default=0.2, help='share of notes of 40-120 words')
+    parser.add_argument('--calls', type=int, default=200)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    user_ids = _user_ids(args.users, rng)
+    sample = [rng.choice(user_ids) for _ in range(args.calls)]
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_NAME = os.path.join(tmp, 'bench.db')
+        build_v9(_notes(args.notes, user_ids, args.long_share, rng))
+        before = _compact(database.DB_NAME)
+        reads_before = _latencies(READS_V9, sample, args.calls)
+
+        t0 = time.perf_counter()
+        database.init_db()
+        migration_s = time.perf_counter() - t0
+        after = _compact(database.DB_NAME)
+        reads_after = _latencies(READS_V10, sample, args.calls)
+        compressed = database.get_connection().execute(
+            "SELECT COUNT(*) FROM notes WHERE typeof(content) = 'blob'").fetchone()[0]
+        database.close_connections()
+
+    print(f"{args.notes} notes, {args.users} users, {compressed} bodies compressed "
+          f"(>= {database.NOTE_COMPRESS_MIN_BYTES} bytes), migration took {migration_s:.1f}s")
+    print(f"{'bytes':<12} {'schema 9':>12} {'schema 10':>12} {'saved':>7}")
+    for label in ("notes", "notes index", "full-text", "users", "file"):
+        saved = f"{1 - after[label] / before[label]:.0%}" if before[label] else "-"
+        print(f"{label:<12} {before[label]:>12,} {after[label]:>12,} {saved:>7}")
+    print(f"\n{'read (ms)':<12} {'9 mean':>8} {'9 p95':>8} {'10 mean':>8} {'10 p95':>8}")
+    for label in READS_V9:
+        (mean9, p95_9), (mean10, p95_10) = reads_before[label], reads_after[label]
+        print(f"{label:<12} {mean9:>8.3f} {p95_9:>8.3f} {mean10:>8.3f} {p95_10:>8.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,165 @@
+"""Compare the SDK RequestVerifier with CachingRequestVerifier (verification.py).
+
+Usage: python -m tools.bench_verifier [--requests 500] [--fetch-ms 80]
+
+Uses a locally generated CA and signing certificate (SAN echo-api.amazon.com)
+and signs synthetic request bodies with it, so no network access is needed;
+--fetch-ms simulates the download of the chain from Amazon. Both verifiers
+trust the local CA in place of the system roots and otherwise run their
+normal code paths.
+"""
+import argparse
+import base64
+import datetime
+import json
+import tempfile
+import time
+
+from asn1crypto import pem
+from ask_sdk_webservice_support.verifier import RequestVerifier, VerificationException
+from certvalidator import CertificateValidator, ValidationContext
+from certvalidator.errors import PathError, ValidationError
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import padding, rsa
+from cryptography.x509.oid import NameOID
+
+from verification import CachingRequestVerifier
+
+CERT_URL = "https://s3.amazonaws.com/echo.api/echo-api-cert-bench.pem"
+
+
+def _name(common_name):
+    return x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, common_name)])
+
+
+def make_chain():
+    """Return (chain PEM with the signing cert first, CA cert DER, signing key)."""
+    now = datetime.datetime.now(datetime.timezone.utc)
+    ca_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    ca_cert = (
+        x509.CertificateBuilder()
+        .subject_name(_name("Bench Root CA")).issuer_name(_name("Bench Root CA"))
+        .public_key(ca_key.public_key()).serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(days=1)).not_valid_after(now + datetime.timedelta(days=30))
+        .add_extension(x509.BasicConstraints(ca=True, path_length=None), critical=True)
+        .add_extension(x509.KeyUsage(digital_signature=True, content_commitment=False, key_encipherment=False,
+                                     data_encipherment=False, key_agreement=False, key_cert_sign=True,
+                                     crl_sign=True, encipher_only=False, decipher_only=False), critical=True)
+        .sign(ca_key, hashes.SHA256())
+    )
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(_name("echo-api.amazon.com")).issuer_name(ca_cert.subject)
+        .public_key(key.public_key()).serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(days=1)).not_valid_after(now + datetime.timedelta(days=7))
+        .add_extension(x509.SubjectAlternativeName([x509.DNSName("echo-api.amazon.com")]), critical=False)
+        .add_extension(x509.KeyUsage(digital_signature=True, content_commitment=False, key_encipherment=True,
+                                     data_encipherment=False, key_agreement=False, key_cert_sign=False,
+                                     crl_sign=False, encipher_only=False, decipher_only=False), critical=True)
+        .sign(ca_key, hashes.SHA256())
+    )
+    chain = cert.public_bytes(serialization.Encoding.PEM) + ca_cert.public_bytes(serialization.Encoding.PEM)
+    return chain, ca_cert.public_bytes(serialization.Encoding.DER), key
+
+
+class LocalRootMixin:
+    """Validate chains against the bench CA instead of the system trust store."""
+
+    trust_root = None
+
+    def _validate_cert_chain(self, cert_chain):
+        try:
+            end_cert, intermediates = None, []
+            for _, _, der_bytes in pem.unarmor(cert_chain, multiple=True):
+                if end_cert is None:
+                    end_cert = der_bytes
+                else:
+                    intermediates.append(der_bytes)
+            context = ValidationContext(extra_trust_roots=[self.trust_root])
+            CertificateValidator(end_cert, intermediates, validation_context=context).validate_usage(
+                key_usage={'digital_signature'})
+        except (PathError, ValidationError) as e:
+            raise VerificationException("Certificate chain is not valid", e)
+
+
+class BaselineVerifier(LocalRootMixin, RequestVerifier):
+    fetch = None
+
+    def _load_cert_chain(self, cert_url):
+        # Same as the SDK: per-instance dict, filled by a download on first use.
+        if cert_url not in self._cert_cache:
+            self._cert_cache[cert_url] = self.fetch(cert_url)
+        return self._cert_cache[cert_url]
+
+
+class BenchCachingVerifier(LocalRootMixin, CachingRequestVerifier):
+    pass
+
+
+def signed_requests(key, count):
+    requests = []
+    for i in range(count):
+        body = json.dumps({"version": "1.0", "request": {"type": "IntentRequest", "requestId": f"req-{i}"}})
+        signature = key.sign(body.encode("utf-8"), padding.PKCS1v15(), hashes.SHA256())
+        headers = {"SignatureCertChainUrl": CERT_URL, "Signature-256": base64.b64encode(signature).decode("ascii")}
+        requests.append((headers, body))
+    return requests
+
+
+def _time(verifier, requests):
+    t0 = time.perf_counter()
+    for headers, body in requests:
+        verifier.verify(headers, body, None)
+    return time.perf_counter() - t0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--fetch-ms', type=float, default=80, help='simulated chain download time')
+    args = parser.parse_args()
+
+    chain, root_der, key = make_chain()
+    LocalRootMixin.trust_root = root_der
+    downloads = []
+
+    def fetch(cert_url):
+        downloads.append(cert_url)
+        time.sleep(args.fetch_ms / 1000)
+        return chain
+
+    requests = signed_requests(key, args.requests + 1)
+    first, rest = requests[:1], requests[1:]
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        baseline = BaselineVerifier()
+        baseline.fetch = fetch
+        cold_baseline = _time(baseline, first)
+        warm_baseline = _time(baseline, rest)
+
+        empty_disk = BenchCachingVerifier(cache_dir=cache_dir, fetch=fetch)
+        cold_caching = _time(empty_disk, first)
+        warm_caching = _time(empty_disk, rest)
+
+        # A second worker (or a restart) finds the chain on disk.
+        downloads.clear()
+        second_worker = BenchCachingVerifier(cache_dir=cache_dir, fetch=fetch)
+        t0 = time.perf_counter()
+        second_worker.prewarm()
+        prewarm = time.perf_counter() - t0
+        after_prewarm = _time(second_worker, first)
+        disk_downloads = len(downloads)
+
+    print(f"first request, SDK verifier:          {cold_baseline * 1000:8.2f} ms")
+    print(f"first request, caching, empty disk:   {cold_caching * 1000:8.2f} ms")
+    print(f"prewarm from disk cache:              {prewarm * 1000:8.2f} ms ({disk_downloads} download(s))")
+    print(f"first request after prewarm:          {after_prewarm * 1000:8.2f} ms")
+    print(f"warm, SDK verifier:                   {warm_baseline / args.requests * 1000:8.3f} ms/request")
+    print(f"warm, caching verifier:               {warm_caching / args.requests * 1000:8.3f} ms/request"
+          f"  ({warm_baseline / warm_caching:.1f}x)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,330 @@
+"""Replay synthetic Alexa sessions against the skill endpoint and report latency.
+
+Usage: python -m tools.loadtest [--db-sizes 0,10000,100000] [--concurrency 8]
+                                [--sessions 200] [--output loadtest.json]
+                                [--compare baseline.json]
+
+Each session is a realistic multi-turn conversation (Launch, StartWriting,
+a few CaptureNote, Finish, ReadNotes, AMAZON.NextIntent, SetRetention,
+SendEmail, SessionEnded) built from correctly shaped request envelopes, with
+session attributes carried from one response to the next request.
+
+By default the Flask app in main.py is imported and driven in-process through
+its test client, with VERIFY_SIGNATURE=false, a temporary database, a local
+SMTP sink behind the outbox and a stand-in for the Alexa profile API that
+SendEmail asks for the user's address. With --url the requests go over HTTP
+to a running server instead; start it with VERIFY_SIGNATURE=false and the
+same --db so seeding is visible. SendEmail is left out in that mode, since
+the server would call the real Alexa API with a made-up token.
+
+Before each run the database is grown to the next --db-sizes total (notes
+spread over --users users). p50/p95/p99 latency and throughput are reported
+per intent and DB size and written as JSON to --output; --compare prints the
+p95 change against an earlier results file.
+"""
+import argparse
+import concurrent.futures
+import json
+import math
+import os
+import platform
+import random
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from datetime import datetime, timezone
+
+from ask_sdk_model.services import ApiClient, ApiClientResponse
+
+from tools.smtp_sink import SmtpSink
+
+APPLICATION_ID = "amzn1.ask.skill.loadtest"
+API_ENDPOINT = "https://api.eu.amazonalexa.com"
+PROFILE_EMAIL = "loadtest@example.com"
+ERROR_SPEECH = os.environ.get("MSG_ERROR", "Scusa, ho avuto un problema. Riprova.")
+
+WORDS = ("comprare", "latte", "chiamare", "mario", "domani", "riunione", "alle", "dieci",
+         "ricordarsi", "pagare", "bolletta", "della", "luce", "prenotare", "dentista")
+
+
+class ProfileApiStandIn(ApiClient):
+    """Answers the profile email lookup made by SendEmailIntent without leaving the process."""
+
+    def invoke(self, request):
+        if request.url.endswith("/Profile.email"):
+            return ApiClientResponse(headers=[("Content-Type", "application/json")],
+                                     body=json.dumps(PROFILE_EMAIL), status_code=200)
+        return ApiClientResponse(headers=[], body='{"message": "not found"}', status_code=404)
+
+
+def _timestamp():
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def _intent(name, **slots):
+    return {
+        "name": name,
+        "confirmationStatus": "NONE",
+        "slots": {slot: {"name": slot, "value": value, "confirmationStatus": "NONE"}
+                  for slot, value in slots.items()},
+    }
+
+
+def build_envelope(session, request):
+    """One request envelope for `session` (dict with id, user_id, attributes, new)."""
+    user = {"userId": session["user_id"], "permissions": {"consentToken": "loadtest-consent"}}
+    application = {"applicationId": APPLICATION_ID}
+    request = dict(request, requestId=f"amzn1.echo-api.request.{uuid.uuid4()}",
+                   timestamp=_timestamp(), locale="it-IT")
+    return {
+        "version": "1.0",
+        "session": {
+            "new": session["new"],
+            "sessionId": session["id"],
+            "application": application,
+            "attributes": session["attributes"],
+            "user": user,
+        },
+        "context": {
+            "System": {
+                "application": application,
+                "user": user,
+                "device": {"deviceId": "amzn1.ask.device.loadtest", "supportedInterfaces": {}},
+                "apiEndpoint": API_ENDPOINT,
+                "apiAccessToken": "loadtest-token",
+            }
+        },
+        "request": request,
+    }
+
+
+def session_script(rng, send_email=True):
+    """The requests of one conversation, in order."""
+    script = [{"type": "LaunchRequest"}, {"type": "IntentRequest", "intent": _intent("StartWritingIntent")}]
+    for _ in range(rng.randint(1, 4)):
+        text = " ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 12)))
+        script.append({"type": "IntentRequest", "intent": _intent("CaptureNoteIntent", note=text)})
+    script += [
+        {"type": "IntentRequest", "intent": _intent("FinishIntent")},
+        {"type": "IntentRequest", "intent": _intent("ReadNotesIntent")},
+        {"type": "IntentRequest", "intent": _intent("AMAZON.NextIntent")},
+        {"type": "IntentRequest", "intent": _intent("SetRetentionIntent", days=str(rng.choice((30, 90, 365))))},
+    ]
+    if send_email:
+        script.append({"type": "IntentRequest", "intent": _intent("SendEmailIntent")})
+    script.append({"type": "SessionEndedRequest", "reason": "USER_INITIATED"})
+    return script
+
+
+def _label(request):
+    return request["intent"]["name"] if request["type"] == "IntentRequest" else request["type"]
+
+
+class InProcessTransport:
+    """Posts envelopes to main.app through the Flask test client."""
+
+    def __init__(self):
+        import main  # imported late: the environment must be set up first
+
+        main.skill.api_client = ProfileApiStandIn()
+        self.app = main.app
+        self.send_email = True
+        self._local = threading.local()
+
+    def post(self, body):
+        client = getattr(self._local, "client", None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        response = client.post("/", data=body, content_type="application/json")
+        return response.status_code, response.get_data()
+
+
+class HttpTransport:
+    """Posts envelopes to a running server."""
+
+    def __init__(self, url):
+        self.url = url
+        self.send_email = False
+
+    def post(self, body):
+        req = urllib.request.Request(self.url, data=body, headers={"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(req, timeout=30) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+
+def run_session(transport, user_id, rng, samples):
+    """Play one conversation; appends (label, seconds, ok) to samples."""
+    session = {"id": f"amzn1.echo-api.session.{uuid.uuid4()}", "user_id": user_id, "attributes": {}, "new": True}
+    for request in session_script(rng, transport.send_email):
+        body = json.dumps(build_envelope(session, request)).encode("utf-8")
+        t0 = time.perf_counter()
+        status, raw = transport.post(body)
+        elapsed = time.perf_counter() - t0
+
+        ok = status == 200
+        if ok and raw:
+            try:
+                payload = json.loads(raw)
+            except ValueError:
+                ok = False
+            else:
+                ssml = ((payload.get("response") or {}).get("outputSpeech") or {}).get("ssml", "")
+                ok = ERROR_SPEECH not in ssml
+                session["attributes"] = payload.get("sessionAttributes") or {}
+        samples.append((_label(request), elapsed, ok))
+        session["new"] = False
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(math.ceil(pct / 100 * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+def summarize(samples, wall_seconds, db_size):
+    """Per-intent rows plus an "ALL" row for one run."""
+    by_label = {}
+    for label, elapsed, ok in samples:
+        by_label.setdefault(label, []).append((elapsed, ok))
+    by_label["ALL"] = [(elapsed, ok) for _, elapsed, ok in samples]
+
+    rows = []
+    for label, values in by_label.items():
+        latencies = sorted(elapsed for elapsed, _ in values)
+        rows.append({
+            "db_size": db_size,
+            "intent": label,
+            "requests": len(values),
+            "errors": sum(1 for _, ok in values if not ok),
+            "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+            "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+            "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+            "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3),
+            "throughput_rps": round(len(values) / wall_seconds, 1),
+        })
+    return rows
+
+
+def seed(database, current, target, users, rng):
+    """Grow the notes table from `current` to `target` notes spread over `users` users."""
+    now = int(time.time())
+    batch = []
+    for i in range(current, target):
+        text = " ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 20)))
+        batch.append((text, _user(i % users), now - rng.randint(0, 30 * 86400)))
+        if len(batch) == 5000:
+            database.save_notes_batch(batch)
+            batch = []
+    if batch:
+        database.save_notes_batch(batch)
+
+
+def _user(n):
+    return f"amzn1.ask.account.LOADTEST{n:06d}"
+
+
+def run(transport, sessions, concurrency, users, db_size, rng_seed):
+    samples = []
+    lock = threading.Lock()
+
+    def one(n):
+        rng = random.Random(rng_seed * 1000003 + n)
+        local = []
+        run_session(transport, _user(rng.randrange(users)), rng, local)
+        with lock:
+            samples.extend(local)
+
+    t0 = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for future in [pool.submit(one, n) for n in range(sessions)]:
+            future.result()
+    return summarize(samples, time.perf_counter() - t0, db_size)
+
+
+def print_table(rows):
+    print(f"{'db_size':>9} {'intent':<22} {'reqs':>6} {'err':>4} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'req/s':>8}")
+    for r in rows:
+        print(f"{r['db_size']:>9} {r['intent']:<22} {r['requests']:>6} {r['errors']:>4} "
+              f"{r['p50_ms']:>8.2f} {r['p95_ms']:>8.2f} {r['p99_ms']:>8.2f} {r['throughput_rps']:>8.1f}")
+
+
+def print_comparison(rows, baseline_path):
+    with open(baseline_path) as f:
+        baseline = {(r["db_size"], r["intent"]): r for r in json.load(f)["results"]}
+    print(f"\np95 vs {baseline_path}:")
+    for r in rows:
+        before = baseline.get((r["db_size"], r["intent"]))
+        if before is None or not before["p95_ms"]:
+            continue
+        change = (r["p95_ms"] - before["p95_ms"]) / before["p95_ms"] * 100
+        print(f"{r['db_size']:>9} {r['intent']:<22} {before['p95_ms']:>8.2f} -> {r['p95_ms']:>8.2f} ms ({change:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default=None, help='POST to a running server instead of the in-process app')
+    parser.add_argument('--db', default=None, help='database path (default: a temporary file)')
+    parser.add_argument('--db-sizes', default='0,10000', help='comma-separated total note counts to test at')
+    parser.add_argument('--users', type=int, default=200, help='distinct users in the seeded data and sessions')
+    parser.add_argument('--sessions', type=int, default=200, help='conversations per DB size')
+    parser.add_argument('--concurrency', type=int, default=8, help='conversations in flight at once')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', default='loadtest-results.json')
+    parser.add_argument('--compare', default=None, help='earlier results file to compare p95 against')
+    args = parser.parse_args()
+    sizes = [int(s) for s in args.db_sizes.split(',')]
+
+    with tempfile.TemporaryDirectory() as tmp, SmtpSink(keep_messages=False) as sink:
+        os.environ.update(
+            DB_NAME=args.db or os.path.join(tmp, 'loadtest.db'),
+            VERIFY_SIGNATURE='false',
+            SMTP_SERVER=sink.host,
+            SMTP_PORT=str(sink.port),
+            SMTP_ENCRYPTION='NONE',
+            RETENTION_SWEEP_INTERVAL='0',
+        )
+        import database  # DB_NAME is read at import
+
+        database.init_db()
+        transport = HttpTransport(args.url) if args.url else InProcessTransport()
+
+        rng = random.Random(args.seed)
+        results = []
+        current = database.count_notes()
+        for size in sizes:
+            if size > current:
+                seed(database, current, size, args.users, rng)
+                current = size
+            rows = run(transport, args.sessions, args.concurrency, args.users, size, args.seed)
+            results.extend(rows)
+            print_table(rows)
+            # Sessions add notes too; the next size is topped up from the real count.
+            current = database.count_notes()
+        print(f"\nSMTP sink received {sink.message_count} message(s)")
+
+    report = {
+        "created_at": _timestamp(),
+        "target": args.url or "in-process",
+        "python": platform.python_version(),
+        "sessions": args.sessions,
+        "concurrency": args.concurrency,
+        "users": args.users,
+        "results": results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+    if args.compare:
+        print_comparison(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+"""Minimal local SMTP server that accepts and counts every message.
+
+Stand-in for a real relay when exercising the outbox, digests or load tests:
+
+    python -m tools.smtp_sink --port 8025
+
+then point the skill at it with SMTP_SERVER=127.0.0.1 SMTP_PORT=8025
+SMTP_ENCRYPTION=NONE. Any AUTH credentials are accepted. Use SmtpSink from
+Python to run it in a background thread and inspect received messages.
+"""
+import argparse
+import socketserver
+import threading
+import time
+
+
+class _SmtpSession(socketserver.StreamRequestHandler):
+    def _reply(self, line):
+        self.wfile.write(f"{line}\r\n".encode("ascii"))
+
+    def handle(self):
+        sink = self.server.sink
+        sink.connections += 1
+        self._reply("220 smtp-sink ESMTP ready")
+        mail_from, rcpt_to = None, []
+        while True:
+            raw = self.rfile.readline()
+            if not raw:
+                return
+            line = raw.decode("utf-8", "replace").rstrip("\r\n")
+            verb = line.split(" ", 1)[0].upper()
+            if sink.delay:
+                time.sleep(sink.delay)
+
+            if verb in ("EHLO", "HELO"):
+                self.wfile.write(b"250-smtp-sink\r\n250-AUTH PLAIN LOGIN\r\n250 8BITMIME\r\n")
+            elif verb == "AUTH":
+                parts = line.split()
+                if len(parts) >= 2 and parts[1].upper() == "LOGIN":
+                    if len(parts) == 2:
+                        self._reply("334 VXNlcm5hbWU6")
+                        self.rfile.readline()
+                    self._reply("334 UGFzc3dvcmQ6")
+                    self.rfile.readline()
+                elif len(parts) == 2:
+                    self._reply("334 ")
+                    self.rfile.readline()
+                self._reply("235 2.7.0 Authentication successful")
+            elif verb == "MAIL":
+                mail_from, rcpt_to = line[10:].strip(), []
+                self._reply("250 OK")
+            elif verb == "RCPT":
+                rcpt_to.append(line[8:].strip())
+                self._reply("250 OK")
+            elif verb == "DATA":
+                self._reply("354 End data with <CR><LF>.<CR><LF>")
+                chunks = []
+                while True:
+                    data = self.rfile.readline()
+                    if not data or data in (b".\r\n", b".\n"):
+                        break
+                    chunks.append(data[1:] if data.startswith(b"..") else data)
+                sink.record(mail_from, rcpt_to, b"".join(chunks))
+                self._reply("250 OK queued")
+            elif verb == "RSET":
+                mail_from, rcpt_to = None, []
+                self._reply("250 OK")
+            elif verb == "NOOP":
+                self._reply("250 OK")
+            elif verb == "QUIT":
+                self._reply("221 Bye")
+                return
+            else:
+                self._reply("502 Command not implemented")
+
+
+class _ThreadingServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class SmtpSink:
+    """SMTP sink running in a background thread. `keep_messages=False` only counts them."""
+
+    def __init__(self, host="127.0.0.1", port=0, keep_messages=True, delay=0.0):
+        self.keep_messages = keep_messages
+        self.delay = delay
+        self.messages = []
+        self.message_count = 0
+        self.connections = 0
+        self._lock = threading.Lock()
+        self._server = _ThreadingServer((host, port), _SmtpSession)
+        self._server.sink = self
+        self.host, self.port = self._server.server_address
+        self._thread = None
+
+    def record(self, mail_from, rcpt_to, data):
+        with self._lock:
+            self.message_count += 1
+            if self.keep_messages:
+                self.messages.append((mail_from, rcpt_to, data))
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="smtp-sink", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local SMTP sink.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8025)
+    parser.add_argument("--delay", type=float, default=0.0, help="seconds to wait before each reply (simulates a slow relay)")
+    args = parser.parse_args()
+
+    sink = SmtpSink(args.host, args.port, keep_messages=False, delay=args.delay).start()
+    print(f"SMTP sink listening on {sink.host}:{sink.port}")
+    try:
+        while True:
+            time.sleep(5)
+            print(f"connections={sink.connections} messages={sink.message_count}")
+    except KeyboardInterrupt:
+        sink.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,407 @@
+"""Run the same storage checks against every database backend.
+
+Usage: python -m tools.storage_conformance [--postgres postgresql://localhost/blocco_note]
+
+Always checks a throwaway SQLite file; with --postgres, also checks a fresh
+schema created (and dropped afterwards) in that database. Each check drives
+the public database.* functions with the backend swapped in and the user
+cache disabled, so what is compared is the storage layer alone. Exits
+non-zero if any check fails on any backend.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import traceback
+import uuid
+
+import cache
+import database
+import notes_cli
+
+USER = "amzn1.ask.account.CONFORMANCE"
+OTHER = "amzn1.ask.account.OTHER"
+DAY = 86400
+
+
+def check_notes_roundtrip():
+    database.save_note("prima nota", USER)
+    database.save_notes_batch([("seconda", USER, int(time.time()) + 1), ("altrui", OTHER, int(time.time()) + 1)])
+    assert database.has_notes(USER) and not database.has_notes("amzn1.ask.account.NOBODY")
+    assert [n[0] for n in database.get_notes(USER)] == ["seconda", "prima nota"]
+    assert [n[0] for n in database.get_all_notes(USER)] == ["seconda", "prima nota"]
+    assert [n[0] for n in database.get_all_notes(OTHER)] == ["altrui"]
+    assert database.count_notes() == 3
+
+
+def check_long_notes():
+    # Long enough to be stored compressed by backends that do that.
+    long_note = "ricordarsi di comprare il latte e di chiamare la nonna alle cinque, " * 40 + "ombrello"
+    database.save_notes_batch([(long_note, USER, int(time.time())), ("breve", USER, int(time.time()) - 1)])
+    assert [n[0] for n in database.get_notes(USER)] == [long_note, "breve"]
+    assert [n[0] for n in database.iter_all_notes(USER)] == [long_note, "breve"]
+    assert [row[0] for row in database.search_notes(USER, "ombrello", 5)] == [long_note]
+    database.delete_expired_notes(USER, int(time.time()) + 1, batch_size=10)
+    assert not database.has_notes(USER) and database.search_notes(USER, "ombrello", 5) == []
+
+
+def check_keyset_pagination():
+    now = int(time.time())
+    # Same timestamp for several notes: the id breaks the tie.
+    database.save_notes_batch([(f"nota {i}", USER, now - i // 3) for i in range(10)])
+    seen, before = [], None
+    while True:
+        page = database.get_notes_page(USER, before, 4)
+        if not page:
+            break
+        seen += [row[0] for row in page]
+        before = (page[-1][1], page[-1][2])
+    assert seen == [row[0] for row in database.get_all_notes(USER)], seen
+    assert len(seen) == 10
+
+
+def check_streaming_export():
+    now = int(time.time())
+    database.save_notes_batch([(f"export {i}", USER, now - i) for i in range(1200)])
+    streamed = list(database.iter_all_notes(USER, batch_size=100))
+    assert streamed == [tuple(row) for row in database.get_all_notes(USER)]
+    assert len(streamed) == 1200
+    # Abandoning the stream halfway must hand the connection back.
+    stream = database.iter_all_notes(USER, batch_size=100)
+    next(stream)
+    stream.close()
+    assert database.has_notes(USER)
+
+
+def check_retention():
+    now = int(time.time())
+    database.save_notes_batch([("vecchia", USER, now - 40 * DAY), ("vecchissima", USER, now - 400 * DAY),
+                               ("recente", USER, now - DAY), ("altrui vecchia", OTHER, now - 40 * DAY)])
+    assert database.get_retention_days(USER) is None
+    database.set_retention_days(USER, 90)
+    database.set_retention_days(USER, 30)
+    assert database.get_retention_days(USER) == 30
+    assert database.delete_expired_notes(USER, database.retention_cutoff(30, now), batch_size=1) == 1
+    assert database.delete_expired_notes(USER, database.retention_cutoff(30, now), batch_size=1) == 1
+    assert database.delete_expired_notes(USER, database.retention_cutoff(30, now), batch_size=1) == 0
+    assert [n[0] for n in database.get_all_notes(USER)] == ["recente"]
+    assert [n[0] for n in database.get_all_notes(OTHER)] == ["altrui vecchia"]
+    assert database.cleanup_old_notes(OTHER) == 0
+    for days in (0, -1):
+        try:
+            database.set_retention_days(OTHER, days)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError(f"set_retention_days accepted {days} days")
+    # A non-positive period stored before it was rejected never reaches the sweeper.
+    database.backend.set_retention_days(OTHER, 0)
+    assert dict(database.get_retention_settings(None, 10)) == {USER: 30}
+    assert database.cleanup_old_notes(OTHER) == 0
+
+
+def check_global_retention():
+    now = int(time.time())
+    database.save_notes_batch([("tre anni fa", USER, now - 3 * 365 * DAY), ("due anni fa", OTHER, now - 2 * 365 * DAY),
+                               ("ieri", USER, now - DAY), ("un anno fa", OTHER, now - 365 * DAY)])
+    cutoff = database.retention_cutoff(500, now)
+    deleted = 0
+    while True:
+        batch = database.delete_notes_before(cutoff, batch_size=1)
+        deleted += batch
+        if batch < 1:
+            break
+    assert deleted == 2, deleted
+    assert [n[0] for n in database.get_all_notes(USER)] == ["ieri"]
+    assert [n[0] for n in database.get_all_notes(OTHER)] == ["un anno fa"]
+    # Notes can still be written into a month whose partition was dropped.
+    database.save_notes_batch([("importata", USER, now - 3 * 365 * DAY)])
+    assert database.get_all_notes(USER)[-1][0] == "importata"
+
+
+def check_retention_settings_paging():
+    users = [f"amzn1.ask.account.R{i:03d}" for i in range(7)]
+    for i, user_id in enumerate(users):
+        database.set_retention_days(user_id, i + 1)
+    seen, after = [], None
+    while True:
+        page = database.get_retention_settings(after, 3)
+        if not page:
+            break
+        seen += [tuple(row) for row in page]
+        after = page[-1][0]
+    assert seen == [(user_id, i + 1) for i, user_id in enumerate(users)], seen
+
+
+def check_note_users_paging():
+    users = [f"amzn1.ask.account.N{i:03d}" for i in range(7)]
+    database.save_notes_batch([(f"nota {i}", user_id, int(time.time())) for i, user_id in enumerate(users * 2)])
+    seen, after = [], None
+    while True:
+        page = database.get_note_users(after, 3)
+        if not page:
+            break
+        seen += page
+        after = page[-1]
+    assert seen == users, seen
+
+
+def check_render_counts():
+    now = int(time.time())
+    database.save_notes_batch([("una", "render-1", now), ("prima", "render-2", now - 60), ("seconda", "render-2", now)])
+    users = ["render-0", "render-1", "render-2"]
+    with tempfile.TemporaryDirectory() as out_dir:
+        for fmt, header in (("txt", 0), ("csv", 1)):
+            # A file left by an earlier run for a user who no longer has notes is removed.
+            open(os.path.join(out_dir, f"render-0.{fmt}"), "w").close()
+            assert notes_cli._render_chunk(users, out_dir, fmt, 1) == (3, 3), fmt
+            assert not os.path.exists(os.path.join(out_dir, f"render-0.{fmt}")), fmt
+            for user_id, count in (("render-1", 1), ("render-2", 2)):
+                with open(os.path.join(out_dir, f"{user_id}.{fmt}"), encoding="utf-8") as f:
+                    assert len(f.read().splitlines()) == count + header, (fmt, user_id)
+
+
+def check_retention_lease_and_progress():
+    assert database.acquire_retention_lease("a", 60)
+    assert database.acquire_retention_lease("a", 60)
+    assert not database.acquire_retention_lease("b", 60)
+    database.release_retention_lease("b")
+    assert not database.acquire_retention_lease("b", 60)
+    database.release_retention_lease("a")
+    assert database.acquire_retention_lease("b", -1)
+    assert database.acquire_retention_lease("a", 60), "an expired lease can be taken over"
+    database.release_retention_lease("a")
+
+    assert tuple(database.get_retention_progress()) == (None, None, None)
+    database.set_retention_progress(None, started_at=100)
+    database.set_retention_progress("user-5")
+    assert tuple(database.get_retention_progress()) == ("user-5", 100, None)
+    database.set_retention_progress(None, finished_at=200)
+    assert tuple(database.get_retention_progress()) == (None, 100, 200)
+
+
+def check_digests():
+    now = int(time.time())
+    database.set_retention_days("digest-b", 30)
+    database.save_notes_batch([("prima", "digest-a", now - 100), ("dopo 1", "digest-a", now + 10),
+                               ("dopo 2", "digest-a", now + 10), ("dopo 3", "digest-a", now + 20),
+                               ("altro", "digest-b", now + 10)])
+    database.set_digest("digest-a", "daily", "a@example.com", next_at=now, after_ts=now)
+    database.set_digest("digest-b", "weekly", "b@example.com", next_at=now + 5, after_ts=now)
+    database.set_digest("digest-c", "daily", "c@example.com", next_at=now + 1000, after_ts=now)
+    assert tuple(database.get_digest("digest-a")) == ("daily", "a@example.com", now)
+
+    claimed = [tuple(row) for row in database.claim_due_digests(now + 5, 10, 60)]
+    assert claimed == [("digest-a", "daily", "a@example.com", now, now, 0),
+                       ("digest-b", "weekly", "b@example.com", now + 5, now, 0)], claimed
+    assert database.claim_due_digests(now + 5, 10, 60) == [], "claimed users are leased"
+
+    notes = database.get_new_notes([("digest-a", now, 0), ("digest-b", now, 0), ("digest-c", now, 0)], 2)
+    assert sorted(notes) == ["digest-a", "digest-b"], notes
+    assert [row[0] for row in notes["digest-a"]] == ["dopo 1", "dopo 2"], notes
+    last = notes["digest-a"][-1]
+    database.record_digests([("digest-a", now + 86400, last[1], last[2]), ("digest-b", now + 86400, now, 0)])
+    assert [row[0] for row in database.get_new_notes([("digest-a", last[1], last[2])], 10)["digest-a"]] == ["dopo 3"]
+    assert database.claim_due_digests(now + 5, 10, 60) == []
+    cursors = {row[0]: tuple(row)[4:] for row in database.claim_due_digests(now + 86400, 10, 60)}
+    assert cursors == {"digest-a": (last[1], last[2]), "digest-b": (now, 0), "digest-c": (now, 0)}, cursors
+
+    database.set_digest("digest-c", None)
+    assert database.get_digest("digest-c") is None
+    database.record_digests([("digest-c", now, now, 0)])
+    assert database.get_digest("digest-c") is None, "an opted-out user is not rescheduled"
+    database.update_digest_email("digest-b", "b2@example.com")
+    assert database.get_digest("digest-b")[1] == "b2@example.com"
+    database.update_digest_email("digest-c", "c2@example.com")
+    assert database.get_digest("digest-c") is None, "a new address does not resubscribe"
+    database.update_digest_email("digest-b", None)
+    assert database.get_digest("digest-b") is None, "withdrawn consent cancels the digest"
+    settings = dict(database.get_retention_settings(None, 10))
+    assert settings == {"digest-b": 30}, settings
+
+
+def check_outbox():
+    first = database.enqueue_email(USER, "a@example.com", "Le tue note", "corpo")
+    second = database.enqueue_email(USER, "a@example.com", "Esportazione", "", kind="export")
+    claimed = database.claim_emails(10, lease_seconds=60)
+    assert sorted(row[0] for row in claimed) == sorted([first, second])
+    row = next(row for row in claimed if row[0] == second)
+    assert tuple(row[1:]) == ("export", USER, "a@example.com", "Esportazione", "", 1, 0), row
+    assert database.claim_emails(10, lease_seconds=60) == [], "claimed rows are leased"
+
+    database.set_email_parts_sent(second, 2)
+    database.mark_email_failed(second, "timeout", retry_at=0)
+    database.mark_email_sent(first)
+    retry = database.claim_emails(10, lease_seconds=60)
+    assert [(row[0], row[6], row[7]) for row in retry] == [(second, 2, 2)], retry
+    database.mark_email_failed(second, "rejected")
+    assert database.get_email_status(first)["status"] == "sent"
+    status = database.get_email_status(second)
+    assert (status["status"], status["attempts"], status["last_error"]) == ("failed", 2, "rejected")
+    assert database.get_email_status(first + second + 1000) is None
+
+    expired = database.enqueue_email(USER, "b@example.com", "x", "y")
+    assert [row[0] for row in database.claim_emails(1, lease_seconds=-1)] == [expired]
+    assert [row[0] for row in database.claim_emails(1, lease_seconds=60)] == [expired], "lapsed leases are reclaimed"
+
+    # A worker whose lease lapsed (attempt 1) can no longer record anything once attempt 2 owns the email.
+    export = database.enqueue_email(USER, "c@example.com", "Esportazione", "", kind="export")
+    assert [row[6] for row in database.claim_emails(1, lease_seconds=-1)] == [1]
+    assert database.set_email_parts_sent(export, 1, attempt=1, lease_seconds=-1)
+    assert [(row[6], row[7]) for row in database.claim_emails(1, lease_seconds=-1)] == [(2, 1)]
+    assert not database.set_email_parts_sent(export, 2, attempt=1, lease_seconds=60)
+    assert not database.mark_email_sent(export, attempt=1)
+    assert database.set_email_parts_sent(export, 2, attempt=2, lease_seconds=60)
+    assert database.claim_emails(1, lease_seconds=60) == [], "recording a part renews the lease"
+    assert database.mark_email_sent(export, attempt=2)
+    status = database.get_email_status(export)
+    assert (status["status"], status["attempts"]) == ("sent", 2), status
+
+
+def check_drafts():
+    database.create_draft("d1", USER)
+    database.append_draft_fragment("d1", USER, "uno")
+    database.append_draft_fragment("d1", USER, "due")
+    # Another worker may see the first fragment of a draft it did not create.
+    database.append_draft_fragment("d2", OTHER, "solo")
+    assert database.get_draft_fragments("d1") == ["uno", "due"]
+    assert database.get_draft_user("d2") == OTHER
+    assert database.get_draft_user("missing") is None
+    assert set(database.get_stale_drafts(int(time.time()) + 1)) == {"d1", "d2"}
+    assert database.get_stale_drafts(0) == []
+    database.create_draft("d1", USER)
+    assert database.get_draft_fragments("d1") == [], "re-creating a draft starts it empty"
+    database.delete_draft("d2")
+    assert database.get_draft_fragments("d2") == [] and database.get_draft_user("d2") is None
+
+    database.append_draft_fragment("d3", USER, "tre")
+    database.append_draft_fragment("d3", USER, "quattro")
+    assert database.claim_draft("d3", 0) is None, "a draft updated since the cutoff is not claimed"
+    assert database.claim_draft("d3", int(time.time()) + 1) == (USER, ["tre", "quattro"])
+    assert database.claim_draft("d3") is None, "a draft is claimed once"
+    assert database.get_draft_fragments("d3") == []
+
+
+def check_profile_emails():
+    assert database.get_profile_email(USER, 3600) is None
+    database.set_profile_email(USER, "old@example.com")
+    database.set_profile_email(USER, "me@example.com")
+    assert database.get_profile_email(USER, 3600) == "me@example.com"
+    assert database.get_profile_email(USER, -1) is None, "entries older than max_age are ignored"
+    database.delete_profile_email(USER)
+    assert database.get_profile_email(USER, 3600) is None
+
+
+def check_search():
+    now = int(time.time())
+    database.save_notes_batch([
+        ("chiamare il dentista lunedì", USER, now - 3),
+        ("dentista: portare le lastre, il dentista vuole vederle", USER, now - 2),
+        ("comprare latte e pane", USER, now - 1),
+        ("il dentista di un altro utente", OTHER, now),
+    ])
+    results = [row[0] for row in database.search_notes(USER, "dentista", 5)]
+    assert results == ["dentista: portare le lastre, il dentista vuole vederle", "chiamare il dentista lunedì"], results
+    assert [row[0] for row in database.search_notes(USER, "DENT", 5)] == results, "prefix and case"
+    assert [row[0] for row in database.search_notes(USER, "lunedi", 5)] == ["chiamare il dentista lunedì"], "accents"
+    assert [row[0] for row in database.search_notes(USER, "latte pane", 5)] == ["comprare latte e pane"]
+    assert database.search_notes(USER, "latte dentista", 5) == []
+    assert database.search_notes(USER, "' & ! :*", 5) == []
+    assert len(database.search_notes(OTHER, "dentista", 5)) == 1
+
+
+CHECKS = [
+    check_notes_roundtrip,
+    check_long_notes,
+    check_keyset_pagination,
+    check_streaming_export,
+    check_retention,
+    check_global_retention,
+    check_retention_settings_paging,
+    check_note_users_paging,
+    check_render_counts,
+    check_retention_lease_and_progress,
+    check_digests,
+    check_outbox,
+    check_drafts,
+    check_profile_emails,
+    check_search,
+]
+
+
+def _sqlite_factory(tmp):
+    def make():
+        database.close_connections()
+        database.DB_NAME = os.path.join(tmp, f"{uuid.uuid4().hex}.db")
+        return database.SqliteBackend()
+    return make
+
+
+def _postgres_factory(dsn, schemas):
+    import psycopg2
+    import psycopg2.extensions
+
+    import postgres_backend
+
+    admin = psycopg2.connect(dsn)
+    admin.autocommit = True
+
+    def make():
+        schema = f"conformance_{uuid.uuid4().hex[:12]}"
+        with admin.cursor() as cur:
+            cur.execute(f"CREATE SCHEMA {schema}")
+        schemas.append(schema)
+        return postgres_backend.PostgresBackend(
+            psycopg2.extensions.make_dsn(dsn, options=f"-c search_path={schema}"), 1, 4)
+    return make, admin
+
+
+def run_checks(label, make_backend):
+    """Run every check on a fresh, initialized backend. Returns the number of failures."""
+    failures = 0
+    for check in CHECKS:
+        backend = make_backend()
+        database.backend = backend
+        try:
+            backend.init_db()
+            t0 = time.perf_counter()
+            check()
+            print(f"{label:<9} {check.__name__:<38} ok   {(time.perf_counter() - t0) * 1000:7.1f} ms")
+        except Exception:
+            failures += 1
+            print(f"{label:<9} {check.__name__:<38} FAIL")
+            traceback.print_exc()
+        finally:
+            backend.close()
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--postgres', metavar='DSN', help='also check PostgreSQL in a scratch schema of this database')
+    args = parser.parse_args()
+
+    cache.user_cache = cache.NullCache()
+    original = database.backend
+    failures = 0
+    with tempfile.TemporaryDirectory() as tmp:
+        failures += run_checks("sqlite", _sqlite_factory(tmp))
+    if args.postgres:
+        schemas = []
+        make, admin = _postgres_factory(args.postgres, schemas)
+        try:
+            failures += run_checks("postgres", make)
+        finally:
+            with admin.cursor() as cur:
+                for schema in schemas:
+                    cur.execute(f"DROP SCHEMA {schema} CASCADE")
+            admin.close()
+    database.backend = original
+
+    print(f"{failures} failure(s)")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+"""Request signature verification with a shared certificate chain cache.
+
+The SDK's RequestVerifier keeps downloaded chains in a per-instance dict
+that never expires, and still runs the full chain validation (certvalidator
+path building, PEM parsing, expiry and SAN checks) on every request.
+CachingRequestVerifier validates a chain once and then reuses the parsed
+signing certificate until it expires (or VERIFIER_CACHE_TTL passes), so a
+warm request only pays for the RSA signature check.
+
+Downloaded chains are also written to VERIFIER_CACHE_DIR, so the other
+gunicorn workers and later restarts read them from disk instead of fetching
+them from Amazon again; a chain read from disk is validated once per process
+like a downloaded one. prewarm() loads every cached chain (plus any URL in
+VERIFIER_PREWARM_URLS) at startup; with `gunicorn --preload` that happens
+once in the master and the workers inherit the warm cache.
+"""
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+from urllib.request import urlopen
+
+from ask_sdk_webservice_support.verifier import RequestVerifier, VerificationException
+from cryptography.x509 import load_pem_x509_certificate
+
+logger = logging.getLogger(__name__)
+
+VERIFIER_CACHE_DIR = os.environ.get("VERIFIER_CACHE_DIR", os.path.join(tempfile.gettempdir(), "blocco-note-certs"))
+# Upper bound on how long a validated chain is trusted without re-validation.
+VERIFIER_CACHE_TTL = int(os.environ.get("VERIFIER_CACHE_TTL", 24 * 3600))
+VERIFIER_PREWARM_URLS = [u.strip() for u in os.environ.get("VERIFIER_PREWARM_URLS", "").split(",") if u.strip()]
+VERIFIER_FETCH_TIMEOUT = float(os.environ.get("VERIFIER_FETCH_TIMEOUT", 5))
+
+
+def _download(cert_url):
+    with urlopen(cert_url, timeout=VERIFIER_FETCH_TIMEOUT) as response:
+        return response.read()
+
+
+class CachingRequestVerifier(RequestVerifier):
+    """RequestVerifier that caches validated signing certificates by chain URL."""
+
+    def __init__(self, cache_dir=VERIFIER_CACHE_DIR, ttl=VERIFIER_CACHE_TTL, fetch=_download, **kwargs):
+        super().__init__(**kwargs)
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.fetch = fetch
+        self._lock = threading.Lock()
+        # chain URL -> (signing certificate, trusted until epoch seconds)
+        self._validated = {}
+
+    def _path(self, cert_url):
+        return os.path.join(self.cache_dir, hashlib.sha256(cert_url.encode("utf-8")).hexdigest() + ".pem")
+
+    def _read_cached_chain(self, cert_url):
+        try:
+            with open(self._path(cert_url), "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _write_cached_chain(self, cert_url, chain):
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # Write then rename so another worker never reads a partial file.
+            fd, tmp = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(chain)
+            os.replace(tmp, self._path(cert_url))
+            with open(self._path(cert_url) + ".url", "w") as f:
+                f.write(cert_url)
+        except OSError as e:
+            logger.warning(f"Could not write certificate cache for {cert_url}: {e}")
+
+    def _validate(self, cert_url, chain):
+        """Full SDK validation of a chain; returns the signing certificate."""
+        self._validate_cert_chain(chain)
+        end_cert = load_pem_x509_certificate(chain)
+        self._validate_end_certificate(end_cert)
+        return end_cert
+
+    def _retrieve_and_validate_certificate_chain(self, cert_url, x509_backend=None):
+        now = time.time()
+        cached = self._validated.get(cert_url)
+        if cached is not None and now < cached[1]:
+            return cached[0]
+
+        self._validate_certificate_url(cert_url)
+        end_cert = None
+        chain = self._read_cached_chain(cert_url)
+        if chain is not None:
+            try:
+                end_cert = self._validate(cert_url, chain)
+            except (VerificationException, ValueError) as e:
+                # Expired or damaged on disk: fetch a fresh copy below.
+                logger.info(f"Cached certificate chain for {cert_url} rejected: {e}")
+        if end_cert is None:
+            try:
+                chain = self.fetch(cert_url)
+            except (OSError, ValueError) as e:
+                raise VerificationException("Unable to load certificate from URL", e)
+            end_cert = self._validate(cert_url, chain)
+            self._write_cached_chain(cert_url, chain)
+
+        expires = end_cert.not_valid_after_utc.timestamp()
+        with self._lock:
+            self._validated[cert_url] = (end_cert, min(expires, now + self.ttl))
+        return end_cert
+
+    def verify(self, headers, serialized_request_env, deserialized_request_env):
+        if isinstance(serialized_request_env, bytes):
+            serialized_request_env = serialized_request_env.decode("utf-8")
+        super().verify(headers, serialized_request_env, deserialized_request_env)
+
+    def prewarm(self, urls=()):
+        """Validate the chains cached on disk and the given URLs. Returns how many are ready."""
+        urls = list(urls)
+        try:
+            for name in os.listdir(self.cache_dir):
+                if name.endswith(".url"):
+                    with open(os.path.join(self.cache_dir, name)) as f:
+                        urls.append(f.read().strip())
+        except OSError:
+            pass
+        ready = 0
+        for cert_url in dict.fromkeys(urls):
+            try:
+                self._retrieve_and_validate_certificate_chain(cert_url)
+                ready += 1
+            except Exception as e:
+                logger.warning(f"Could not prewarm certificate {cert_url}: {e}")
+        return ready